@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+#
+# ezIBpy: Pythonic Wrapper for IbPy
+# https://github.com/ranaroussi/ezibpy
+#
+# Copyright 2015 Ran Aroussi
+#
+# Licensed under the GNU Lesser General Public License, v3.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.gnu.org/licenses/lgpl-3.0.en.html
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Synthetic-feed benchmark of ezIBpy's message handlers.
+
+Drives ezIBpy.handleServerEvents through a fake Connection (no TWS/IBGW
+needed) with generated messages and reports throughput, per-handler
+latency percentiles and memory growth per message type.
+
+    python benchmarks/handlers.py --count 200000
+    python benchmarks/handlers.py --mix tickPrice=5,updateMktDepth=1 --rate 20000
+"""
+
+import argparse
+import bisect
+import gc
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import ezibpy  # noqa: E402
+from ezibpy.orders import OrderIdAllocator  # noqa: E402
+from ib.opt import message  # noqa: E402
+from ib.ext.Order import Order  # noqa: E402
+
+DEFAULT_MIX = {
+    "tickPrice": 40,
+    "tickSize": 30,
+    "tickString": 10,
+    "tickOptionComputation": 5,
+    "updateMktDepth": 10,
+    "orderStatus": 2,
+    "historicalData": 3,
+}
+
+STOCKS = tuple((symbol, "STK", "SMART", "USD", "", 0.0, "")
+               for symbol in ("AAPL", "MSFT", "IBM", "AMZN", "NVDA"))
+OPTIONS = (("AAPL", "OPT", "SMART", "USD", "20990120", 150.0, "CALL"),
+           ("AAPL", "OPT", "SMART", "USD", "20990120", 150.0, "PUT"))
+
+
+# ---------------------------------------------
+
+class FakeConnection(object):
+    """ stands in for ib.opt.Connection: swallows every outbound request """
+
+    def __init__(self):
+        self.sent = 0
+
+    def registerAll(self, handler):
+        self.handler = handler
+
+    def __getattr__(self, name):
+        def request(*args, **kwargs):
+            self.sent += 1
+        return request
+
+
+# ---------------------------------------------
+
+def create_client(workdir):
+    ib = ezibpy.ezIBpy()
+    ib.ibConn = FakeConnection()
+    ib.connected = True
+
+    # never move the order id high-water mark of a live client
+    ib.orderIdAllocator = OrderIdAllocator(ib.clientId, path=os.path.join(workdir, "bench.oid"))
+
+    contracts = [ib.createContract(contract, wait=False) for contract in STOCKS + OPTIONS]
+    tickerIds = [ib.tickerId(ib.contractString(contract)) for contract in contracts]
+    stocks, options = tickerIds[:len(STOCKS)], tickerIds[len(STOCKS):]
+
+    return ib, stocks, options
+
+
+# ---------------------------------------------
+
+class MessageFactory(object):
+    """ generates realistic-looking messages of every benchmarked type """
+
+    def __init__(self, ib, stocks, options, seed=0):
+        self.ib = ib
+        self.stocks = stocks
+        self.options = options
+        self.random = random.Random(seed)
+        self.price = {tickerId: 100. for tickerId in stocks + options}
+        self.depth = {}
+        self.orders = []
+        self.statuses = {}
+        self.bars = {}
+        self.histReqId = ezibpy.ezibpy.HISTORY_REQID_BASE * 2
+        self.clock = time.time()
+
+    def _price(self, tickerId):
+        self.price[tickerId] = round(self.price[tickerId] + self.random.choice((-.01, 0, .01)), 2)
+        return self.price[tickerId]
+
+    def tickPrice(self):
+        tickerId = self.random.choice(self.stocks)
+        return message.tickPrice(tickerId=tickerId, field=self.random.choice((1, 2, 4)),
+                                 price=self._price(tickerId), canAutoExecute=1)
+
+    def tickSize(self):
+        return message.tickSize(tickerId=self.random.choice(self.stocks),
+                                field=self.random.choice((0, 3, 5, 8)),
+                                size=self.random.randint(1, 500))
+
+    def tickString(self):
+        tickerId = self.random.choice(self.stocks)
+        self.clock += .01
+        value = "%.2f;%d;%d;%d;%.4f;%s" % (self._price(tickerId), self.random.randint(1, 500),
+                                          self.clock * 1000, self.random.randint(1, 10 ** 6),
+                                          self.price[tickerId], "false")
+        return message.tickString(tickerId=tickerId,
+                                  tickType=ezibpy.dataTypes["FIELD_RTVOLUME"], value=value)
+
+    def tickOptionComputation(self):
+        tickerId = self.random.choice(self.options)
+        return message.tickOptionComputation(
+            tickerId=tickerId, field=self.random.choice((10, 11, 12, 13)),
+            impliedVol=.25, delta=.5, optPrice=self._price(tickerId), pvDividend=0.,
+            gamma=.02, vega=.1, theta=-.05, undPrice=self.price[self.stocks[0]])
+
+    def updateMktDepth(self):
+        tickerId = self.random.choice(self.stocks)
+        side = self.random.randint(0, 1)
+        rows = self.depth.setdefault((tickerId, side), 0)
+        position = self.random.randint(0, 9)
+
+        if rows < 10:
+            operation, position = 0, rows
+            self.depth[(tickerId, side)] += 1
+        else:
+            operation = 1
+
+        price = self.price[tickerId] + (.01 * (position + 1) * (1 if side == 0 else -1))
+        return message.updateMktDepth(tickerId=tickerId, position=position,
+                                      operation=operation, side=side,
+                                      price=round(price, 2), size=self.random.randint(1, 500))
+
+    def orderStatus(self):
+        if len(self.orders) < 50:
+            contract = self.ib.contracts[self.random.choice(self.stocks)]
+            orderId = self.ib.placeOrder(contract, Order())
+            self.orders.append(orderId)
+
+        # alternate statuses so messages aren't dropped as duplicates
+        orderId = self.random.choice(self.orders)
+        status = "PreSubmitted" if self.statuses.get(orderId) == "Submitted" else "Submitted"
+        self.statuses[orderId] = status
+        return message.orderStatus(orderId=orderId, status=status, filled=0, remaining=1,
+                                   avgFillPrice=0., permId=orderId, parentId=0,
+                                   lastFillPrice=0., clientId=self.ib.clientId, whyHeld=None)
+
+    def historicalData(self):
+        # 390-bar downloads (one session of 1-min bars), then "finished"
+        reqId = self.histReqId
+        bar = self.bars.get(reqId, 0)
+
+        if bar == 390:
+            self.histReqId += 1
+            date = "finished-%s-%s" % (bar, bar)
+        else:
+            self.bars[reqId] = bar + 1
+            date = time.strftime("%Y%m%d  %H:%M:%S", time.localtime(1500000000 + bar * 60))
+
+        return message.historicalData(reqId=reqId, date=date, open=1., high=2., low=.5,
+                                      close=1.5, volume=100, count=10, WAP=1.2, hasGaps=False)
+
+    def generate(self, mix, count):
+        # weighted choice (random.choices needs Python 3.6)
+        names = list(mix)
+        bounds, total = [], 0.
+        for name in names:
+            total += mix[name]
+            bounds.append(total)
+
+        messages = []
+        for _ in range(count):
+            index = bisect.bisect_right(bounds, self.random.random() * total)
+            messages.append(getattr(self, names[min(index, len(names) - 1)])())
+        return messages
+
+
+# ---------------------------------------------
+
+def percentiles(values):
+    values = np.asarray(values, dtype=np.float64) * 1e6  # secs => us
+    return np.percentile(values, (50, 90, 99)).tolist() + [values.max()]
+
+
+def run_throughput(mix, count, rate, seed, workdir):
+    ib, stocks, options = create_client(workdir)
+    messages = MessageFactory(ib, stocks, options, seed).generate(mix, count)
+
+    latencies = {}
+    handle = ib.handleServerEvents
+    clock = time.perf_counter
+    interval = 1. / rate if rate else 0
+
+    gc.collect()
+    started = clock()
+    for i, msg in enumerate(messages):
+        if interval:
+            wait = started + i * interval - clock()
+            if wait > 0:
+                time.sleep(wait)
+
+        before = clock()
+        handle(msg)
+        latencies.setdefault(msg.typeName, []).append(clock() - before)
+    elapsed = clock() - started
+
+    print("\n%d messages in %.3fs: %.0f msgs/sec%s" % (
+        count, elapsed, count / elapsed, " (paced at %d/sec)" % rate if rate else ""))
+
+    print("\n%-24s %9s %10s %10s %10s %10s" % ("handler latency (us)", "count", "p50", "p90", "p99", "max"))
+    for typeName in sorted(latencies):
+        print("%-24s %9d %10.2f %10.2f %10.2f %10.2f" % (
+            (typeName, len(latencies[typeName])) + tuple(percentiles(latencies[typeName]))))
+
+
+def run_memory(mix, count, seed, workdir):
+    print("\n%-24s %9s %14s %14s" % ("memory growth", "count", "bytes/msg", "total KiB"))
+    for typeName in sorted(mix):
+        ib, stocks, options = create_client(workdir)
+        messages = MessageFactory(ib, stocks, options, seed).generate({typeName: 1}, count)
+
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        for msg in messages:
+            ib.handleServerEvents(msg)
+        del messages
+        gc.collect()
+        growth = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+
+        print("%-24s %9d %14.1f %14.1f" % (typeName, count, growth / count, growth / 1024.))
+
+
+# ---------------------------------------------
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError("unknown message type: %s" % name)
+        mix[name] = float(weight or 1)
+    return mix
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--count", type=int, default=100000,
+                        help="messages in the throughput run (default: %(default)s)")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help="weighted message mix, ie. tickPrice=40,tickSize=30")
+    parser.add_argument("--rate", type=int, default=0,
+                        help="messages/sec to feed (default: as fast as possible)")
+    parser.add_argument("--memory-count", type=int, default=20000,
+                        help="messages per type in the memory run (0 to skip)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="ezibpy-bench-")
+    try:
+        run_throughput(args.mix, args.count, args.rate, args.seed, workdir)
+        if args.memory_count:
+            run_memory(args.mix, args.memory_count, args.seed, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+#
+# ezIBpy: Pythonic Wrapper for IbPy
+# https://github.com/ranaroussi/ezibpy
+#
+# Copyright 2015 Ran Aroussi
+#
+# Licensed under the GNU Lesser General Public License, v3.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.gnu.org/licenses/lgpl-3.0.en.html
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import pickle
+import time
+
+from datetime import datetime
+
+from .utils import private_dir
+
+
+# ---------------------------------------------
+
+class ContractDetailsCache(object):
+    """
+    On-disk cache of contractDetails replies, one pickle per
+    contractString holding the m_* fields of every ContractDetails
+    message received for it.
+
+    Entries older than `ttl` seconds are stale (usable, but should be
+    refreshed). Entries of single contracts that already expired are
+    invalid and get removed.
+
+    Loading a pickle can run code, so `path` must be a private
+    directory: it's created 0700 and refused if others can write to it.
+    """
+
+    def __init__(self, path, ttl=86400):
+        self.path = path
+        self.ttl = ttl
+        private_dir(path)
+
+    # -----------------------------------------
+    def _file(self, contractString):
+        name = "".join(c if c.isalnum() or c in "-." else "_" for c in contractString)
+        return os.path.join(self.path, name + ".pkl")
+
+    # -----------------------------------------
+    @staticmethod
+    def _expiries(details):
+        expiries = []
+        for fields in details:
+            expiry = str(getattr(fields.get("m_summary"), "m_expiry", "") or "")[:8]
+            if expiry.isdigit():
+                expiries.append(expiry)
+        return expiries
+
+    # -----------------------------------------
+    def load(self, contractString):
+        """ returns (details, fresh) or None if missing/invalid """
+        try:
+            with open(self._file(contractString), "rb") as f:
+                entry = pickle.load(f)
+        except Exception:
+            return None
+
+        details = entry["details"]
+        fresh = time.time() - entry["time"] < self.ttl
+
+        expiries = self._expiries(details)
+        if expiries and min(expiries) < datetime.now().strftime("%Y%m%d"):
+            if len(details) == 1:
+                self.remove(contractString)
+                return None
+            fresh = False  # expired sub-contracts: refresh the chain
+
+        return details, fresh
+
+    # -----------------------------------------
+    def save(self, contractString, details):
+        tmp = self._file(contractString) + ".tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump({"time": time.time(), "details": details}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._file(contractString))
+
+    # -----------------------------------------
+    def remove(self, contractString):
+        try:
+            os.remove(self._file(contractString))
+        except OSError:
+            pass
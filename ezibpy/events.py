@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+#
+# ezIBpy: Pythonic Wrapper for IbPy
+# https://github.com/ranaroussi/ezibpy
+#
+# Copyright 2015 Ran Aroussi
+#
+# Licensed under the GNU Lesser General Public License, v3.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.gnu.org/licenses/lgpl-3.0.en.html
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import threading
+
+from collections import deque, OrderedDict
+
+from .utils import dataTypes
+
+
+# ---------------------------------------------
+
+OVERFLOW_POLICIES = ("drop_oldest", "drop_newest", "block")
+
+# callbacks a conflating subscriber merges per tickerId
+CONFLATED_CALLERS = ("handleTickPrice", "handleTickSize")
+
+
+# ---------------------------------------------
+
+class Subscription(object):
+    """
+    A subscriber of the EventBus: a filter, a bounded queue and a
+    worker thread calling `handler(caller, msg, **kwargs)`.
+
+    When the queue is full, `overflow` decides what happens:
+    drop_oldest (default), drop_newest or block (the publisher waits).
+    """
+
+    def __init__(self, handler, callers=None, tickerIds=None, symbols=None,
+                 maxsize=10000, overflow="drop_oldest", name=None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("overflow must be one of %s" % (OVERFLOW_POLICIES,))
+
+        self.handler = handler
+        self.callers = set(callers) if callers is not None else None
+        self.tickerIds = set(tickerIds) if tickerIds is not None else None
+        self.symbols = set(symbols) if symbols is not None else None
+        self.maxsize = maxsize
+        self.overflow = overflow
+
+        self.delivered = 0
+        self.dropped = 0
+        self.errors = 0
+
+        self.log = logging.getLogger('ezibpy')
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._running = True
+
+        self._thread = threading.Thread(target=self._run,
+            name=name or "ezibpy-subscriber-%s" % getattr(handler, "__name__", id(handler)))
+        self._thread.daemon = True
+        self._thread.start()
+
+    # -----------------------------------------
+    def matches(self, caller, tickerId, symbol):
+        if self.callers is not None and caller not in self.callers:
+            return False
+        if self.tickerIds is not None and tickerId not in self.tickerIds:
+            return False
+        if self.symbols is not None and symbol() not in self.symbols:
+            return False
+        return True
+
+    # -----------------------------------------
+    def put(self, event):
+        with self._cond:
+            if not self._running:
+                return
+
+            if len(self._queue) >= self.maxsize:
+                if self.overflow == "drop_newest":
+                    self.dropped += 1
+                    return
+                elif self.overflow == "drop_oldest":
+                    self._queue.popleft()
+                    self.dropped += 1
+                else:
+                    while self._running and len(self._queue) >= self.maxsize:
+                        self._cond.wait()
+
+            self._queue.append(event)
+            self._cond.notify_all()
+
+    # -----------------------------------------
+    def pending(self):
+        return len(self._queue)
+
+    # -----------------------------------------
+    def _take(self):
+        """ next event (blocking), None once closed """
+        with self._cond:
+            while self._running and not self._queue:
+                self._cond.wait()
+            if not self._queue:
+                return None
+            event = self._queue.popleft()
+            self._cond.notify_all()
+            return event
+
+    # -----------------------------------------
+    def _run(self):
+        while True:
+            event = self._take()
+            if event is None:
+                return
+
+            caller, msg, kwargs = event
+            try:
+                self.handler(caller, msg, **kwargs)
+                self.delivered += 1
+            except Exception as e:
+                self.errors += 1
+                self.log.exception("[SUBSCRIBER ERROR] %s: %s", self._thread.name, e)
+
+    # -----------------------------------------
+    def close(self, wait=False):
+        """ stops the worker (after draining the queue if `wait`) """
+        with self._cond:
+            if wait:
+                while self._queue:
+                    self._cond.wait()
+            self._running = False
+            self._queue.clear()
+            self._cond.notify_all()
+
+
+# ---------------------------------------------
+
+def tick_field_name(caller, msg):
+    """ marketData column name of a tickPrice/tickSize field """
+    field = getattr(msg, "field", None)
+    if caller == "handleTickPrice":
+        return dataTypes["PRICE_TICKS"].get(field, field)
+    if caller == "handleTickSize":
+        name = dataTypes["SIZE_TICKS"].get(field)
+        return field if name is None else name if name == "volume" else name + "size"
+    return field
+
+
+# ---------------------------------------------
+
+class ConflatingSubscription(Subscription):
+    """
+    Subscription that keeps only the latest value per tickerId and
+    field for `conflate` callbacks (tickPrice/tickSize by default).
+
+    A backlog of those is merged into one call per tickerId:
+    `handler(caller, msg, fields={"bid": .., "asksize": ..}, conflated=n)`
+    where caller/msg are the latest ones and n the number of messages
+    merged. Other callbacks (orders, errors, ...) are queued in order.
+    Queue depth is bounded by the number of tickerIds, not the tick rate.
+    """
+
+    def __init__(self, handler, conflate=CONFLATED_CALLERS, **kwargs):
+        self.conflate = frozenset(conflate)
+        self._latest = OrderedDict()  # tickerId => [caller, msg, fields, count]
+        Subscription.__init__(self, handler, **kwargs)
+
+    # -----------------------------------------
+    def put(self, event):
+        caller, msg, kwargs = event
+        tickerId = getattr(msg, "tickerId", None)
+        if caller not in self.conflate or tickerId is None:
+            return Subscription.put(self, event)
+
+        with self._cond:
+            if not self._running:
+                return
+
+            latest = self._latest.get(tickerId)
+            if latest is None:
+                latest = self._latest[tickerId] = [caller, msg, {}, 0]
+            else:
+                latest[0], latest[1] = caller, msg
+                self.dropped += 1  # merged away
+
+            value = getattr(msg, "price", getattr(msg, "size", None))
+            latest[2][tick_field_name(caller, msg)] = value
+            latest[3] += 1
+            self._cond.notify_all()
+
+    # -----------------------------------------
+    def pending(self):
+        return len(self._queue) + len(self._latest)
+
+    # -----------------------------------------
+    def _take(self):
+        with self._cond:
+            while self._running and not self._queue and not self._latest:
+                self._cond.wait()
+
+            if self._queue:
+                event = self._queue.popleft()
+            elif self._latest:
+                _, (caller, msg, fields, count) = self._latest.popitem(last=False)
+                event = (caller, msg, {"fields": fields, "conflated": count})
+            else:
+                return None
+
+            self._cond.notify_all()
+            return event
+
+    # -----------------------------------------
+    def close(self, wait=False):
+        with self._cond:
+            if wait:
+                while self._queue or self._latest:
+                    self._cond.wait()
+            self._latest.clear()
+        Subscription.close(self, wait)
+
+
+# ---------------------------------------------
+
+class EventBus(object):
+    """
+    Publish/subscribe dispatch of ezIBpy callbacks.
+
+    publish() only filters and enqueues, so it's safe to call from
+    IbPy's reader thread; each subscriber runs on its own thread.
+    """
+
+    def __init__(self):
+        self.subscriptions = ()  # replaced (never mutated) => lock-free reads
+        self._lock = threading.Lock()
+
+    # -----------------------------------------
+    def subscribe(self, handler, conflate=False, **kwargs):
+        """ conflate: True (tickPrice/tickSize) or a list of callers to conflate """
+        if isinstance(handler, Subscription):
+            subscription = handler
+        elif conflate:
+            callers = CONFLATED_CALLERS if conflate is True else conflate
+            subscription = ConflatingSubscription(handler, conflate=callers, **kwargs)
+        else:
+            subscription = Subscription(handler, **kwargs)
+        with self._lock:
+            self.subscriptions = self.subscriptions + (subscription,)
+        return subscription
+
+    # -----------------------------------------
+    def unsubscribe(self, subscription, wait=False):
+        with self._lock:
+            self.subscriptions = tuple(s for s in self.subscriptions if s is not subscription)
+        subscription.close(wait)
+
+    # -----------------------------------------
+    def publish(self, caller, msg, tickerId=None, symbol=None, **kwargs):
+        """ `symbol` is a callable, only resolved if a subscriber filters on it """
+        subscriptions = self.subscriptions
+        if not subscriptions:
+            return
+
+        resolved = []
+
+        def resolve():
+            if not resolved:
+                resolved.append(symbol() if symbol is not None else None)
+            return resolved[0]
+
+        for subscription in subscriptions:
+            if subscription.matches(caller, tickerId, resolve):
+                subscription.put((caller, msg, kwargs))
+
+    # -----------------------------------------
+    def close(self, wait=False):
+        with self._lock:
+            subscriptions, self.subscriptions = self.subscriptions, ()
+        for subscription in subscriptions:
+            subscription.close(wait)
@@ -20,22 +20,43 @@
 
 import atexit
 import os
-import tempfile
+import threading
 import time
 import logging
 import sys
 
-from datetime import datetime
-from pandas import DataFrame, read_pickle
-from stat import S_IWRITE
+from concurrent.futures import Future
+from datetime import datetime, timedelta
 
-from ib.opt import Connection
+from ib.opt import Connection, message
 from ib.ext.Contract import Contract
+from ib.ext.ContractDetails import ContractDetails
 from ib.ext.Order import Order
 from ib.ext.ComboLeg import ComboLeg
 
 from .utils import (
-    dataTypes, createLogger, local_to_utc
+    dataTypes, createLogger, local_to_utc, ServerClock, DATA_DIR, private_dir
+)
+from .contracts import ContractDetailsCache
+from .journal import (
+    MessageJournal, OfflineConnection, replay_journal, CONTRACT_RECORD
+)
+from .events import EventBus
+from .lanes import PriorityLanes, ACCOUNT_LANE, MARKET_DATA_LANE
+from .pacing import PacedConnection
+from .lines import MarketDataLines
+from .orders import (
+    OrderIdAllocator, OrderIndex, OrderRecord, OrderArchive,
+    INDEXED_ORDER_FIELDS, TERMINAL_ORDER_STATUSES, ORDER_ID_BLOCK_SIZE
+)
+from .history import (
+    BarBuffer, HistoricalScheduler, HistoryCache, HISTORY_ERROR_CODES,
+    claimable_ranges, duration_to_seconds, frame_to_local, frame_to_utc,
+    from_utc, history_chunks, parse_bar_date, parse_end_datetime, seconds_to_duration,
+    stitch_bars, to_utc
+)
+from .marketdata import (
+    QuoteBoard, TickHistory, DepthBoard, QUOTE_FIELDS, OPTION_FIELDS
 )
 
 import copy
@@ -50,6 +71,10 @@ if sys.version_info < (3, 4):
 createLogger('ezibpy')
 # ---------------------------------------------
 
+# reqIds of historical data requests start here
+# (so they never collide with tickerIds)
+HISTORY_REQID_BASE = 100000000
+
 
 class ezIBpy():
 
@@ -67,23 +92,38 @@ class ezIBpy():
         self.port      = 4001  # 7496/7497 = TWS, 4001 = IBGateway
         self.host      = "localhost"
         self.ibConn    = None
+        self.pacing    = {"rate": 40, "burst": 10}  # outgoing msgs/sec (see PacedConnection)
         self.connected = False
 
         self.time        = 0
+        self.clock       = ServerClock()
         self.commission  = 0
         self.accountCode = 0
         self.orderId     = 1
+        self.orderIdBlockSize = ORDER_ID_BLOCK_SIZE  # ids reserved on disk at a time
+        self.orderIdAllocator = OrderIdAllocator(self.clientId, blockSize=self.orderIdBlockSize)
 
         # auto-construct for every contract/order
         self.tickerIds     = {0: "SYMBOL"}
+        self._tickerSymbols = {"SYMBOL": 0}  # reverse index of tickerIds
+        self._nextTickerId  = 1
         self.contracts     = {}
         self.orders        = {}
-        self.symbol_orders = {}
+        self.orderIndex    = OrderIndex()
+        self.orderArchive  = None
+        self.journal       = None
+        self.lanes         = None  # see enablePriorityLanes()
+        self.events        = EventBus()
+        self.symbol_orders = self.orderIndex.bySymbol
         self.account       = {}
         self.positions     = {}
         self.portfolio     = {}
 
         self._contract_details = {}  # multiple expiry/strike/side contracts
+        self._contractDetailsWaiters = {}  # idx = reqId, threading.Event
+        self._contractDetailsPending = {}  # reqId => contractString, awaiting contractDetailsEnd
+        self._contractDetailsReplies = {}  # idx = reqId, raw replies to cache
+        self.contractDetailsCache = None  # see enableContractDetailsCache()
         self.contract_details  = {}
         self.localSymbolExpiry = {}
 
@@ -92,19 +132,16 @@ class ezIBpy():
         # -------------------------------------
 
         # holds market data
-        tickDF = DataFrame({
-            "datetime": [0], "bid": [0], "bidsize": [0],
-            "ask": [0], "asksize": [0], "last": [0], "lastsize": [0]
-        })
-        tickDF.set_index('datetime', inplace=True)
-        self.marketData = {0: tickDF}  # idx = tickerId
+        self.marketData = QuoteBoard(QUOTE_FIELDS)  # idx = tickerId
+
+        # holds last N RTVOLUME ticks per tickerId (see enableTickHistory)
+        self.tickHistory = None
 
         # holds orderbook data
-        l2DF = DataFrame(index=range(5), data={
-            "bid": 0, "bidsize": 0,
-            "ask": 0, "asksize": 0
-        })
-        self.marketDepthData = {0: l2DF}  # idx = tickerId
+        self.marketDepthData = DepthBoard()  # idx = tickerId
+
+        # multiplexes market data lines (see enableMarketDataLines)
+        self.marketDataLines = None
 
         # trailing stops
         self.trailingStops = {}
@@ -128,28 +165,22 @@ class ezIBpy():
         # }
 
         # holds options data
-        optionsDF = DataFrame({
-            "datetime": [0], "oi": [0], "volume": [0], "underlying": [0], "iv": [0],
-            "bid": [0], "bidsize": [0], "ask": [0], "asksize": [0], "last": [0], "lastsize": [0],
-            # opt field
-            "price": [0], "dividend": [0], "imp_vol": [0], "delta": [0],
-            "gamma": [0], "vega": [0], "theta": [0],
-            "last_price": [0], "last_dividend": [0], "last_imp_vol": [0], "last_delta": [0],
-            "last_gamma": [0], "last_vega": [0], "last_theta": [0],
-            "bid_price": [0], "bid_dividend": [0], "bid_imp_vol": [0], "bid_delta": [0],
-            "bid_gamma": [0], "bid_vega": [0], "bid_theta": [0],
-            "ask_price": [0], "ask_dividend": [0], "ask_imp_vol": [0], "ask_delta": [0],
-            "ask_gamma": [0], "ask_vega": [0], "ask_theta": [0],
-        })
-        optionsDF.set_index('datetime', inplace=True)
-        self.optionsData = {0: optionsDF}  # idx = tickerId
+        self.optionsData = QuoteBoard(OPTION_FIELDS)  # idx = tickerId
 
         # historical data contrainer
         self.historicalData = {}  # idx = symbol
-        self.utc_history = False
+        self._historyRequests = {}  # idx = reqId, per-download state
+        self._historyJobs = {}  # idx = tickerId, chunked downloads
+        self._nextHistoryReqId = HISTORY_REQID_BASE
+        self.historyScheduler = HistoricalScheduler(self._sendHistoryRequest)
+        self.historyCache = None  # see enableHistoryCache()
+
+        # msg.typeName => handlers
+        self._buildDispatcher()
 
         # register exit
         atexit.register(self.disconnect)
+        atexit.register(self.stopRecording)
 
         # fire connected/disconnected callbacks/errors once per event
         self.connection_tracking = {
@@ -160,7 +191,10 @@ class ezIBpy():
 
     # -----------------------------------------
     def log_msg(self, title, msg):
-        # log handler msg
+        # log handler msg (skip formatting altogether unless logged)
+        if not self.log.isEnabledFor(logging.INFO):
+            return
+
         logmsg = copy.copy(msg)
         if hasattr(logmsg, "contract"):
             logmsg.contract = self.contractString(logmsg.contract)
@@ -169,22 +203,30 @@ class ezIBpy():
     # -----------------------------------------
     def connect(self, clientId=0, host="localhost", port=4001):
         """ Establish connection to TWS/IBGW """
+        if clientId != self.clientId or \
+                self.orderIdAllocator.blockSize != self.orderIdBlockSize:
+            self.orderIdAllocator = OrderIdAllocator(clientId, blockSize=self.orderIdBlockSize)
+
         self.clientId = clientId
         self.host = host
         self.port = port
-        self.ibConn = Connection.create(
+        self.ibConn = PacedConnection(Connection.create(
             host=self.host,
             port=int(self.port),
             clientId=self.clientId
-        )
+        ), onDropped=self._requestDropped, **self.pacing)
 
         # Assign server messages handling function.
-        self.ibConn.registerAll(self.handleServerEvents)
+        self.ibConn.registerAll(self.receiveServerEvent)
 
         # connect
         self.log.info("[CONNECTING TO IB]")
         self.ibConn.connect()
 
+        # re-request streaming lines
+        if self.marketDataLines is not None:
+            self.marketDataLines.reset()
+
         # get server time
         self.getServerTime()
 
@@ -214,9 +256,30 @@ class ezIBpy():
             self.connect(self.clientId, self.host, self.port)
             time.sleep(1)
 
+    # -----------------------------------------
+    def _requestDropped(self, name, args, kwargs):
+        """ a queued request was discarded by disconnect() """
+        if name == "placeOrder":
+            orderId = args[0] if args else kwargs.get("id")
+            if orderId in self.orders and self.orders[orderId]["status"] == "SENT":
+                self._updateOrder(orderId, status="DROPPED",
+                                  reason="disconnected before the order was sent")
+            self.log.error("[ORDER NOT SENT] #%s dropped on disconnect", orderId)
+        elif name == "cancelOrder":
+            self.log.error("[CANCEL NOT SENT] #%s dropped on disconnect",
+                           args[0] if args else kwargs.get("id"))
+
+    # -----------------------------------------
+    def pacingStats(self):
+        """ outgoing request pacer metrics (see PacedConnection.stats) """
+        if self.ibConn is None:
+            return {}
+        return self.ibConn.stats()
+
     # -----------------------------------------
     def getServerTime(self):
         """ get the current time on IB """
+        self.clock.requested()
         self.ibConn.reqCurrentTime()
 
     # -----------------------------------------
@@ -246,7 +309,8 @@ class ezIBpy():
 
         if self.getConId(contract) == 0:
             contract_tuple = self.contract_to_tuple(contract)
-            self.createContract(contract_tuple)
+            # called from the reader thread: don't wait for the details
+            self.createContract(contract_tuple, wait=False)
 
     # -----------------------------------------
     # Start event handlers
@@ -254,6 +318,24 @@ class ezIBpy():
     def handleErrorEvents(self, msg):
         """ logs error messages """
         # https://www.interactivebrokers.com/en/software/api/apiguide/tables/api_message_codes.htm
+        history = self._historyRequests.get(msg.id)
+        if history is not None and msg.errorCode in HISTORY_ERROR_CODES:
+            self.handleHistoricalDataError(msg)
+
+        # no contract details coming (ie. #200 no security definition)
+        if msg.id in self._contractDetailsPending and msg.errorCode in (200, 321):
+            self._contractDetailsPending.pop(msg.id, None)
+            self._contractDetailsReplies.pop(msg.id, None)
+            if msg.id in self._contractDetailsWaiters:
+                self._contractDetailsWaiters.pop(msg.id).set()
+
+        # out of market data lines / depth slots
+        if self.marketDataLines is not None:
+            if msg.errorCode == 101:
+                self.marketDataLines.lineRejected(msg.id)
+            elif msg.errorCode == 309:
+                self.marketDataLines.depthRejected(msg.id)
+
         if msg.errorCode is not None and msg.errorCode != -1 and \
                 msg.errorCode not in dataTypes["BENIGN_ERROR_CODES"]:
 
@@ -268,91 +350,241 @@ class ezIBpy():
 
             if log:
                 self.log.error("[#%s] %s" % (msg.errorCode, msg.errorMsg))
-                self.ibCallback(caller="handleError", msg=msg)
+                if history is not None:
+                    self._callback(caller="handleError", msg=msg,
+                                   tickerId=history["job"].get("tickerId"))
+                else:
+                    self._callback(caller="handleError", msg=msg)
 
     # -----------------------------------------
-    def handleServerEvents(self, msg):
-        """ dispatch msg to the right handler """
+    def receiveServerEvent(self, msg):
+        """ called by IbPy's reader thread for every inbound msg """
+        if self.journal is not None:
+            self.journal.record(msg)
 
-        self.log.debug('MSG %s', msg)
-        self.handleConnectionState(msg)
+        if self.lanes is not None:
+            self.lanes.put(msg)
+        else:
+            self.handleServerEvents(msg)
 
-        if msg.typeName == "error":
-            self.handleErrorEvents(msg)
+    # -----------------------------------------
+    def enablePriorityLanes(self, lanes=None):
+        """
+        Dispatches inbound messages from a separate thread, by priority:
+        orders/errors/connection, then account/positions, then market
+        data, so order updates never wait behind a burst of ticks.
+        `lanes` overrides the lane of a msg.typeName, ie. {"tickPrice": 1}
+        """
+        if self.lanes is None:
+            self.lanes = PriorityLanes(self.handleServerEvents, lanes, route=self._messageLane)
+        return self.lanes
 
-        elif msg.typeName == dataTypes["MSG_CURRENT_TIME"]:
-            if self.time < msg.time:
-                self.time = msg.time
+    # -----------------------------------------
+    def _messageLane(self, msg):
+        """ errors of data requests queue behind that request's data """
+        if msg.typeName != "error" or msg.id is None:
+            return None
+        if msg.id >= HISTORY_REQID_BASE:
+            return MARKET_DATA_LANE  # with the historicalData bars
+        if msg.id in self._contractDetailsPending:
+            return ACCOUNT_LANE  # with the contractDetails replies
+        return None
 
-        elif (msg.typeName == dataTypes["MSG_TYPE_MKT_DEPTH"] or
-                msg.typeName == dataTypes["MSG_TYPE_MKT_DEPTH_L2"]):
-            self.handleMarketDepth(msg)
+    # -----------------------------------------
+    def disablePriorityLanes(self, wait=True):
+        """ back to dispatching on IbPy's reader thread """
+        lanes, self.lanes = self.lanes, None
+        if lanes is not None:
+            lanes.close(wait)
 
-        elif msg.typeName == dataTypes["MSG_TYPE_TICK_STRING"]:
-            self.handleTickString(msg)
+    # -----------------------------------------
+    def handleServerEvents(self, msg):
+        """ dispatch msg to the right handler """
 
-        elif msg.typeName == dataTypes["MSG_TYPE_TICK_PRICE"]:
-            self.handleTickPrice(msg)
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug('MSG %s', msg)
+        self.handleConnectionState(msg)
 
-        elif msg.typeName == dataTypes["MSG_TYPE_TICK_GENERIC"]:
-            self.handleTickGeneric(msg)
+        handlers = self._dispatcher.get(msg.typeName)
+        if handlers is None:
+            # log handler msg
+            self.log_msg("server", msg)
+            return
 
-        elif msg.typeName == dataTypes["MSG_TYPE_TICK_SIZE"]:
-            self.handleTickSize(msg)
+        for handler in handlers:
+            handler(msg)
+
+    # -----------------------------------------
+    def _buildDispatcher(self):
+        """ maps every msg.typeName to its built-in handler """
+        self._builtinHandlers = {
+            "error":                                 self.handleErrorEvents,
+            dataTypes["MSG_CURRENT_TIME"]:           self.handleCurrentTime,
+            dataTypes["MSG_TYPE_MKT_DEPTH"]:         self.handleMarketDepth,
+            dataTypes["MSG_TYPE_MKT_DEPTH_L2"]:      self.handleMarketDepth,
+            dataTypes["MSG_TYPE_TICK_STRING"]:       self.handleTickString,
+            dataTypes["MSG_TYPE_TICK_PRICE"]:        self.handleTickPrice,
+            dataTypes["MSG_TYPE_TICK_GENERIC"]:      self.handleTickGeneric,
+            dataTypes["MSG_TYPE_TICK_SIZE"]:         self.handleTickSize,
+            dataTypes["MSG_TYPE_TICK_OPTION"]:       self.handleTickOptionComputation,
+            dataTypes["MSG_TYPE_OPEN_ORDER"]:        self.handleOrders,
+            dataTypes["MSG_TYPE_OPEN_ORDER_END"]:    self.handleOrders,
+            dataTypes["MSG_TYPE_ORDER_STATUS"]:      self.handleOrders,
+            dataTypes["MSG_TYPE_HISTORICAL_DATA"]:   self.handleHistoricalData,
+            dataTypes["MSG_TYPE_ACCOUNT_UPDATES"]:   self.handleAccount,
+            dataTypes["MSG_TYPE_PORTFOLIO_UPDATES"]: self.handlePortfolio,
+            dataTypes["MSG_TYPE_POSITION"]:          self.handlePosition,
+            dataTypes["MSG_TYPE_NEXT_ORDER_ID"]:     self.handleNextValidIdMsg,
+            dataTypes["MSG_CONNECTION_CLOSED"]:      self.handleConnectionClosed,
+            dataTypes["MSG_TYPE_MANAGED_ACCOUNTS"]:  self.handleManagedAccounts,
+            dataTypes["MSG_COMMISSION_REPORT"]:      self.handleCommissionReport,
+            dataTypes["MSG_CONTRACT_DETAILS"]:       self.handleContractDetails,
+            dataTypes["MSG_CONTRACT_DETAILS_END"]:   self.handleContractDetailsEnd,
+            dataTypes["MSG_TICK_SNAPSHOT_END"]:      self.handleTickSnapshotEnd,
+        }
+        self._extraHandlers = {}
+        self._dispatcher = {typeName: (handler,)
+                            for typeName, handler in self._builtinHandlers.items()}
 
-        elif msg.typeName == dataTypes["MSG_TYPE_TICK_OPTION"]:
-            self.handleTickOptionComputation(msg)
+    # -----------------------------------------
+    def _rebuildDispatcher(self, typeName):
+        handlers = []
+        if typeName in self._builtinHandlers:
+            handlers.append(self._builtinHandlers[typeName])
+        handlers.extend(self._extraHandlers.get(typeName, []))
 
-        elif (msg.typeName == dataTypes["MSG_TYPE_OPEN_ORDER"] or
-                msg.typeName == dataTypes["MSG_TYPE_OPEN_ORDER_END"] or
-                msg.typeName == dataTypes["MSG_TYPE_ORDER_STATUS"]):
-            self.handleOrders(msg)
+        if handlers:
+            self._dispatcher[typeName] = tuple(handlers)
+        else:
+            self._dispatcher.pop(typeName, None)
 
-        elif msg.typeName == dataTypes["MSG_TYPE_HISTORICAL_DATA"]:
-            self.handleHistoricalData(msg)
+    # -----------------------------------------
+    def registerHandler(self, typeName, handler):
+        """
+        register an extra handler for msg.typeName (ie. "tickPrice").
+        extra handlers run after the built-in one, in registration order
+        """
+        handlers = self._extraHandlers.setdefault(typeName, [])
+        if handler not in handlers:
+            handlers.append(handler)
+        self._rebuildDispatcher(typeName)
 
-        elif msg.typeName == dataTypes["MSG_TYPE_ACCOUNT_UPDATES"]:
-            self.handleAccount(msg)
+    # -----------------------------------------
+    def unregisterHandler(self, typeName, handler=None):
+        """ remove an extra handler (or all extra handlers) for msg.typeName """
+        if handler is None:
+            self._extraHandlers.pop(typeName, None)
+        elif handler in self._extraHandlers.get(typeName, []):
+            self._extraHandlers[typeName].remove(handler)
+        self._rebuildDispatcher(typeName)
 
-        elif msg.typeName == dataTypes["MSG_TYPE_PORTFOLIO_UPDATES"]:
-            self.handlePortfolio(msg)
+    # -----------------------------------------
+    # generic callback function - can be used externally
+    # -----------------------------------------
+    def ibCallback(self, caller, msg, **kwargs):
+        pass
 
-        elif msg.typeName == dataTypes["MSG_TYPE_POSITION"]:
-            self.handlePosition(msg)
+    # -----------------------------------------
+    def _callback(self, caller, msg, **kwargs):
+        """
+        fires ibCallback (synchronously) and publishes to subscribers.
+        a `tickerId` kwarg overrides the msg's own (ie. history reqIds)
+        """
+        self.ibCallback(caller=caller, msg=msg, **kwargs)
+
+        if self.events.subscriptions:
+            tickerId = kwargs.pop("tickerId", None)
+            if tickerId is None:
+                tickerId = getattr(msg, "tickerId", getattr(msg, "reqId", None))
+            self.events.publish(caller, msg, tickerId=tickerId,
+                symbol=lambda: self._callbackSymbol(msg, tickerId), **kwargs)
+
+    # -----------------------------------------
+    def _callbackSymbol(self, msg, tickerId):
+        if tickerId is not None:
+            return self.tickerSymbol(tickerId)
+        if getattr(msg, "orderId", None) in self.orders:
+            return self.orders[msg.orderId]["symbol"]
+        contract = getattr(msg, "contract", None)
+        if contract is not None:
+            return self.contractString(contract)
+        return None
 
-        elif msg.typeName == dataTypes["MSG_TYPE_NEXT_ORDER_ID"]:
-            self.handleNextValidId(msg.orderId)
+    # -----------------------------------------
+    def subscribe(self, handler, callers=None, tickerIds=None, symbols=None,
+            maxsize=10000, overflow="drop_oldest", conflate=False):
+        """
+        Subscribe `handler(caller, msg, **kwargs)` to callbacks, optionally
+        filtered by caller (ie. "handleTickPrice"), tickerId or symbol.
+        The handler runs on its own thread, fed by a bounded queue.
 
-        elif msg.typeName == dataTypes["MSG_CONNECTION_CLOSED"]:
-            self.handleConnectionClosed(msg)
+        With `conflate`, tickPrice/tickSize backlogs are merged into one
+        call per tickerId with the latest values (`fields` kwarg).
+        Returns the Subscription (pass it to unsubscribe()).
+        """
+        if tickerIds is not None:
+            tickerIds = [t if isinstance(t, int) else self.tickerId(
+                t if isinstance(t, str) else self.contractString(t)) for t in tickerIds]
+        if symbols is not None:
+            symbols = [s if isinstance(s, str) else self.contractString(s) for s in symbols]
 
-        elif msg.typeName == dataTypes["MSG_TYPE_MANAGED_ACCOUNTS"]:
-            self.accountCode = msg.accountsList
+        return self.events.subscribe(handler, callers=callers, tickerIds=tickerIds,
+            symbols=symbols, maxsize=maxsize, overflow=overflow, conflate=conflate)
 
-        elif msg.typeName == dataTypes["MSG_COMMISSION_REPORT"]:
-            self.commission = msg.commissionReport.m_commission
+    # -----------------------------------------
+    def unsubscribe(self, subscription, wait=False):
+        self.events.unsubscribe(subscription, wait)
 
-        elif msg.typeName == dataTypes["MSG_CONTRACT_DETAILS"]:
-            self.handleContractDetails(msg, end=False)
+    # -----------------------------------------
+    # Start admin handlers
+    # -----------------------------------------
+    def startRecording(self, path=None, append=False):
+        """
+        journal every inbound message to `path` (see replayJournal).
+        defaults to a new file in ~/.ezibpy/journals
+        """
+        if path is None:
+            path = os.path.join(private_dir(os.path.join(DATA_DIR, "journals")),
+                "client_%s_%s.journal" % (self.clientId, time.strftime("%Y%m%d%H%M%S")))
 
-        elif msg.typeName == dataTypes["MSG_CONTRACT_DETAILS_END"]:
-            self.handleContractDetails(msg, end=True)
+        self.stopRecording()
+        journal = MessageJournal(path, append)
 
-        elif msg.typeName == dataTypes["MSG_TICK_SNAPSHOT_END"]:
-            self.ibCallback(caller="handleTickSnapshotEnd", msg=msg)
+        # contracts created so far (replays need them)
+        for tickerId, contract in list(self.contracts.items()):
+            journal.recordContract(tickerId, self.tickerSymbol(tickerId), contract)
 
-        else:
-            # log handler msg
-            self.log_msg("server", msg)
+        self.journal = journal
+        return path
 
     # -----------------------------------------
-    # generic callback function - can be used externally
+    def stopRecording(self):
+        journal, self.journal = self.journal, None
+        if journal is not None:
+            journal.close()
+
     # -----------------------------------------
-    def ibCallback(self, caller, msg, **kwargs):
-        pass
+    def replayJournal(self, path, speed=None):
+        """
+        feeds a recorded journal into handleServerEvents (no connection
+        needed). speed=None replays as fast as possible, 1 = recorded pace.
+        journals are unpickled: only replay ones you recorded
+        """
+        # requests made by handlers go nowhere
+        if self.ibConn is None:
+            self.ibConn = OfflineConnection()
+
+        return replay_journal(path, self._replayMessage, speed)
 
     # -----------------------------------------
-    # Start admin handlers
+    def _replayMessage(self, msg):
+        if msg.typeName != CONTRACT_RECORD:
+            return self.handleServerEvents(msg)
+
+        # journaled contract: register it as createContract() did
+        self.setTickerSymbol(msg.tickerId, msg.symbol)
+        self.contracts[msg.tickerId] = msg.contract
+
     # -----------------------------------------
     def handleConnectionState(self, msg):
         """:Return: True if IBPy message `msg` indicates the connection is unavailable for any reason, else False."""
@@ -366,7 +598,7 @@ class ezIBpy():
             if msg.typeName == dataTypes["MSG_CURRENT_TIME"] and not self.connection_tracking["connected"]:
                 self.log.info("[CONNECTION TO IB ESTABLISHED]")
                 self.connection_tracking["connected"] = True
-                self.ibCallback(caller="handleConnectionOpened", msg="<connectionOpened>")
+                self._callback(caller="handleConnectionOpened", msg="<connectionOpened>")
         else:
             self.connection_tracking["connected"] = False
 
@@ -377,61 +609,58 @@ class ezIBpy():
     # -----------------------------------------
     def handleConnectionClosed(self, msg):
         self.connected = False
-        self.ibCallback(caller="handleConnectionClosed", msg=msg)
+        self._callback(caller="handleConnectionClosed", msg=msg)
 
         # retry to connect
         self.reconnect()
 
     # -----------------------------------------
-    def handleNextValidId(self, orderId):
-        """
-        handle nextValidId event
-        https://www.interactivebrokers.com/en/software/api/apiguide/java/nextvalidid.htm
-        """
-        self.orderId = orderId
-
-        # cash last orderId
-        try:
-            # db file
-            dbfile = tempfile.gettempdir() + "/ezibpy.pkl"
-
-            lastOrderId = 1  # default
-            if os.path.exists(dbfile):
-                df = read_pickle(dbfile).groupby("clientId").last()
-                filtered = df[df['clientId'] == self.clientId]
-                if len(filtered) > 0:
-                    lastOrderId = filtered['orderId'].values[0]
+    def handleCurrentTime(self, msg):
+        self.clock.update(msg.time)
+        if self.time < msg.time:
+            self.time = msg.time
 
-            # override with db if needed
-            if self.orderId <= 1 or self.orderId < lastOrderId + 1:
-                self.orderId = lastOrderId + 1
-
-            # save in db
-            orderDB = DataFrame(
-                index=[0], data={'clientId': self.clientId, 'orderId': self.orderId})
-
-            if os.path.exists(dbfile):
-                orderDB = df[df['clientId'] != self.clientId].append(
-                    orderDB[['clientId', 'orderId']])
+    # -----------------------------------------
+    def handleManagedAccounts(self, msg):
+        self.accountCode = msg.accountsList
 
-            orderDB.groupby("clientId").last().to_pickle(dbfile)
+    # -----------------------------------------
+    def handleCommissionReport(self, msg):
+        self.commission = msg.commissionReport.m_commission
 
-            # make writeable by all users
-            try: os.chmod(dbfile, S_IWRITE) # windows (cover all)
-            except: pass
-            try: os.chmod(dbfile, 0o777) # *nix
-            except: pass
+    # -----------------------------------------
+    def handleTickSnapshotEnd(self, msg):
+        if self.marketDataLines is not None:
+            self.marketDataLines.snapshotEnd(msg.reqId)
+        self._callback(caller="handleTickSnapshotEnd", msg=msg)
 
-            time.sleep(.001)
+    # -----------------------------------------
+    def handleNextValidIdMsg(self, msg):
+        self.handleNextValidId(msg.orderId)
 
-        except:
-            pass
+    # -----------------------------------------
+    def handleNextValidId(self, orderId):
+        """
+        handle nextValidId event
+        https://www.interactivebrokers.com/en/software/api/apiguide/java/nextvalidid.htm
+        """
+        self.orderIdAllocator.sync(orderId)
+        self.orderId = self.orderIdAllocator.peek()
 
     # -----------------------------------------
     def handleContractDetails(self, msg, end=False):
         """ handles contractDetails and contractDetailsEnd """
 
         if end:
+            # save replies for warm restarts
+            if msg.reqId in self._contractDetailsReplies:
+                replies = self._contractDetailsReplies.pop(msg.reqId)
+                # (under the contractString it was requested/loaded as,
+                # multi contracts get renamed below)
+                if self.contractDetailsCache is not None:
+                    self.contractDetailsCache.save(
+                        self._contractDetailsPending[msg.reqId], replies)
+
              # mark as downloaded
             self._contract_details[msg.reqId]['downloaded'] = True
 
@@ -451,20 +680,26 @@ class ezIBpy():
                     self.contract_details[msg.reqId]["contracts"][0])
 
             # update local db with correct contractString
-            for tid in self.contract_details:
-                oldString = self.tickerIds[tid]
-                newString = self.contractString(self.contract_details[tid]["contracts"][0])
+            if len(self.contract_details[msg.reqId]["contracts"]) > 1:
+                for tid in self.contract_details:
+                    oldString = self.tickerIds[tid]
+                    newString = self.contractString(self.contract_details[tid]["contracts"][0])
 
-                if len(self.contract_details[msg.reqId]["contracts"]) > 1:
-                    self.tickerIds[tid] = newString
+                    self.setTickerSymbol(tid, newString)
                     if newString != oldString:
                         if oldString in self.portfolio:
                             self.portfolio[newString] = self.portfolio[oldString]
                         if oldString in self.positions:
                             self.positions[newString] = self.positions[oldString]
 
+            # release waiters
+            self._contractDetailsPending.pop(msg.reqId, None)
+            waiter = self._contractDetailsWaiters.pop(msg.reqId, None)
+            if waiter is not None:
+                waiter.set()
+
             # fire callback
-            self.ibCallback(caller="handleContractDetailsEnd", msg=msg)
+            self._callback(caller="handleContractDetailsEnd", msg=msg)
 
             # exit
             return
@@ -476,6 +711,11 @@ class ezIBpy():
         details  = vars(msg.contractDetails)
         contract = details["m_summary"]
 
+        # keep the raw reply of requested details (for the cache)
+        if self.contractDetailsCache is not None and msg.reqId in self._contractDetailsPending:
+            self._contractDetailsReplies.setdefault(msg.reqId, []).append(
+                {k: v for k, v in details.items() if k.startswith("m_")})
+
         if msg.reqId in self._contract_details:
             details['contracts'] = self._contract_details[msg.reqId]["contracts"]
         else:
@@ -504,7 +744,11 @@ class ezIBpy():
             self.contract_details[tickerId]["contracts"] = [contract]
 
         # fire callback
-        self.ibCallback(caller="handleContractDetails", msg=msg)
+        self._callback(caller="handleContractDetails", msg=msg)
+
+    # -----------------------------------------
+    def handleContractDetailsEnd(self, msg):
+        self.handleContractDetails(msg, end=True)
 
     # -----------------------------------------
     def handleAccount(self, msg):
@@ -524,7 +768,7 @@ class ezIBpy():
             self.account[msg.key] = float(msg.value)
 
             # fire callback
-            self.ibCallback(caller="handleAccount", msg=msg)
+            self._callback(caller="handleAccount", msg=msg)
 
     # -----------------------------------------
     def handlePosition(self, msg):
@@ -549,7 +793,7 @@ class ezIBpy():
         }
 
         # fire callback
-        self.ibCallback(caller="handlePosition", msg=msg)
+        self._callback(caller="handlePosition", msg=msg)
 
     # -----------------------------------------
     def handlePortfolio(self, msg):
@@ -578,7 +822,7 @@ class ezIBpy():
         }
 
         # fire callback
-        self.ibCallback(caller="handlePortfolio", msg=msg)
+        self._callback(caller="handlePortfolio", msg=msg)
 
     # -----------------------------------------
     def handleOrders(self, msg):
@@ -591,9 +835,11 @@ class ezIBpy():
         # log handler msg
         self.log_msg("order", msg)
 
-        # get server time
-        self.getServerTime()
-        time.sleep(0.001)
+        # re-sync the clock model every now and then (never blocks)
+        if self.clock.due():
+            self.getServerTime()
+
+        orderTime = self.clock.datetime()
 
         # we need to handle mutiple events for the same order status
         duplicateMessage = False
@@ -604,27 +850,26 @@ class ezIBpy():
             contractString = self.contractString(msg.contract)
 
             if msg.orderId in self.orders and self.orders[msg.orderId]["status"] == "SENT":
-                try: del self.orders[msg.orderId]
-                except: pass
+                self._removeOrder(msg.orderId)
 
             if msg.orderId in self.orders:
                 duplicateMessage = True
             else:
-                self.orders[msg.orderId] = {
-                    "id":       msg.orderId,
-                    "symbol":   contractString,
-                    "contract": msg.contract,
-                    "order":    msg.order,
-                    "status":   "OPENED",
-                    "reason":   None,
-                    "avgFillPrice": 0.,
-                    "parentId": 0,
-                    "time": datetime.fromtimestamp(int(self.time))
-                }
+                self._storeOrder(OrderRecord(
+                    id       = msg.orderId,
+                    symbol   = contractString,
+                    contract = msg.contract,
+                    order    = msg.order,
+                    status   = "OPENED",
+                    time     = orderTime
+                ))
 
         # order status
         elif msg.typeName == dataTypes["MSG_TYPE_ORDER_STATUS"]:
-            if msg.orderId in self.orders and self.orders[msg.orderId]['status'] == msg.status.upper():
+            if msg.orderId not in self.orders:
+                # unknown or already archived
+                duplicateMessage = True
+            elif self.orders[msg.orderId]['status'] == msg.status.upper():
                 duplicateMessage = True
             else:
                 # remove cancelled orphan orders
@@ -633,11 +878,13 @@ class ezIBpy():
                 #     except: pass
                 # # otherwise, update order status
                 # else:
-                self.orders[msg.orderId]['status']       = msg.status.upper()
-                self.orders[msg.orderId]['reason']       = msg.whyHeld
-                self.orders[msg.orderId]['avgFillPrice'] = float(msg.avgFillPrice)
-                self.orders[msg.orderId]['parentId']     = int(msg.parentId)
-                self.orders[msg.orderId]['time']         = datetime.fromtimestamp(int(self.time))
+                self._updateOrder(msg.orderId,
+                    status       = msg.status.upper(),
+                    reason       = msg.whyHeld,
+                    avgFillPrice = float(msg.avgFillPrice),
+                    parentId     = int(msg.parentId),
+                    time         = orderTime
+                )
 
             # remove from orders?
             # if msg.status.upper() == 'CANCELLED':
@@ -645,12 +892,109 @@ class ezIBpy():
 
         # fire callback
         if duplicateMessage == False:
-            # group orders by symbol
-            self.symbol_orders = self.group_orders("symbol")
-            self.ibCallback(caller="handleOrders", msg=msg)
+            self._callback(caller="handleOrders", msg=msg)
+
+        if self.orderArchive is not None:
+            self._archiveOrders()
+
+    # -----------------------------------------
+    def _storeOrder(self, order):
+        """ adds/replaces an order, keeping the order indexes in sync """
+        if order["id"] in self.orders:
+            self._removeOrder(order["id"])
+        self.orders[order["id"]] = order
+        self.orderIndex.add(order)
+
+    # -----------------------------------------
+    def _updateOrder(self, orderId, **fields):
+        self.orderIndex.update(self.orders[orderId], fields)
+
+        if self.orderArchive is not None and \
+                fields.get("status") in TERMINAL_ORDER_STATUSES:
+            self.orderArchive.schedule(orderId, self.clock.local())
+
+    # -----------------------------------------
+    def _removeOrder(self, orderId):
+        order = self.orders.pop(orderId, None)
+        if order is not None:
+            self.orderIndex.remove(order)
+        return order
+
+    # -----------------------------------------
+    def _orderReferenced(self, orderId):
+        """ is the order still needed by a software trailing stop? """
+        for trailingStop in self.trailingStops.values():
+            if trailingStop["orderId"] == orderId:
+                return True
+        for pendingOrder in self.triggerableTrailingStops.values():
+            if pendingOrder["parentId"] == orderId:
+                return True
+        return False
+
+    # -----------------------------------------
+    def _archiveOrders(self):
+        """ moves terminal orders past their retention to the archive """
+        now = self.clock.local()
+        archived = []
+
+        for orderId in self.orderArchive.due(now):
+            order = self.orders.get(orderId)
+            if order is None or order["status"] not in TERMINAL_ORDER_STATUSES:
+                continue
+            if self._orderReferenced(orderId):
+                self.orderArchive.schedule(orderId, now)
+                continue
+            archived.append(self._removeOrder(orderId))
+
+        self.orderArchive.append(archived)
+
+    # -----------------------------------------
+    def enableOrderArchive(self, path=None, retention=60):
+        """
+        Moves FILLED/CANCELLED orders out of memory into an append-only
+        log, `retention` seconds after they reached their final status.
+        Use archivedOrders() to query them.
+        `path` defaults to ~/.ezibpy/orders/client_<clientId>.jsonl
+        """
+        if path is None:
+            path = os.path.join(private_dir(os.path.join(DATA_DIR, "orders")),
+                                "client_%s.jsonl" % self.clientId)
+
+        self.orderArchive = OrderArchive(path, retention)
+
+        # orders that are already done
+        now = self.clock.local()
+        for orderId, order in self.orders.items():
+            if order["status"] in TERMINAL_ORDER_STATUSES:
+                self.orderArchive.schedule(orderId, now)
+
+        return self.orderArchive
+
+    # -----------------------------------------
+    def archivedOrders(self, symbol=None, status=None, since=None):
+        """ returns archived orders as {orderId: dict} """
+        if self.orderArchive is None:
+            return {}
+        if symbol is not None and not isinstance(symbol, str):
+            symbol = self.contractString(symbol)
+        return self.orderArchive.query(symbol, status, since)
+
+    # -----------------------------------------
+    def workingOrders(self, symbol=None):
+        """
+        returns the working (not filled/cancelled) orders as
+        {orderId: order}, optionally for one contract only
+        """
+        if symbol is not None and not isinstance(symbol, str):
+            symbol = self.contractString(symbol)
+        return self.orderIndex.working(symbol)
 
     # -----------------------------------------
     def group_orders(self, by="symbol"):
+        if by in INDEXED_ORDER_FIELDS:
+            return {key: dict(orders) for key, orders
+                    in self.orderIndex.index(by).items()}
+
         orders = {}
         for orderId in self.orders:
             order = self.orders[orderId]
@@ -674,81 +1018,189 @@ class ezIBpy():
         https://www.interactivebrokers.com/en/software/api/apiguide/java/updatemktdepthl2.htm
         """
 
-        # make sure symbol exists
-        if msg.tickerId not in self.marketDepthData.keys():
-            self.marketDepthData[msg.tickerId] = self.marketDepthData[0].copy()
-
-        # bid
-        if msg.side == 1:
-            self.marketDepthData[msg.tickerId].loc[msg.position, "bid"] = msg.price
-            self.marketDepthData[msg.tickerId].loc[msg.position, "bidsize"] = msg.size
-
-        # ask
-        elif msg.side == 0:
-            self.marketDepthData[msg.tickerId].loc[msg.position, "ask"] = msg.price
-            self.marketDepthData[msg.tickerId].loc[msg.position, "asksize"] = msg.size
-
-        """
-        # bid/ask spread / vol diff
-        self.marketDepthData[msg.tickerId].loc[msg.position, "spread"] = \
-            self.marketDepthData[msg.tickerId].loc[msg.position, "ask"]-\
-            self.marketDepthData[msg.tickerId].loc[msg.position, "bid"]
+        if msg.typeName == dataTypes["MSG_TYPE_MKT_DEPTH_L2"]:
+            self.marketDepthData.book(msg.tickerId, l2=True).update(
+                msg.position, msg.operation, msg.side, msg.price, msg.size,
+                marketMaker=msg.marketMaker)
+        else:
+            self.marketDepthData.book(msg.tickerId).update(
+                msg.position, msg.operation, msg.side, msg.price, msg.size)
 
-        self.marketDepthData[msg.tickerId].loc[msg.position, "spreadsize"] = \
-            self.marketDepthData[msg.tickerId].loc[msg.position, "asksize"]-\
-            self.marketDepthData[msg.tickerId].loc[msg.position, "bidsize"]
-        """
+        if self.marketDataLines is not None:
+            self.marketDataLines.touchDepth(msg.tickerId)
 
-        self.ibCallback(caller="handleMarketDepth", msg=msg)
+        self._callback(caller="handleMarketDepth", msg=msg)
 
     # -----------------------------------------
     def handleHistoricalData(self, msg):
         # self.log.debug("[HISTORY]: %s", msg)
-        print('.', end="", flush=True)
+        try:
+            request = self._historyRequests[msg.reqId]
+        except KeyError:
+            if HISTORY_REQID_BASE <= msg.reqId < self._nextHistoryReqId:
+                return  # late bars of a cancelled/finished request
+
+            # not requested via requestHistoricalData()
+            job = self._newHistoryJob(self.tickerSymbol(msg.reqId))
+            job["tickerId"] = msg.reqId
+            request = self._newHistoryRequest(msg.reqId, job)
 
         if msg.date[:8].lower() == 'finished':
-            # print(self.historicalData)
-
-            if self.utc_history:
-                for sym in self.historicalData:
-                    contractString = str(sym)
-                    self.historicalData[contractString] = local_to_utc(self.historicalData[contractString])
-
-            if self.csv_path != None:
-                for sym in self.historicalData:
-                    contractString = str(sym)
-                    self.log.info("[HISTORICAL DATA FOR %s DOWNLOADED]" % contractString)
-                    self.historicalData[contractString].to_csv(
-                        self.csv_path + contractString + '.csv'
-                    )
+            self._completeHistoryRequest(request, msg)
 
-            print('.')
-            # fire callback
-            self.ibCallback(caller="handleHistoricalData", msg=msg, completed=True)
+        else:
+            request["bars"].append(parse_bar_date(msg.date), msg.open, msg.high,
+                                   msg.low, msg.close, msg.volume, msg.count, msg.WAP)
+
+            job = request["job"]
+            job["received"] += 1
+            if job["progress"] is not None:
+                job["progress"](job["symbol"], job["received"])
+
+            # fire callback (under the contract's tickerId, not our reqId)
+            self._callback(caller="handleHistoricalData", msg=msg, completed=False,
+                           tickerId=job.get("tickerId", msg.reqId))
+
+    # -----------------------------------------
+    def handleHistoricalDataError(self, msg):
+        """ re-queues paced-out requests, ends failed ones """
+        request = self._historyRequests[msg.id]
+
+        if msg.errorCode == 162 and "pacing violation" in str(msg.errorMsg).lower():
+            self.log.warning("[HISTORICAL DATA PACING VIOLATION] re-queueing %s",
+                             request["job"]["symbol"])
+            request["bars"] = BarBuffer()
+            self.historyScheduler.submit(request, delay=self.historyScheduler.identical_gap)
+            return
+
+        request["job"]["errors"] += 1
+        request["failed"] = True
+        self._completeHistoryRequest(request, msg)
+
+    # -----------------------------------------
+    def _newHistoryJob(self, symbol, csv_path=None, utc=False, callback=None,
+            progress=None):
+        """ state of a requestHistoricalData() download (one per contract) """
+        return {
+            "symbol": symbol,
+            "csv_path": csv_path,
+            "utc": utc,
+            "callback": callback,
+            "progress": progress,
+            "received": 0,
+            "reqIds": [],
+            "frames": [],
+            "errors": 0,
+            "pending": 0,
+            "completed": False,
+            "future": Future()
+        }
+
+    # -----------------------------------------
+    def _newHistoryRequest(self, reqId, job, **kwargs):
+        """ state of a single reqHistoricalData (one chunk of a job) """
+        request = self._historyRequests[reqId] = dict(kwargs,
+            reqId=reqId, job=job, bars=BarBuffer())
+        job["reqIds"].append(reqId)
+        job["pending"] += 1
+        return request
+
+    # -----------------------------------------
+    def _completeHistoryRequest(self, request, msg):
+        self._historyRequests.pop(request["reqId"], None)
+
+        job = request["job"]
+        if job["completed"]:
+            return
+
+        job["frames"].append(request["bars"].frame())
+        request["bars"] = None
+        if "cacheRange" in request and not request.get("failed"):
+            job["downloaded"].append(request["cacheRange"])
+        job["pending"] -= 1
+        if job["pending"] <= 0:
+            self._completeHistoryJob(job, msg)
 
+    # -----------------------------------------
+    def _cacheHistoryJob(self, job, df):
+        """
+        stores the chunks that succeeded (bars and coverage, in UTC)
+        and returns the job's bars from the cache (in local time)
+        """
+        key = job["cacheKey"]
+
+        if job["errors"]:
+            # failed chunks leave holes: only claim what stays contiguous
+            ranges = claimable_ranges(job["downloaded"], self.historyCache.coverage(key))
         else:
-            # create tick holder for ticker
-            if len(msg.date) <= 8:  # daily
-                ts = datetime.strptime(msg.date, dataTypes["DATE_FORMAT"])
-                ts = ts.strftime(dataTypes["DATE_FORMAT_HISTORY"])
-            else:
-                ts = datetime.fromtimestamp(int(msg.date))
-                ts = ts.strftime(dataTypes["DATE_TIME_FORMAT_LONG"])
-
-            hist_row = DataFrame(index=['datetime'], data={
-                "datetime": ts, "O": msg.open, "H": msg.high,
-                "L": msg.low, "C": msg.close, "V": msg.volume,
-                "OI": msg.count, "WAP": msg.WAP})
-            hist_row.set_index('datetime', inplace=True)
-
-            symbol = self.tickerSymbol(msg.reqId)
-            if symbol not in self.historicalData.keys():
-                self.historicalData[symbol] = hist_row
-            else:
-                self.historicalData[symbol] = self.historicalData[symbol].append(hist_row)
+            ranges = [(job["start"], job["end"])]
 
-            # fire callback
-            self.ibCallback(caller="handleHistoricalData", msg=msg, completed=False)
+        if ranges:
+            start = min(start for start, _ in ranges)
+            end = max(end for _, end in ranges)
+            self.historyCache.update(key, frame_to_utc(df).loc[start:end], start, end)
+
+        cached = frame_to_local(self.historyCache.frame(key, job["start"], job["end"]))
+
+        # bars of the ranges that couldn't be claimed are still returned
+        return stitch_bars([cached, df]) if job["errors"] else cached
+
+    # -----------------------------------------
+    def _completeHistoryJob(self, job, msg=None):
+        """ all chunks in: build the DataFrame once """
+        symbol = job["symbol"]
+        df = stitch_bars(job["frames"])
+        job["frames"] = []
+
+        # merge with (and serve from) the on-disk cache
+        if job.get("cacheKey") is not None:
+            df = self._cacheHistoryJob(job, df)
+
+        if job.get("window") is not None:
+            df = df.loc[job["window"][0]:job["window"][1]]
+
+        if job["utc"]:
+            df = local_to_utc(df)
+
+        if job["csv_path"] is not None:
+            self.log.info("[HISTORICAL DATA FOR %s DOWNLOADED]" % symbol)
+            df.to_csv(job["csv_path"] + symbol + '.csv')
+
+        self.historicalData[symbol] = df
+        job["completed"] = True
+
+        # forget the finished download
+        if self._historyJobs.get(job.get("tickerId")) is job:
+            del self._historyJobs[job["tickerId"]]
+        for reqId in job["reqIds"]:
+            self._historyRequests.pop(reqId, None)
+
+        # resolve first: a failing callback mustn't leave the Future pending
+        job["future"].set_result(df)
+
+        # fire callbacks
+        if job["callback"] is not None:
+            try:
+                job["callback"](symbol, df)
+            except Exception as e:
+                self.log.exception("[HISTORICAL DATA CALLBACK ERROR] %s: %s", symbol, e)
+        self._callback(caller="handleHistoricalData", msg=msg, completed=True,
+                       tickerId=job.get("tickerId"))
+
+    # -----------------------------------------
+    def _sendHistoryRequest(self, request):
+        """ called by the scheduler when pacing allows """
+        request["sent"] = True
+        self.ibConn.reqHistoricalData(
+            tickerId       = request["reqId"],
+            contract       = request["contract"],
+            endDateTime    = request["endDateTime"],
+            durationStr    = request["durationStr"],
+            barSizeSetting = request["barSizeSetting"],
+            whatToShow     = request["whatToShow"],
+            useRTH         = request["useRTH"],
+            formatDate     = request["formatDate"]
+        )
 
     # -----------------------------------------
     def handleTickGeneric(self, msg):
@@ -760,18 +1212,14 @@ class ezIBpy():
         if self.contracts[msg.tickerId].m_secType in ("OPT", "FOP"):
             df2use = self.optionsData
 
-        # create tick holder for ticker
-        if msg.tickerId not in df2use.keys():
-            df2use[msg.tickerId] = df2use[0].copy()
-
         if msg.tickType == dataTypes["FIELD_OPTION_IMPLIED_VOL"]:
-            df2use[msg.tickerId]['iv'] = round(float(msg.value), 2)
+            df2use.set(msg.tickerId, 'iv', round(float(msg.value), 2))
 
         # elif msg.tickType == dataTypes["FIELD_OPTION_HISTORICAL_VOL"]:
-        #     df2use[msg.tickerId]['historical_iv'] = round(float(msg.value), 2)
+        #     df2use.set(msg.tickerId, 'historical_iv', round(float(msg.value), 2))
 
         # fire callback
-        self.ibCallback(caller="handleTickGeneric", msg=msg)
+        self._callback(caller="handleTickGeneric", msg=msg)
 
     # -----------------------------------------
     def handleTickPrice(self, msg):
@@ -790,22 +1238,21 @@ class ezIBpy():
             df2use = self.optionsData
             canAutoExecute = True
 
-        # create tick holder for ticker
-        if msg.tickerId not in df2use.keys():
-            df2use[msg.tickerId] = df2use[0].copy()
-
         # bid price
         if canAutoExecute and msg.field == dataTypes["FIELD_BID_PRICE"]:
-            df2use[msg.tickerId]['bid'] = float(msg.price)
+            df2use.set(msg.tickerId, 'bid', float(msg.price))
         # ask price
         elif canAutoExecute and msg.field == dataTypes["FIELD_ASK_PRICE"]:
-            df2use[msg.tickerId]['ask'] = float(msg.price)
+            df2use.set(msg.tickerId, 'ask', float(msg.price))
         # last price
         elif msg.field == dataTypes["FIELD_LAST_PRICE"]:
-            df2use[msg.tickerId]['last'] = float(msg.price)
+            df2use.set(msg.tickerId, 'last', float(msg.price))
+
+        if self.marketDataLines is not None:
+            self.marketDataLines.touch(msg.tickerId)
 
         # fire callback
-        self.ibCallback(caller="handleTickPrice", msg=msg)
+        self._callback(caller="handleTickPrice", msg=msg)
 
     # -----------------------------------------
     def handleTickSize(self, msg):
@@ -820,52 +1267,48 @@ class ezIBpy():
         if self.contracts[msg.tickerId].m_secType in ("OPT", "FOP"):
             df2use = self.optionsData
 
-        # create tick holder for ticker
-        if msg.tickerId not in df2use.keys():
-            df2use[msg.tickerId] = df2use[0].copy()
-
         # ---------------------
         # market data
         # ---------------------
         # bid size
         if msg.field == dataTypes["FIELD_BID_SIZE"]:
-            df2use[msg.tickerId]['bidsize'] = int(msg.size)
+            df2use.set(msg.tickerId, 'bidsize', int(msg.size))
         # ask size
         elif msg.field == dataTypes["FIELD_ASK_SIZE"]:
-            df2use[msg.tickerId]['asksize'] = int(msg.size)
+            df2use.set(msg.tickerId, 'asksize', int(msg.size))
         # last size
         elif msg.field == dataTypes["FIELD_LAST_SIZE"]:
-            df2use[msg.tickerId]['lastsize'] = int(msg.size)
+            df2use.set(msg.tickerId, 'lastsize', int(msg.size))
 
         # ---------------------
         # options data
         # ---------------------
         # open interest
         elif msg.field == dataTypes["FIELD_OPEN_INTEREST"]:
-            df2use[msg.tickerId]['oi'] = int(msg.size)
+            df2use.set(msg.tickerId, 'oi', int(msg.size))
 
         elif msg.field == dataTypes["FIELD_OPTION_CALL_OPEN_INTEREST"] and \
                 self.contracts[msg.tickerId].m_right == "CALL":
-            df2use[msg.tickerId]['oi'] = int(msg.size)
+            df2use.set(msg.tickerId, 'oi', int(msg.size))
 
         elif msg.field == dataTypes["FIELD_OPTION_PUT_OPEN_INTEREST"] and \
                 self.contracts[msg.tickerId].m_right == "PUT":
-            df2use[msg.tickerId]['oi'] = int(msg.size)
+            df2use.set(msg.tickerId, 'oi', int(msg.size))
 
         # volume
         elif msg.field == dataTypes["FIELD_VOLUME"]:
-            df2use[msg.tickerId]['volume'] = int(msg.size)
+            df2use.set(msg.tickerId, 'volume', int(msg.size))
 
         elif msg.field == dataTypes["FIELD_OPTION_CALL_VOLUME"] and \
                 self.contracts[msg.tickerId].m_right == "CALL":
-            df2use[msg.tickerId]['volume'] = int(msg.size)
+            df2use.set(msg.tickerId, 'volume', int(msg.size))
 
         elif msg.field == dataTypes["FIELD_OPTION_PUT_VOLUME"] and \
                 self.contracts[msg.tickerId].m_right == "PUT":
-            df2use[msg.tickerId]['volume'] = int(msg.size)
+            df2use.set(msg.tickerId, 'volume', int(msg.size))
 
         # fire callback
-        self.ibCallback(caller="handleTickSize", msg=msg)
+        self._callback(caller="handleTickSize", msg=msg)
 
     # -----------------------------------------
     def handleTickString(self, msg):
@@ -877,16 +1320,9 @@ class ezIBpy():
         if self.contracts[msg.tickerId].m_secType in ("OPT", "FOP"):
             df2use = self.optionsData
 
-        # create tick holder for ticker
-        if msg.tickerId not in df2use.keys():
-            df2use[msg.tickerId] = df2use[0].copy()
-
         # update timestamp
         if msg.tickType == dataTypes["FIELD_LAST_TIMESTAMP"]:
-            ts = datetime.fromtimestamp(int(msg.value)) \
-                .strftime(dataTypes["DATE_TIME_FORMAT_LONG_MILLISECS"])
-            df2use[msg.tickerId].index = [ts]
-            # self.log.debug("[TICK TS]: %s", ts)
+            df2use.set(msg.tickerId, 'datetime', int(msg.value))
 
             # handle trailing stop orders
             if self.contracts[msg.tickerId].m_secType not in ("OPT", "FOP"):
@@ -894,7 +1330,7 @@ class ezIBpy():
                 self.handleTrailingStops(msg.tickerId)
 
             # fire callback
-            self.ibCallback(caller="handleTickString", msg=msg)
+            self._callback(caller="handleTickString", msg=msg)
 
         elif (msg.tickType == dataTypes["FIELD_RTVOLUME"]):
 
@@ -914,20 +1350,27 @@ class ezIBpy():
                 tick['instrument'] = self.tickerSymbol(msg.tickerId)
 
                 # parse time
-                s, ms = divmod(int(tick['time']), 1000)
+                epoch_ms = int(tick['time'])
+                s, ms = divmod(epoch_ms, 1000)
                 tick['time'] = '{}.{:03d}'.format(
                     time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(s)), ms)
 
                 # add most recent bid/ask to "tick"
-                tick['bid']     = df2use[msg.tickerId]['bid'][0]
-                tick['bidsize'] = int(df2use[msg.tickerId]['bidsize'][0])
-                tick['ask']     = df2use[msg.tickerId]['ask'][0]
-                tick['asksize'] = int(df2use[msg.tickerId]['asksize'][0])
+                tick['bid']     = float(df2use.get(msg.tickerId, 'bid'))
+                tick['bidsize'] = int(df2use.get(msg.tickerId, 'bidsize'))
+                tick['ask']     = float(df2use.get(msg.tickerId, 'ask'))
+                tick['asksize'] = int(df2use.get(msg.tickerId, 'asksize'))
+
+                # keep in tick history
+                if self.tickHistory is not None:
+                    self.tickHistory.append(msg.tickerId, epoch_ms / 1000.,
+                        tick['last'], tick['lastsize'], tick['volume'],
+                        tick['wap'], tick['bid'], tick['ask'])
 
                 # self.log.debug("%s: %s\n%s", tick['time'], self.tickerSymbol(msg.tickerId), tick)
 
                 # fire callback
-                self.ibCallback(caller="handleTickString", msg=msg, tick=tick)
+                self._callback(caller="handleTickString", msg=msg, tick=tick)
 
             except:
                 pass
@@ -935,7 +1378,7 @@ class ezIBpy():
         else:
             # self.log.info("tickString-%s", msg)
             # fire callback
-            self.ibCallback(caller="handleTickString", msg=msg)
+            self._callback(caller="handleTickString", msg=msg)
 
         # print(msg)
 
@@ -947,9 +1390,9 @@ class ezIBpy():
         https://www.interactivebrokers.com/en/software/api/apiguide/java/tickoptioncomputation.htm
         """
         def calc_generic_val(data, field):
-            last_val = data['last_' + field].values[-1]
-            bid_val  = data['bid_' + field].values[-1]
-            ask_val  = data['ask_' + field].values[-1]
+            last_val = data['last_' + field]
+            bid_val  = data['bid_' + field]
+            ask_val  = data['ask_' + field]
             bid_ask_val = last_val
             if bid_val != 0 and ask_val != 0:
                 bid_ask_val = (bid_val + ask_val) / 2
@@ -958,10 +1401,6 @@ class ezIBpy():
         def valid_val(val):
             return float(val) if val < 1000000000 else None
 
-        # create tick holder for ticker
-        if msg.tickerId not in self.optionsData.keys():
-            self.optionsData[msg.tickerId] = self.optionsData[0].copy()
-
         col_prepend = ""
         if msg.field == "FIELD_BID_OPTION_COMPUTATION":
             col_prepend = "bid_"
@@ -971,27 +1410,56 @@ class ezIBpy():
             col_prepend = "last_"
 
         # save side
-        self.optionsData[msg.tickerId][col_prepend + 'imp_vol']  = valid_val(msg.impliedVol)
-        self.optionsData[msg.tickerId][col_prepend + 'dividend'] = valid_val(msg.pvDividend)
-        self.optionsData[msg.tickerId][col_prepend + 'delta'] = valid_val(msg.delta)
-        self.optionsData[msg.tickerId][col_prepend + 'gamma'] = valid_val(msg.gamma)
-        self.optionsData[msg.tickerId][col_prepend + 'vega'] = valid_val(msg.vega)
-        self.optionsData[msg.tickerId][col_prepend + 'theta'] = valid_val(msg.theta)
-        self.optionsData[msg.tickerId][col_prepend + 'price'] = valid_val(msg.optPrice)
+        self.optionsData.set(msg.tickerId, col_prepend + 'imp_vol', valid_val(msg.impliedVol))
+        self.optionsData.set(msg.tickerId, col_prepend + 'dividend', valid_val(msg.pvDividend))
+        self.optionsData.set(msg.tickerId, col_prepend + 'delta', valid_val(msg.delta))
+        self.optionsData.set(msg.tickerId, col_prepend + 'gamma', valid_val(msg.gamma))
+        self.optionsData.set(msg.tickerId, col_prepend + 'vega', valid_val(msg.vega))
+        self.optionsData.set(msg.tickerId, col_prepend + 'theta', valid_val(msg.theta))
+        self.optionsData.set(msg.tickerId, col_prepend + 'price', valid_val(msg.optPrice))
 
         # save generic/mid
-        data = self.optionsData[msg.tickerId]
-        self.optionsData[msg.tickerId]['imp_vol'] = calc_generic_val(data, 'imp_vol')
-        self.optionsData[msg.tickerId]['dividend'] = calc_generic_val(data, 'dividend')
-        self.optionsData[msg.tickerId]['delta'] = calc_generic_val(data, 'delta')
-        self.optionsData[msg.tickerId]['gamma'] = calc_generic_val(data, 'gamma')
-        self.optionsData[msg.tickerId]['vega'] = calc_generic_val(data, 'vega')
-        self.optionsData[msg.tickerId]['theta'] = calc_generic_val(data, 'theta')
-        self.optionsData[msg.tickerId]['price'] = calc_generic_val(data, 'price')
-        self.optionsData[msg.tickerId]['underlying'] = valid_val(msg.undPrice)
+        data = self.optionsData.record(msg.tickerId)
+        self.optionsData.set(msg.tickerId, 'imp_vol', calc_generic_val(data, 'imp_vol'))
+        self.optionsData.set(msg.tickerId, 'dividend', calc_generic_val(data, 'dividend'))
+        self.optionsData.set(msg.tickerId, 'delta', calc_generic_val(data, 'delta'))
+        self.optionsData.set(msg.tickerId, 'gamma', calc_generic_val(data, 'gamma'))
+        self.optionsData.set(msg.tickerId, 'vega', calc_generic_val(data, 'vega'))
+        self.optionsData.set(msg.tickerId, 'theta', calc_generic_val(data, 'theta'))
+        self.optionsData.set(msg.tickerId, 'price', calc_generic_val(data, 'price'))
+        self.optionsData.set(msg.tickerId, 'underlying', valid_val(msg.undPrice))
 
         # fire callback
-        self.ibCallback(caller="handleTickOptionComputation", msg=msg)
+        self._callback(caller="handleTickOptionComputation", msg=msg)
+
+    # -----------------------------------------
+    # tick history
+    # -----------------------------------------
+    def enableTickHistory(self, capacity=1000):
+        """
+        keep the last `capacity` RTVOLUME ticks of every tickerId
+        in fixed-size ring buffers (memory stays flat)
+        """
+        self.tickHistory = TickHistory(capacity)
+        return self.tickHistory
+
+    # -----------------------------------------
+    def getTickHistory(self, contract_identifier, n=None, since=None):
+        """
+        returns the buffered ticks of a contract as a DataFrame
+        n = last N ticks, since = epoch seconds / datetime
+        """
+        if self.tickHistory is None:
+            raise ValueError("Tick history is disabled. Use enableTickHistory() first")
+
+        if isinstance(since, datetime):
+            since = since.timestamp()
+
+        tickerId = contract_identifier
+        if not isinstance(tickerId, int):
+            tickerId = self.tickerId(contract_identifier)
+
+        return self.tickHistory.frame(tickerId, n=n, since=since)
 
     # -----------------------------------------
     # trailing stops
@@ -1059,14 +1527,15 @@ class ezIBpy():
 
         # continue
         trailingStop   = self.trailingStops[tickerId]
-        price          = self.marketData[tickerId]['last'][0]
+        price          = self.marketData.get(tickerId, 'last')
         symbol         = self.tickerSymbol(tickerId)
         # contract       = self.contracts[tickerId]
         # contractString = self.contractString(contract)
 
         # filled / no positions?
+        stopOrder = self.orders.get(trailingStop['orderId'])
         if (self.positions[symbol] == 0) | \
-                (self.orders[trailingStop['orderId']]['status'] == "FILLED"):
+                (stopOrder is not None and stopOrder['status'] == "FILLED"):
             del self.trailingStops[tickerId]
             return None
 
@@ -1115,7 +1584,7 @@ class ezIBpy():
         # print('.')
         # test
         symbol = self.tickerSymbol(tickerId)
-        price  = self.marketData[tickerId]['last'][0]
+        price  = self.marketData.get(tickerId, 'last')
         # contract = self.contracts[tickerId]
 
         if symbol in self.triggerableTrailingStops.keys():
@@ -1207,13 +1676,34 @@ class ezIBpy():
         if isinstance(symbol, Contract):
             symbol = self.contractString(symbol)
 
-        for tickerId in self.tickerIds:
-            if symbol == self.tickerIds[tickerId]:
-                return tickerId
-        else:
-            tickerId = len(self.tickerIds)
-            self.tickerIds[tickerId] = symbol
-            return tickerId
+        tickerId = self._tickerSymbols.get(symbol)
+        if tickerId is None:
+            tickerId = self._nextTickerId
+            self._nextTickerId += 1
+            self.setTickerSymbol(tickerId, symbol)
+
+        return tickerId
+
+    # -----------------------------------------
+    def tickerIdsFor(self, contract_identifiers):
+        """ bulk version of tickerId(). returns a list of tickerIds """
+        return [self.tickerId(identifier) for identifier in contract_identifiers]
+
+    # -----------------------------------------
+    def setTickerSymbol(self, tickerId, symbol):
+        """ (re)assigns a symbol to a tickerId, keeping both indexes in sync """
+        oldSymbol = self.tickerIds.get(tickerId)
+        if oldSymbol is not None and self._tickerSymbols.get(oldSymbol) == tickerId:
+            del self._tickerSymbols[oldSymbol]
+
+        self.tickerIds[tickerId] = symbol
+
+        # keep the lowest tickerId when a symbol is shared
+        if self._tickerSymbols.get(symbol, tickerId) >= tickerId:
+            self._tickerSymbols[symbol] = tickerId
+
+        if tickerId >= self._nextTickerId:
+            self._nextTickerId = tickerId + 1
 
     # -----------------------------------------
     def tickerSymbol(self, tickerId):
@@ -1328,8 +1818,12 @@ class ezIBpy():
         return False
 
     # -----------------------------------------
-    def createContract(self, contractTuple, **kwargs):
+    def createContract(self, contractTuple, wait=True, timeout=10, **kwargs):
         # https://www.interactivebrokers.com/en/software/api/apiguide/java/contract.htm
+        """
+        creates a contract and requests its details. with `wait`,
+        blocks until contractDetailsEnd arrives (or `timeout` seconds)
+        """
 
         contractString = self.contractString(contractTuple)
         # print(contractString)
@@ -1360,19 +1854,103 @@ class ezIBpy():
 
         # add contract to pool
         self.contracts[tickerId] = newContract
+        if self.journal is not None:
+            self.journal.recordContract(tickerId, contractString, newContract)
+
+        # use cached contract details
+        if "comboLegs" not in kwargs and self.contractDetailsCache is not None:
+            cached = self.contractDetailsCache.load(contractString)
+            if cached is not None:
+                details, fresh = cached
+                self._replayContractDetails(tickerId, details)
+
+                # stale? refresh in the background
+                if not fresh:
+                    self._requestContractDetails(tickerId, newContract, waiter=False,
+                                                 contractString=contractString)
+                return newContract
 
         # request contract details
         if "comboLegs" not in kwargs:
-            try:
-                self.requestContractDetails(newContract)
-                time.sleep(1.5 if self.isMultiContract(newContract) else 0.5)
-            except KeyboardInterrupt:
-                sys.exit()
+            self.requestContractDetails(newContract)
+            if wait:
+                self.waitForContractDetails(tickerId, timeout)
 
         # print(vars(newContract))
         # print('Contract Values:%s,%s,%s,%s,%s,%s,%s:' % contractTuple)
         return newContract
 
+    # -----------------------------------------
+    def _replayContractDetails(self, tickerId, details):
+        """ feeds cached contractDetails replies through handleContractDetails """
+        for fields in details:
+            contractDetails = ContractDetails()
+            contractDetails.__dict__.update(fields)
+            msg = message.contractDetails(reqId=tickerId, contractDetails=contractDetails)
+            if self.journal is not None:
+                self.journal.record(msg)  # as if IB had sent it
+            self.handleContractDetails(msg)
+
+        msg = message.contractDetailsEnd(reqId=tickerId)
+        if self.journal is not None:
+            self.journal.record(msg)
+        self.handleContractDetails(msg, end=True)
+
+    # -----------------------------------------
+    def enableContractDetailsCache(self, path=None, ttl=86400):
+        """
+        cache contract details on disk so createContract() can skip
+        the IB round trip on restart. entries older than `ttl` seconds
+        are used, then refreshed in the background.
+        `path` defaults to ~/.ezibpy/contracts and must be private (0700)
+        """
+        if path is None:
+            path = os.path.join(DATA_DIR, "contracts")
+        self.contractDetailsCache = ContractDetailsCache(path, ttl=ttl)
+        return self.contractDetailsCache
+
+    # -----------------------------------------
+    def createContracts(self, contractTuples, timeout=10):
+        """
+        bulk createContract(): fires all contract details requests
+        at once and returns when all resolved (or timed out)
+        """
+        contractTuples = list(contractTuples)
+        tickerIds = [self.tickerId(self.contractString(contractTuple))
+                     for contractTuple in contractTuples]
+        contracts = [self.createContract(contractTuple, wait=False)
+                     for contractTuple in contractTuples]
+
+        deadline = time.time() + timeout
+        for tickerId in tickerIds:
+            self.waitForContractDetails(tickerId, max(deadline - time.time(), 0))
+
+        return contracts
+
+    # -----------------------------------------
+    def waitForContractDetails(self, contract_identifier, timeout=10):
+        """
+        blocks until the contract's details were downloaded.
+        returns False on timeout
+        """
+        if isinstance(contract_identifier, int):
+            tickerId = contract_identifier
+        else:
+            tickerId = self.tickerId(contract_identifier)
+
+        waiter = self._contractDetailsWaiters.get(tickerId)
+        if waiter is None:
+            return True
+
+        try:
+            resolved = waiter.wait(timeout)
+        except KeyboardInterrupt:
+            sys.exit()
+
+        if not resolved:
+            self.log.warning("[CONTRACT DETAILS TIMEOUT] %s", self.tickerSymbol(tickerId))
+        return resolved
+
     # shortcuts
     # -----------------------------------------
     def createStockContract(self, symbol, currency="USD", exchange="SMART"):
@@ -1384,11 +1962,9 @@ class ezIBpy():
     def createFuturesContract(self, symbol, currency="USD", expiry=None, exchange="GLOBEX"):
         expiry = [expiry] if not isinstance(expiry, list) else expiry
 
-        contracts = []
-        for fut_expiry in expiry:
-            contract_tuple = (symbol, "FUT", exchange, currency, fut_expiry, 0.0, "")
-            contract = self.createContract(contract_tuple)
-            contracts.append(contract)
+        contracts = self.createContracts([
+            (symbol, "FUT", exchange, currency, fut_expiry, 0.0, "")
+            for fut_expiry in expiry])
 
         return contracts[0] if len(contracts) == 1 else contracts
 
@@ -1406,14 +1982,11 @@ class ezIBpy():
         strike = [strike] if not isinstance(strike, list) else strike
         otype  = [otype] if not isinstance(otype, list) else otype
 
-        contracts = []
-        for opt_expiry in expiry:
-            for opt_strike in strike:
-                for opt_otype in otype:
-                    contract_tuple = (symbol, secType, exchange, currency,
-                                      opt_expiry, opt_strike, opt_otype)
-                    contract = self.createContract(contract_tuple)
-                    contracts.append(contract)
+        contracts = self.createContracts([
+            (symbol, secType, exchange, currency, opt_expiry, opt_strike, opt_otype)
+            for opt_expiry in expiry
+            for opt_strike in strike
+            for opt_otype in otype])
 
         return contracts[0] if len(contracts) == 1 else contracts
 
@@ -1562,8 +2135,7 @@ class ezIBpy():
                     parentId=parentId
                 )
 
-        self.requestOrderIds()
-        return self.placeOrder(contract, order, self.orderId + 1)
+        return self.placeOrder(contract, order)
 
     # -----------------------------------------
     def createBracketOrder(self, contract, quantity,
@@ -1597,8 +2169,7 @@ class ezIBpy():
                             tif       = tif
                         )
 
-            self.requestOrderIds()
-            targetOrderId = self.placeOrder(contract, targetOrder, self.orderId + 1)
+            targetOrderId = self.placeOrder(contract, targetOrder)
 
         # stop
         stopOrderId = 0
@@ -1614,8 +2185,7 @@ class ezIBpy():
                             stop_limit=stop_limit
                         )
 
-            self.requestOrderIds()
-            stopOrderId = self.placeOrder(contract, stopOrder, self.orderId + 2)
+            stopOrderId = self.placeOrder(contract, stopOrder)
 
         # triggered trailing stop?
         # if ("triggerPrice" in kwargs) & ("trailPercent" in kwargs):
@@ -1633,35 +2203,27 @@ class ezIBpy():
     def placeOrder(self, contract, order, orderId=None):
         """ Place order on IB TWS """
 
-        # get latest order id before submitting an order
-        self.requestOrderIds()
+        useOrderId = self.orderIdAllocator.next() if orderId == None else orderId
 
-        # continue...
-        useOrderId = self.orderId if orderId == None else orderId
-        self.ibConn.placeOrder(useOrderId, contract, order)
+        # stored first: the request may be paced (or dropped on disconnect)
+        self._storeOrder(OrderRecord(
+            id       = useOrderId,
+            symbol   = self.contractString(contract),
+            contract = contract,
+            order    = order,
+            status   = "SENT",
+            time     = self.clock.datetime()
+        ))
 
-        self.orders[useOrderId] = {
-            "id":       useOrderId,
-            "symbol":   self.contractString(contract),
-            "contract": contract,
-            "status":   "SENT",
-            "reason":   None,
-            "avgFillPrice": 0.,
-            "parentId": 0,
-            "time": datetime.fromtimestamp(int(self.time))
-        }
+        self.ibConn.placeOrder(useOrderId, contract, order)
 
-        # update order id for next time
-        self.requestOrderIds()
+        self.orderId = self.orderIdAllocator.peek()
         return useOrderId
 
     # -----------------------------------------
     def cancelOrder(self, orderId):
         """ cancel order on IB TWS """
         self.ibConn.cancelOrder(orderId)
-
-        # update order id for next time
-        self.requestOrderIds()
         return orderId
 
     # -----------------------------------------
@@ -1686,10 +2248,21 @@ class ezIBpy():
         self.ibConn.reqIds(numIds)
 
     # -----------------------------------------
-    def requestMarketDepth(self, contracts=None, num_rows=10):
+    def reserveOrderIds(self, count):
+        """
+        Reserve a block of consecutive order ids (ie. to hand over to
+        another process sharing this clientId). Returns a list of ids.
+        """
+        return self.orderIdAllocator.reserve(count)
+
+    # -----------------------------------------
+    def requestMarketDepth(self, contracts=None, num_rows=10, priority=0):
         """
         Register to streaming market data updates
         https://www.interactivebrokers.com/en/software/api/apiguide/java/reqmktdepth.htm
+
+        with enableMarketDataLines(), contracts are ranked by `priority`
+        for the account's depth slots
         """
 
         if num_rows > 10:
@@ -1700,10 +2273,18 @@ class ezIBpy():
         elif not isinstance(contracts, list):
             contracts = [contracts]
 
+        tickerIds = []
         for contract in contracts:
             tickerId = self.tickerId(self.contractString(contract))
-            self.ibConn.reqMktDepth(
-                tickerId, contract, num_rows)
+            self.marketDepthData.setDepth(tickerId, num_rows)
+            tickerIds.append(tickerId)
+
+            if self.marketDataLines is None:
+                self.ibConn.reqMktDepth(
+                    tickerId, contract, num_rows)
+
+        if self.marketDataLines is not None:
+            self.marketDataLines.watchDepth(tickerIds, priority)
 
     # -----------------------------------------
     def cancelMarketDepth(self, contracts=None):
@@ -1716,38 +2297,49 @@ class ezIBpy():
         elif not isinstance(contracts, list):
             contracts = [contracts]
 
-        for contract in contracts:
-            tickerId = self.tickerId(self.contractString(contract))
+        tickerIds = [self.tickerId(self.contractString(contract)) for contract in contracts]
+        if self.marketDataLines is not None:
+            return self.marketDataLines.unwatchDepth(tickerIds)
+
+        for tickerId in tickerIds:
             self.ibConn.cancelMktDepth(tickerId=tickerId)
 
     # -----------------------------------------
-    def requestMarketData(self, contracts=None, snapshot=False):
+    def requestMarketData(self, contracts=None, snapshot=False, priority=0):
         """
         Register to streaming market data updates
         https://www.interactivebrokers.com/en/software/api/apiguide/java/reqmktdata.htm
+
+        with enableMarketDataLines(), contracts are ranked by `priority`
+        and streamed or rotated through snapshots by the line manager
         """
         if contracts == None:
             contracts = list(self.contracts.values())
         elif not isinstance(contracts, list):
             contracts = [contracts]
 
+        # get market data for single contracts only
+        contracts = [contract for contract in contracts if not self.isMultiContract(contract)]
+
+        if self.marketDataLines is not None and not snapshot:
+            tickerIds = [self.tickerId(self.contractString(contract)) for contract in contracts]
+            return self.marketDataLines.watch(tickerIds, priority)
+
         for contract in contracts:
-            if snapshot:
-                reqType = ""
-            else:
-                reqType = dataTypes["GENERIC_TICKS_RTVOLUME"]
-                if contract.m_secType in ("OPT", "FOP"):
-                    reqType = dataTypes["GENERIC_TICKS_NONE"]
+            self._requestMarketData(contract, snapshot)
 
-            # get market data for single contract
-            # limit is 250 requests/second
-            if not self.isMultiContract(contract):
-                try:
-                    tickerId = self.tickerId(self.contractString(contract))
-                    self.ibConn.reqMktData(tickerId, contract, reqType, snapshot)
-                    time.sleep(0.0042)  # 250 = 1.05s
-                except KeyboardInterrupt:
-                    sys.exit()
+    # -----------------------------------------
+    def _requestMarketData(self, contract, snapshot=False):
+        if snapshot:
+            reqType = ""
+        else:
+            reqType = dataTypes["GENERIC_TICKS_RTVOLUME"]
+            if contract.m_secType in ("OPT", "FOP"):
+                reqType = dataTypes["GENERIC_TICKS_NONE"]
+
+        # (paced by self.ibConn)
+        tickerId = self.tickerId(self.contractString(contract))
+        self.ibConn.reqMktData(tickerId, contract, reqType, snapshot)
 
     # -----------------------------------------
     def cancelMarketData(self, contracts=None):
@@ -1760,26 +2352,82 @@ class ezIBpy():
         elif not isinstance(contracts, list):
             contracts = [contracts]
 
-        for contract in contracts:
-            # tickerId = self.tickerId(contract.m_symbol)
-            tickerId = self.tickerId(self.contractString(contract))
+        # tickerId = self.tickerId(contract.m_symbol)
+        tickerIds = [self.tickerId(self.contractString(contract)) for contract in contracts]
+        if self.marketDataLines is not None:
+            return self.marketDataLines.unwatch(tickerIds)
+
+        for tickerId in tickerIds:
+            self.ibConn.cancelMktData(tickerId=tickerId)
+
+    # -----------------------------------------
+    def enableMarketDataLines(self, maxLines=100, snapshotLines=10, refresh=60,
+                              depthSlots=3, depthRefresh=10, rejectBackoff=30):
+        """
+        Multiplexes more symbols than the account's market data lines:
+        requestMarketData() keeps the highest priority contracts streaming
+        within `maxLines` and rotates the rest through snapshots (every
+        `refresh` secs, `snapshotLines` at a time). requestMarketDepth()
+        does the same with the `depthSlots` depth slots. Symbols IB
+        refuses a line for sit out `rejectBackoff`+ secs.
+        See marketDataFreshness() for the age of each symbol's data.
+        """
+        if self.marketDataLines is None:
+            self.marketDataLines = MarketDataLines(
+                self._sendLineRequest, maxLines=maxLines, snapshotLines=snapshotLines,
+                refresh=refresh, depthSlots=depthSlots, depthRefresh=depthRefresh,
+                rejectBackoff=rejectBackoff)
+        return self.marketDataLines
+
+    # -----------------------------------------
+    def _sendLineRequest(self, action, tickerId):
+        """ called by the line manager """
+        if action == "cancel":
             self.ibConn.cancelMktData(tickerId=tickerId)
+        elif action == "cancelDepth":
+            self.ibConn.cancelMktDepth(tickerId=tickerId)
+        else:
+            contract = self.contracts[tickerId]
+            if action == "depth":
+                self.ibConn.reqMktDepth(tickerId, contract,
+                                        self.marketDepthData.book(tickerId).depth)
+            else:
+                self._requestMarketData(contract, snapshot=(action == "snapshot"))
+
+    # -----------------------------------------
+    def marketDataFreshness(self, symbols=None):
+        """ seconds since the last quote per symbol (None = none yet) """
+        if self.marketDataLines is None:
+            return {}
+
+        tickerIds = None
+        if symbols is not None:
+            tickerIds = self.tickerIdsFor(symbols)
+
+        return {self.tickerSymbol(tickerId): age for tickerId, age
+                in self.marketDataLines.freshness(tickerIds).items()}
 
     # -----------------------------------------
     def requestHistoricalData(self, contracts=None, resolution="1 min",
             lookback="1 D", data="TRADES", end_datetime=None, rth=False,
-            csv_path=None, format_date=2, utc=False):
+            csv_path=None, format_date=2, utc=False, callback=None, progress=None):
 
         """
         Download to historical data
         https://www.interactivebrokers.com/en/software/api/apiguide/java/reqhistoricaldata.htm
-        """
 
-        self.csv_path = csv_path
-        self.utc_history = utc
+        requests are queued and paced to IB's historical data limits
+        (see setHistoryPacing()), and lookbacks longer than the bar size
+        allows are split into chunks.
+
+        returns a Future (or a list of Futures) resolving to each contract's
+        DataFrame. `callback(symbol, df)` is called as each download completes,
+        `progress(symbol, bars_received)` as bars arrive
+        """
 
-        if end_datetime == None:
-            end_datetime = time.strftime(dataTypes["DATE_TIME_FORMAT_HISTORY"])
+        # "" / None / "now" => now (raises on malformed dates)
+        end, tz = parse_end_datetime(end_datetime)
+        end_datetime = end.strftime(dataTypes["DATE_TIME_FORMAT_HISTORY"]) + tz
 
         if contracts == None:
             contracts = list(self.contracts.values())
@@ -1787,24 +2435,124 @@ class ezIBpy():
         if not isinstance(contracts, list):
             contracts = [contracts]
 
+        # one download per contract at a time
+        running = [self.contractString(contract) for contract in contracts
+                   if self.tickerId(self.contractString(contract)) in self._historyJobs]
+        if running:
+            raise ValueError("Historical data download already running for %s "
+                             "(wait for it or use cancelHistoricalData())" % ", ".join(running))
+
+        futures = []
         for contract in contracts:
             show = str(data).upper()
             if contract.m_secType in ['CASH', 'CFD'] and data == 'TRADES':
                 show = 'MIDPOINT'
 
             # tickerId = self.tickerId(contract.m_symbol)
-            tickerId = self.tickerId(self.contractString(contract))
-            self.ibConn.reqHistoricalData(
-                tickerId       = tickerId,
-                contract       = contract,
-                endDateTime    = end_datetime,
-                durationStr    = lookback,
-                barSizeSetting = resolution,
-                whatToShow     = show,
-                useRTH         = int(rth),
-                formatDate     = int(format_date)
-            )
+            contractString = self.contractString(contract)
+            tickerId = self.tickerId(contractString)
+
+            job = self._newHistoryJob(contractString,
+                csv_path=csv_path, utc=utc, callback=callback, progress=progress)
+            job["tickerId"] = tickerId
+            futures.append(job["future"])
+
+            # only download what the cache doesn't have
+            ranges = [(end_datetime, lookback)]
+            if self.historyCache is not None:
+                # the cache works in UTC, whatever timezone end_datetime is in
+                job["end"] = to_utc(end, tz)
+                job["start"] = job["end"] - timedelta(seconds=duration_to_seconds(lookback))
+                job["cacheKey"] = (contractString, resolution, show, int(rth))
+                job["downloaded"] = []
+
+                ranges = [(range_end.strftime(dataTypes["DATE_TIME_FORMAT_HISTORY"]) + " GMT",
+                           seconds_to_duration((range_end - range_start).total_seconds()))
+                          for range_start, range_end in self.historyCache.missing(
+                              job["cacheKey"], job["start"], job["end"])]
+
+            # split into chunks IB accepts for this bar size
+            chunks = [chunk for range_end, duration in ranges
+                      for chunk in history_chunks(range_end, duration, resolution)]
+
+            # chunks round the lookback up: keep just the window asked for
+            if len(chunks) > 1:
+                window_end = end if not tz.strip() else from_utc(to_utc(end, tz))
+                job["window"] = (window_end - timedelta(
+                    seconds=duration_to_seconds(lookback)), window_end)
+
+            if not chunks:
+                self._completeHistoryJob(job)
+                continue
+
+            self._historyJobs[tickerId] = job
+            for chunk_end, chunk_duration in chunks:
+                # own reqIds: market data errors on tickerId can't end the job
+                reqId = self._nextHistoryReqId
+                self._nextHistoryReqId += 1
+
+                request = self._newHistoryRequest(reqId, job,
+                    contract       = contract,
+                    endDateTime    = chunk_end,
+                    durationStr    = chunk_duration,
+                    barSizeSetting = resolution,
+                    whatToShow     = show,
+                    useRTH         = int(rth),
+                    formatDate     = int(format_date),
+                    identity       = (contractString, chunk_end, chunk_duration,
+                                      resolution, show, int(rth)),
+                    contractKey    = (contractString, contract.m_exchange, show)
+                )
+
+                # the (UTC) range this chunk adds to the cache once it succeeds
+                if self.historyCache is not None:
+                    chunk_utc = to_utc(*parse_end_datetime(chunk_end))
+                    request["cacheRange"] = (chunk_utc - timedelta(
+                        seconds=duration_to_seconds(chunk_duration)), chunk_utc)
+                self.historyScheduler.submit(request)
+
+        return futures[0] if len(futures) == 1 else futures
+
+    # -----------------------------------------
+    def setHistoryPacing(self, **settings):
+        """
+        changes the historical data pacing limits, ie.
+        setHistoryPacing(max_requests=50, paced_bar_sizes=()).
+
+        settings: max_requests/period (secs), identical_gap (secs),
+        burst/burst_period (secs) and paced_bar_sizes (the bar sizes
+        the limits apply to; IB enforces them for 30 secs or less)
+        """
+        self.historyScheduler.configure(**settings)
+
+    # -----------------------------------------
+    def enableHistoryCache(self, path=None):
+        """
+        cache downloaded bars on disk so requestHistoricalData()
+        only asks IB for the ranges it hasn't seen before
+        """
+        if path is None:
+            path = private_dir(os.path.join(DATA_DIR, "history"))
+        self.historyCache = HistoryCache(path)
+        return self.historyCache
+
+    # -----------------------------------------
+    def cachedHistoricalData(self, contract_identifier, resolution="1 min",
+            data="TRADES", rth=False, start=None, end=None):
+        """ reads bars from the history cache (no IB request), in local time """
+        if self.historyCache is None:
+            raise ValueError("History cache is disabled. Use enableHistoryCache() first")
+
+        symbol = contract_identifier
+        if isinstance(symbol, Contract):
+            symbol = self.contractString(symbol)
+
+        key = (symbol, resolution, str(data).upper(), int(rth))
+        return frame_to_local(self.historyCache.frame(key,
+            None if start is None else to_utc(start),
+            None if end is None else to_utc(end)))
 
+    # -----------------------------------------
     def cancelHistoricalData(self, contracts=None):
         """ cancel historical data stream """
         if contracts == None:
@@ -1815,7 +2563,20 @@ class ezIBpy():
         for contract in contracts:
             # tickerId = self.tickerId(contract.m_symbol)
             tickerId = self.tickerId(self.contractString(contract))
-            self.ibConn.cancelHistoricalData(tickerId=tickerId)
+
+            if tickerId not in self._historyJobs:
+                self.ibConn.cancelHistoricalData(tickerId=tickerId)
+                continue
+
+            job = self._historyJobs.pop(tickerId)
+            self.historyScheduler.cancel(job["reqIds"])
+            job["completed"] = True
+            job["future"].cancel()
+
+            for reqId in job["reqIds"]:
+                request = self._historyRequests.pop(reqId, None)
+                if request is not None and request.get("sent"):
+                    self.ibConn.cancelHistoricalData(tickerId=reqId)
 
     # -----------------------------------------
     def requestPositionUpdates(self, subscribe=True):
@@ -1843,7 +2604,20 @@ class ezIBpy():
         Register to contract details
         https://www.interactivebrokers.com/en/software/api/apiguide/java/reqcontractdetails.htm
         """
-        self.ibConn.reqContractDetails(self.tickerId(contract), contract)
+        self._requestContractDetails(self.tickerId(contract), contract)
+
+    # -----------------------------------------
+    def _requestContractDetails(self, tickerId, contract, waiter=True, contractString=None):
+        # contractString = cache key of the replies
+        if contractString is None:
+            contractString = self.tickerSymbol(tickerId)
+        self._contractDetailsPending[tickerId] = contractString
+
+        # released by contractDetailsEnd (or an error)
+        if waiter and tickerId not in self._contractDetailsWaiters:
+            self._contractDetailsWaiters[tickerId] = threading.Event()
+
+        self.ibConn.reqContractDetails(tickerId, contract)
 
     # -----------------------------------------
     def getConId(self, contract_identifier):
@@ -1862,12 +2636,8 @@ class ezIBpy():
         """
         leg = ComboLeg()
 
-        loops = 0
-        conId = 0
-        while conId == 0 and loops < 100:
-            conId = self.getConId(contract)
-            loops += 1
-            time.sleep(0.05)
+        self.waitForContractDetails(contract, timeout=5)
+        conId = self.getConId(contract)
 
         leg.m_conId = conId
         leg.m_ratio = abs(ratio)
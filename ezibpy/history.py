@@ -0,0 +1,536 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+#
+# ezIBpy: Pythonic Wrapper for IbPy
+# https://github.com/ranaroussi/ezibpy
+#
+# Copyright 2015 Ran Aroussi
+#
+# Licensed under the GNU Lesser General Public License, v3.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.gnu.org/licenses/lgpl-3.0.en.html
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import calendar
+import json
+import logging
+import os
+import threading
+import time
+
+from collections import deque
+from datetime import datetime, timedelta
+
+import numpy as np
+from dateutil import tz as dateutil_tz
+from pandas import DataFrame, DatetimeIndex, concat
+
+from .utils import dataTypes
+
+
+# ---------------------------------------------
+
+BAR_FIELDS = np.dtype([
+    ("datetime", "M8[s]"), ("O", "f8"), ("H", "f8"), ("L", "f8"),
+    ("C", "f8"), ("V", "i8"), ("OI", "i8"), ("WAP", "f8"),
+])
+
+# https://interactivebrokers.github.io/tws-api/historical_limitations.html
+# bar size => longest duration allowed per request
+MAX_DURATIONS = {
+    "1 secs": "1800 S", "5 secs": "3600 S", "10 secs": "14400 S",
+    "15 secs": "14400 S", "30 secs": "28800 S",
+    "1 min": "1 D", "2 mins": "2 D", "3 mins": "1 W", "5 mins": "1 W",
+    "10 mins": "1 W", "15 mins": "1 W", "20 mins": "1 W", "30 mins": "1 M",
+    "1 hour": "1 M", "2 hours": "1 M", "3 hours": "1 M", "4 hours": "1 M",
+    "8 hours": "1 M", "1 day": "1 Y", "1 week": "20 Y", "1 month": "20 Y",
+}
+
+DURATION_SECONDS = {"S": 1, "D": 86400, "W": 604800, "M": 2592000, "Y": 31536000}
+
+# bar sizes IB's historical data pacing rules apply to (30 secs or less)
+SMALL_BAR_SIZES = ("1 secs", "5 secs", "10 secs", "15 secs", "30 secs")
+
+# historicalData error codes that end a request
+HISTORY_ERROR_CODES = (162, 200, 321, 322, 366)
+
+# HistoryCache coverage (naive UTC)
+COVERAGE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+# ---------------------------------------------
+
+def duration_to_seconds(duration):
+    """ converts an IB duration string ("3 D", "1800 S", ...) to seconds """
+    value, unit = duration.split()
+    return int(value) * DURATION_SECONDS[unit.upper()]
+
+
+# ---------------------------------------------
+
+def parse_end_datetime(end_datetime):
+    """
+    splits an IB endDateTime ("20170101 16:00:00", optionally followed
+    by a timezone) into (datetime, timezone suffix). None, "" or "now"
+    mean the current (local) time.
+    """
+    if end_datetime is None or end_datetime.strip().lower() in ("", "now"):
+        return datetime.now().replace(microsecond=0), ""
+
+    try:
+        return (datetime.strptime(end_datetime[:17], dataTypes["DATE_TIME_FORMAT_HISTORY"]),
+                end_datetime[17:])
+    except ValueError:
+        raise ValueError("end_datetime must be 'YYYYMMDD HH:MM:SS [TZ]' "
+                         "(or empty for now), got %r" % (end_datetime,))
+
+
+# ---------------------------------------------
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_utc(dt, tz=""):
+    """ naive datetime in timezone `tz` (local time if empty) => naive UTC """
+    tz = tz.strip()
+    if not tz:
+        return EPOCH + timedelta(seconds=time.mktime(dt.timetuple()))
+
+    zone = dateutil_tz.gettz(tz)
+    if zone is None:
+        raise ValueError("Unknown timezone in end_datetime: %r" % tz)
+    return dt.replace(tzinfo=zone).astimezone(dateutil_tz.tzutc()).replace(tzinfo=None)
+
+
+def from_utc(dt):
+    """ naive UTC datetime => naive local datetime """
+    return datetime.fromtimestamp(calendar.timegm(dt.timetuple()))
+
+
+def _local_offsets(seconds, local):
+    """ UTC offset (secs) of the local timezone at each of `seconds` """
+    hours, inverse = np.unique(seconds // 3600, return_inverse=True)
+    if local:  # seconds are local wall-clock times
+        offsets = [hour * 3600 - time.mktime(time.gmtime(hour * 3600)[:8] + (-1,))
+                   for hour in hours.tolist()]
+    else:
+        offsets = [calendar.timegm(time.localtime(hour * 3600)) - hour * 3600
+                   for hour in hours.tolist()]
+    return np.array(offsets, dtype="i8")[inverse]
+
+
+def local_to_utc_times(times):
+    """ naive local datetime64 values => naive UTC datetime64[s] """
+    seconds = np.asarray(times, dtype="M8[s]").astype("i8")
+    if len(seconds):
+        seconds = seconds - _local_offsets(seconds, local=True)
+    return seconds.astype("M8[s]")
+
+
+def utc_to_local_times(times):
+    """ naive UTC datetime64 values => naive local datetime64[s] """
+    seconds = np.asarray(times, dtype="M8[s]").astype("i8")
+    if len(seconds):
+        seconds = seconds + _local_offsets(seconds, local=False)
+    return seconds.astype("M8[s]")
+
+
+def frame_to_utc(df):
+    """ copy of a bars DataFrame with its (local) index in UTC """
+    df = df.copy()
+    df.index = DatetimeIndex(local_to_utc_times(df.index.values), name="datetime")
+    return df
+
+
+def frame_to_local(df):
+    """ copy of a bars DataFrame with its (UTC) index in local time """
+    df = df.copy()
+    df.index = DatetimeIndex(utc_to_local_times(df.index.values), name="datetime")
+    return df
+
+
+# ---------------------------------------------
+
+def history_chunks(end_datetime, duration, resolution):
+    """
+    splits a (end_datetime, duration) request into a list of
+    (endDateTime, durationStr) tuples that each fit IB's
+    maximum duration for the bar size, newest first
+    """
+    window = MAX_DURATIONS.get(resolution)
+    if window is None or duration_to_seconds(duration) <= duration_to_seconds(window):
+        return [(end_datetime, duration)]
+
+    # keep a trailing timezone (ie. "20170101 16:00:00 EST")
+    end, tz = parse_end_datetime(end_datetime)
+
+    step = timedelta(seconds=duration_to_seconds(window))
+    count = -(-duration_to_seconds(duration) // duration_to_seconds(window))
+
+    return [((end - step * i).strftime(dataTypes["DATE_TIME_FORMAT_HISTORY"]) + tz, window)
+            for i in range(count)]
+
+
+# ---------------------------------------------
+
+def stitch_bars(frames):
+    """ joins chunked downloads into one sorted, de-duplicated DataFrame """
+    frames = [df for df in frames if len(df) > 0]
+    if not frames:
+        return BarBuffer(1).frame()
+    if len(frames) == 1:
+        return frames[0]
+
+    df = concat(frames).sort_index()
+    return df[~df.index.duplicated(keep="last")]
+
+
+# ---------------------------------------------
+
+def parse_bar_date(date):
+    """ converts historicalData's msg.date (any formatDate) to datetime """
+    if len(date) <= 8:  # daily
+        return datetime.strptime(date, dataTypes["DATE_FORMAT"])
+    if date.isdigit():  # formatDate=2
+        return datetime.fromtimestamp(int(date))
+    return datetime.strptime(" ".join(date.split()), dataTypes["DATE_TIME_FORMAT"])
+
+
+# ---------------------------------------------
+
+class BarBuffer(object):
+    """ preallocated (amortized growth) buffer of historical bars """
+
+    def __init__(self, capacity=1024):
+        self._data = np.zeros(max(int(capacity), 1), dtype=BAR_FIELDS)
+        self._count = 0
+
+    # -----------------------------------------
+    def append(self, ts, o, h, l, c, v, oi, wap):
+        if self._count >= len(self._data):
+            data = np.zeros(len(self._data) * 2, dtype=BAR_FIELDS)
+            data[:self._count] = self._data
+            self._data = data
+
+        self._data[self._count] = (ts, o, h, l, c, v, oi, wap)
+        self._count += 1
+
+    # -----------------------------------------
+    def frame(self):
+        """ returns the bars as a DataFrame with a datetime64 index """
+        bars = self._data[:self._count]
+        df = DataFrame({field: bars[field] for field in BAR_FIELDS.names[1:]},
+                       index=DatetimeIndex(bars["datetime"], name="datetime"))
+        return df
+
+    def __len__(self):
+        return self._count
+
+
+# ---------------------------------------------
+
+class HistoricalScheduler(object):
+    """
+    Queues reqHistoricalData calls and releases them without breaking
+    IB's pacing rules: no more than `max_requests` per `period` seconds,
+    no identical request within `identical_gap` seconds and no more than
+    `burst` requests for the same contract/exchange/tick type within
+    `burst_period` seconds.
+
+    IB only enforces these for small bars, so requests whose
+    "barSizeSetting" isn't in `paced_bar_sizes` skip them (and don't
+    count towards them); they still wait for their `delay`.
+
+    Every queued request is a dict with "identity" and "contractKey"
+    tuples; `send(request)` is called from the scheduler thread.
+    """
+
+    SETTINGS = ("max_requests", "period", "identical_gap", "burst",
+                "burst_period", "paced_bar_sizes")
+
+    def __init__(self, send, max_requests=60, period=600, identical_gap=15,
+                 burst=6, burst_period=2, paced_bar_sizes=SMALL_BAR_SIZES):
+        self._send = send
+        self.max_requests = max_requests
+        self.period = period
+        self.identical_gap = identical_gap
+        self.burst = burst
+        self.burst_period = burst_period
+        self.paced_bar_sizes = tuple(paced_bar_sizes)
+
+        self._queue = deque()
+        self._sent = deque()      # send times within period
+        self._identical = {}      # identity => last send time
+        self._contracts = {}      # contractKey => deque of send times
+        self._cond = threading.Condition()
+        self._thread = None
+
+        self.log = logging.getLogger('ezibpy')
+
+    # -----------------------------------------
+    def submit(self, request, delay=0):
+        """ queue a request, optionally not before `delay` seconds """
+        request["notBefore"] = time.monotonic() + delay
+
+        with self._cond:
+            if delay > 0:
+                self._queue.appendleft(request)
+            else:
+                self._queue.append(request)
+
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="ezibpy-history", daemon=True)
+                self._thread.start()
+
+            self._cond.notify()
+
+    # -----------------------------------------
+    def cancel(self, reqIds):
+        """ drop queued (not yet sent) requests """
+        reqIds = set(reqIds)
+        with self._cond:
+            self._queue = deque(request for request in self._queue
+                                if request["reqId"] not in reqIds)
+
+    # -----------------------------------------
+    def pending(self):
+        return len(self._queue)
+
+    # -----------------------------------------
+    def configure(self, **settings):
+        """ changes the pacing limits (any of SETTINGS) """
+        unknown = set(settings) - set(self.SETTINGS)
+        if unknown:
+            raise ValueError("Unknown history pacing setting(s): %s" % ", ".join(sorted(unknown)))
+
+        if "paced_bar_sizes" in settings:
+            settings["paced_bar_sizes"] = tuple(settings["paced_bar_sizes"])
+
+        with self._cond:
+            for name, value in settings.items():
+                setattr(self, name, value)
+            self._cond.notify()
+
+    # -----------------------------------------
+    def _paced(self, request):
+        return request.get("barSizeSetting") in self.paced_bar_sizes
+
+    # -----------------------------------------
+    def _next(self, now):
+        """ returns (request, wait): the first request allowed to go now,
+        or None and the number of seconds until one might be """
+        while self._sent and self._sent[0] <= now - self.period:
+            self._sent.popleft()
+
+        full = len(self._sent) >= self.max_requests
+
+        wait = self.period
+        for request in self._queue:
+            ready = request["notBefore"]
+
+            if self._paced(request):
+                if full:
+                    ready = max(ready, self._sent[0] + self.period)
+
+                last = self._identical.get(request["identity"])
+                if last is not None:
+                    ready = max(ready, last + self.identical_gap)
+
+                sent = self._contracts.get(request["contractKey"])
+                if sent is not None:
+                    while sent and sent[0] <= now - self.burst_period:
+                        sent.popleft()
+                    if len(sent) >= self.burst:
+                        ready = max(ready, sent[0] + self.burst_period)
+
+            if ready <= now:
+                return request, 0
+            wait = min(wait, ready - now)
+
+        return None, wait
+
+    # -----------------------------------------
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._queue:
+                        self._cond.wait()
+                        continue
+
+                    now = time.monotonic()
+                    request, wait = self._next(now)
+                    if request is not None:
+                        break
+                    self._cond.wait(wait)
+
+                self._queue.remove(request)
+                if self._paced(request):
+                    self._sent.append(now)
+                    self._identical[request["identity"]] = now
+                    self._contracts.setdefault(request["contractKey"], deque()).append(now)
+
+                    # forget identities that can no longer block anything
+                    if len(self._identical) > self.max_requests * 10:
+                        self._identical = {key: sent for key, sent in self._identical.items()
+                                           if sent > now - self.identical_gap}
+
+            try:
+                self._send(request)
+            except Exception as e:
+                self.log.error("[HISTORICAL DATA REQUEST FAILED] %s", e)
+
+
+# ---------------------------------------------
+
+def seconds_to_duration(seconds):
+    """ smallest IB duration string covering `seconds` """
+    seconds = max(int(seconds), 1)
+    if seconds <= 86400:
+        return "%d S" % seconds
+    if seconds <= DURATION_SECONDS["Y"]:
+        return "%d D" % -(-seconds // 86400)
+    return "%d Y" % -(-seconds // DURATION_SECONDS["Y"])
+
+
+# ---------------------------------------------
+
+class HistoryCache(object):
+    """
+    On-disk cache of historical bars. Every (contractString, bar size,
+    whatToShow, rth) key is stored as a NumPy structured array (.npy,
+    loaded memory-mapped) plus a small .json with the covered range.
+
+    All datetimes (bars and coverage) are naive UTC, so requests made
+    in different timezones share the cache correctly.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        self._lock = threading.Lock()
+
+    # -----------------------------------------
+    def _file(self, key, ext):
+        name = "_".join(str(part) for part in key)
+        name = "".join(c if c.isalnum() or c in "-." else "_" for c in name)
+        return os.path.join(self.path, name + ext)
+
+    # -----------------------------------------
+    def coverage(self, key):
+        """ returns the (start, end) datetimes covered by the cache, or None """
+        try:
+            with open(self._file(key, ".json")) as f:
+                meta = json.load(f)
+        except (IOError, ValueError):
+            return None
+        return (datetime.strptime(meta["start"], COVERAGE_FORMAT),
+                datetime.strptime(meta["end"], COVERAGE_FORMAT))
+
+    # -----------------------------------------
+    def bars(self, key, mmap=True):
+        """ returns the cached bars as a (memory-mapped) structured array """
+        try:
+            return np.load(self._file(key, ".npy"), mmap_mode="r" if mmap else None)
+        except IOError:
+            return np.zeros(0, dtype=BAR_FIELDS)
+
+    # -----------------------------------------
+    def frame(self, key, start=None, end=None):
+        """ returns cached bars between start and end as a DataFrame """
+        bars = self.bars(key)
+        times = bars["datetime"]
+
+        lo, hi = 0, len(bars)
+        if start is not None:
+            lo = np.searchsorted(times, np.datetime64(start, "s"), side="left")
+        if end is not None:
+            hi = np.searchsorted(times, np.datetime64(end, "s"), side="right")
+
+        bars = np.array(bars[lo:hi])  # copy out of the memory map
+        return DataFrame({field: bars[field] for field in BAR_FIELDS.names[1:]},
+                         index=DatetimeIndex(bars["datetime"], name="datetime"))
+
+    # -----------------------------------------
+    def update(self, key, df, start, end):
+        """ merges downloaded bars (covering start..end) into the cache """
+        new = np.zeros(len(df), dtype=BAR_FIELDS)
+        new["datetime"] = df.index.values.astype("M8[s]")
+        for field in BAR_FIELDS.names[1:]:
+            new[field] = df[field].values
+
+        with self._lock:
+            old = self.bars(key, mmap=False)
+            bars = np.concatenate((new, old))  # new bars win on duplicates
+            _, unique = np.unique(bars["datetime"], return_index=True)
+            bars = bars[unique]
+
+            coverage = self.coverage(key)
+            if coverage is not None:
+                start = min(start, coverage[0])
+                end = max(end, coverage[1])
+
+            tmp = self._file(key, ".npy.tmp")
+            with open(tmp, "wb") as f:
+                np.save(f, bars)
+            os.replace(tmp, self._file(key, ".npy"))
+
+            tmp = self._file(key, ".json.tmp")
+            with open(tmp, "w") as f:
+                json.dump({"start": start.strftime(COVERAGE_FORMAT),
+                           "end": end.strftime(COVERAGE_FORMAT)}, f)
+            os.replace(tmp, self._file(key, ".json"))
+
+    # -----------------------------------------
+    def missing(self, key, start, end):
+        """
+        returns the [(start, end), ...] ranges not in the cache.
+        coverage is a single range, so a window past either end of it
+        also fetches the gap in between (update() will claim it)
+        """
+        coverage = self.coverage(key)
+        if coverage is None:
+            return [(start, end)]
+
+        ranges = []
+        if end > coverage[1]:
+            ranges.append((coverage[1], end))
+        if start < coverage[0]:
+            ranges.append((start, coverage[0]))
+        return ranges
+
+
+# ---------------------------------------------
+
+def claimable_ranges(ranges, coverage=None):
+    """
+    of the (start, end) ranges downloaded, those that can be added to a
+    cache covering `coverage` without claiming a gap: the ones connected
+    to it (or, with nothing cached yet, to the newest range)
+    """
+    remaining = sorted(ranges)
+    if not remaining:
+        return []
+
+    lo, hi = coverage if coverage is not None else remaining[-1]
+    claimed = []
+
+    grown = True
+    while grown:
+        grown = False
+        for start, end in list(remaining):
+            if start <= hi and end >= lo:
+                claimed.append((start, end))
+                remaining.remove((start, end))
+                lo, hi = min(lo, start), max(hi, end)
+                grown = True
+
+    return sorted(claimed)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+#
+# ezIBpy: Pythonic Wrapper for IbPy
+# https://github.com/ranaroussi/ezibpy
+#
+# Copyright 2015 Ran Aroussi
+#
+# Licensed under the GNU Lesser General Public License, v3.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.gnu.org/licenses/lgpl-3.0.en.html
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import pickle
+import struct
+import threading
+import time
+
+from ib.ext.Contract import Contract
+from ib.opt import message
+
+from .utils import open_private
+
+
+# ---------------------------------------------
+
+JOURNAL_MAGIC = b"EZIBJNL1"
+
+# receive time (epoch seconds), typeName length, payload length
+JOURNAL_RECORD = struct.Struct("<dHI")
+
+# typeName of the records registering a contract (not an IB message)
+CONTRACT_RECORD = "ezibpy.contract"
+
+
+# ---------------------------------------------
+
+class ContractRecord(object):
+    """ a journaled tickerId => (symbol, contract) registration """
+    __slots__ = ("typeName", "tickerId", "symbol", "contract")
+
+    def __init__(self, tickerId, symbol, contract):
+        self.typeName = CONTRACT_RECORD
+        self.tickerId = tickerId
+        self.symbol = symbol
+        self.contract = contract
+
+    def items(self):
+        return [("tickerId", self.tickerId), ("symbol", self.symbol),
+                ("contract", dict(vars(self.contract)))]
+
+
+# ---------------------------------------------
+
+class OfflineConnection(object):
+    """ stands in for ib.opt.Connection during replays: drops every request """
+
+    def __init__(self):
+        self.dropped = 0
+
+    def __getattr__(self, name):
+        def request(*args, **kwargs):
+            self.dropped += 1
+        return request
+
+
+# ---------------------------------------------
+
+class MessageJournal(object):
+    """
+    Append-only binary journal of inbound IbPy messages.
+
+    Layout: an 8-byte magic, then one record per message:
+    header (receive time, len(typeName), len(payload)), the typeName
+    and the pickled tuple of the message's field values.
+
+    Contracts known to the client are journaled too (CONTRACT_RECORD),
+    so a replay can rebuild them without a connection.
+
+    Replays unpickle the records, so the file is created 0600 and must
+    not exist yet; with `append`, an existing journal of ours is
+    extended instead (files owned/writable by others are refused).
+    """
+
+    def __init__(self, path, append=False):
+        self.path = path
+        self.count = 0
+        self._lock = threading.Lock()
+
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, mode=0o700, exist_ok=True)
+
+        if append:
+            fd = open_private(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+        else:
+            fd = open_private(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+
+        self._file = os.fdopen(fd, "ab")
+        if os.fstat(fd).st_size == 0:
+            self._file.write(JOURNAL_MAGIC)
+
+    # -----------------------------------------
+    def record(self, msg, received=None):
+        if received is None:
+            received = time.time()
+
+        typeName = msg.typeName.encode()
+        payload = pickle.dumps(tuple(value for _, value in msg.items()),
+                               protocol=pickle.HIGHEST_PROTOCOL)
+
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(JOURNAL_RECORD.pack(received, len(typeName), len(payload)))
+            self._file.write(typeName)
+            self._file.write(payload)
+            self.count += 1
+
+    # -----------------------------------------
+    def recordContract(self, tickerId, symbol, contract):
+        self.record(ContractRecord(tickerId, symbol, contract))
+
+    # -----------------------------------------
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    # -----------------------------------------
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+# ---------------------------------------------
+
+def read_journal(path):
+    """
+    yields (received, msg) from a journal, rebuilding IbPy messages.
+    records are unpickled: only read journals you (or ezIBpy) wrote
+    """
+    classes = {}
+
+    with open(path, "rb") as f:
+        if f.read(len(JOURNAL_MAGIC)) != JOURNAL_MAGIC:
+            raise ValueError("%s is not an ezIBpy message journal" % path)
+
+        while True:
+            header = f.read(JOURNAL_RECORD.size)
+            if len(header) < JOURNAL_RECORD.size:
+                return  # eof (or torn last record)
+
+            received, nameSize, payloadSize = JOURNAL_RECORD.unpack(header)
+            typeName = f.read(nameSize).decode()
+            payload = f.read(payloadSize)
+            if len(payload) < payloadSize:
+                return
+
+            values = pickle.loads(payload)
+
+            if typeName == CONTRACT_RECORD:
+                tickerId, symbol, fields = values
+                contract = Contract()
+                contract.__dict__.update(fields)
+                yield received, ContractRecord(tickerId, symbol, contract)
+                continue
+
+            if typeName not in classes:
+                classes[typeName] = message.registry[typeName][0]
+            msgClass = classes[typeName]
+
+            yield received, msgClass(**dict(zip(msgClass.__slots__, values)))
+
+
+# ---------------------------------------------
+
+def replay_journal(path, handler, speed=None):
+    """
+    feeds the messages of a journal to `handler` (ie. handleServerEvents).
+
+    `speed=None` replays as fast as possible, `speed=1` at the recorded
+    pace, `speed=10` ten times faster. Returns the number of messages.
+    """
+    count = 0
+    first = start = None
+
+    for received, msg in read_journal(path):
+        if speed:
+            if first is None:
+                first, start = received, time.monotonic()
+            wait = (received - first) / speed - (time.monotonic() - start)
+            if wait > 0:
+                time.sleep(wait)
+
+        handler(msg)
+        count += 1
+
+    return count
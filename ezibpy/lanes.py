@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+#
+# ezIBpy: Pythonic Wrapper for IbPy
+# https://github.com/ranaroussi/ezibpy
+#
+# Copyright 2015 Ran Aroussi
+#
+# Licensed under the GNU Lesser General Public License, v3.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.gnu.org/licenses/lgpl-3.0.en.html
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import logging
+import threading
+import time
+
+from collections import deque
+
+
+# ---------------------------------------------
+
+LANES = ("orders", "account", "marketdata")
+ORDERS_LANE, ACCOUNT_LANE, MARKET_DATA_LANE = range(len(LANES))
+
+# msg.typeName => lane (anything else is market data)
+MESSAGE_LANES = dict(
+    [(typeName, ORDERS_LANE) for typeName in (
+        "error", "connectionClosed", "currentTime", "nextValidId", "managedAccounts",
+        "orderStatus", "openOrder", "openOrderEnd", "execDetails", "execDetailsEnd",
+        "commissionReport")] +
+    [(typeName, ACCOUNT_LANE) for typeName in (
+        "updateAccountValue", "updateAccountTime", "updatePortfolio",
+        "accountDownloadEnd", "position", "positionEnd", "accountSummary",
+        "accountSummaryEnd", "contractDetails", "bondContractDetails",
+        "contractDetailsEnd")]
+)
+
+
+# ---------------------------------------------
+
+class PriorityLanes(object):
+    """
+    Sorts inbound messages into priority lanes and dispatches them to
+    `handler` from a single thread, always draining the highest lane
+    first: orders/errors/connection, then account/positions, then market
+    data. Messages keep their arrival order within a lane.
+
+    put() only appends to a deque, so IbPy's reader thread is never held
+    up by slow handlers. `route(msg)` may override the lane of a single
+    message (ie. to keep an error behind the data of the same reqId);
+    it returns a lane or None for the default.
+    """
+
+    def __init__(self, handler, lanes=None, route=None, name="ezibpy-dispatcher"):
+        self.handler = handler
+        self.lanes = dict(MESSAGE_LANES, **(lanes or {}))
+        self.route = route
+
+        self.processed = [0] * len(LANES)
+        self.maxDepth = [0] * len(LANES)
+        self.maxWait = [0.] * len(LANES)  # seconds
+        self.errors = 0
+
+        self.log = logging.getLogger('ezibpy')
+        self._queues = tuple(deque() for _ in LANES)
+        self._cond = threading.Condition()
+        self._running = True
+
+        self._thread = threading.Thread(target=self._run, name=name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    # -----------------------------------------
+    def lane(self, typeName):
+        return self.lanes.get(typeName, MARKET_DATA_LANE)
+
+    # -----------------------------------------
+    def put(self, msg):
+        lane = None if self.route is None else self.route(msg)
+        if lane is None:
+            lane = self.lanes.get(msg.typeName, MARKET_DATA_LANE)
+        queue = self._queues[lane]
+
+        with self._cond:
+            if not self._running:
+                return
+            queue.append((time.monotonic(), msg))
+            if len(queue) > self.maxDepth[lane]:
+                self.maxDepth[lane] = len(queue)
+            self._cond.notify()
+
+    # -----------------------------------------
+    def pending(self):
+        return sum(len(queue) for queue in self._queues)
+
+    # -----------------------------------------
+    def _take(self):
+        """ (lane, queued, msg) from the highest non-empty lane, None once closed """
+        with self._cond:
+            while True:
+                for lane, queue in enumerate(self._queues):
+                    if queue:
+                        queued, msg = queue.popleft()
+                        if not self.pending():
+                            self._cond.notify_all()  # close(wait=True)
+                        return lane, queued, msg
+
+                if not self._running:
+                    return None
+                self._cond.wait()
+
+    # -----------------------------------------
+    def _run(self):
+        while True:
+            item = self._take()
+            if item is None:
+                return
+
+            lane, queued, msg = item
+            waited = time.monotonic() - queued
+            if waited > self.maxWait[lane]:
+                self.maxWait[lane] = waited
+
+            try:
+                self.handler(msg)
+            except Exception as e:
+                self.errors += 1
+                self.log.exception("[DISPATCH ERROR] %s: %s", msg.typeName, e)
+            self.processed[lane] += 1
+
+    # -----------------------------------------
+    def stats(self):
+        return {name: {
+            "pending": len(self._queues[lane]),
+            "processed": self.processed[lane],
+            "maxDepth": self.maxDepth[lane],
+            "maxWait": self.maxWait[lane],
+        } for lane, name in enumerate(LANES)}
+
+    # -----------------------------------------
+    def close(self, wait=False):
+        """ stops the dispatcher (after draining the lanes if `wait`) """
+        with self._cond:
+            if wait:
+                while self._running and self.pending():
+                    self._cond.wait()
+            self._running = False
+            for queue in self._queues:
+                queue.clear()
+            self._cond.notify_all()
+
+        if wait and threading.current_thread() is not self._thread:
+            self._thread.join()
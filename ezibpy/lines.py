@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+#
+# ezIBpy: Pythonic Wrapper for IbPy
+# https://github.com/ranaroussi/ezibpy
+#
+# Copyright 2015 Ran Aroussi
+#
+# Licensed under the GNU Lesser General Public License, v3.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.gnu.org/licenses/lgpl-3.0.en.html
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import itertools
+import logging
+import threading
+import time
+
+
+# ---------------------------------------------
+
+# send(action, tickerId) actions
+LINE_ACTIONS = ("stream", "cancel", "snapshot", "depth", "cancelDepth")
+
+# longest a rejected symbol sits out (seconds)
+MAX_REJECT_BACKOFF = 600
+
+
+# ---------------------------------------------
+
+class MarketDataLines(object):
+    """
+    Multiplexes any number of watched tickerIds over the account's
+    market data lines (`maxLines` concurrent reqMktData) and market
+    depth slots (`depthSlots` concurrent reqMktDepth).
+
+    The highest priority symbols stream. When there are more than
+    `maxLines`, `snapshotLines` lines (at most half) are set aside to
+    rotate the rest through snapshot requests, stalest first, so each is refreshed
+    about every `refresh` seconds (as line throughput allows).
+    Depth works the same way, minus snapshots: all but one slot stream
+    the top symbols and the last slot rotates every `depthRefresh` secs.
+
+    A symbol IB refuses a line/slot for is parked for `rejectBackoff`
+    secs (doubling on every repeat, up to MAX_REJECT_BACKOFF) instead
+    of being requested again right away.
+
+    `send(action, tickerId)` does the actual requests (LINE_ACTIONS);
+    touch()/snapshotEnd() report incoming data for freshness tracking.
+    """
+
+    def __init__(self, send, maxLines=100, snapshotLines=10, refresh=60,
+                 snapshotTimeout=11, depthSlots=3, depthRefresh=10, interval=.25,
+                 rejectBackoff=30):
+        self._send = send
+        self.maxLines = maxLines
+        self.snapshotLines = snapshotLines
+        self.refresh = refresh
+        self.snapshotTimeout = snapshotTimeout
+        self.depthSlots = depthSlots
+        self.depthRefresh = depthRefresh
+        self.interval = interval
+        self.rejectBackoff = rejectBackoff
+
+        self.watched = {}       # tickerId => rank (-priority, seq)
+        self.streaming = set()
+        self.snapshots = {}     # tickerId => snapshot sent (in flight)
+        self.updated = {}       # tickerId => last data received
+        self.parked = {}        # tickerId => (retry at, rejections)
+
+        self.depthWatched = {}  # tickerId => rank
+        self.depthStreaming = {}  # tickerId => streaming since
+        self.depthUpdated = {}
+        self.depthParked = {}
+
+        self.sent = 0
+        self.timeouts = 0
+        self.rejected = 0
+
+        self.log = logging.getLogger('ezibpy')
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._running = True
+        self._thread = None
+
+    # -----------------------------------------
+    def watch(self, tickerIds, priority=0):
+        """ watch (or re-rank) tickerIds, higher priority streams first """
+        with self._cond:
+            for tickerId in tickerIds:
+                self.watched[tickerId] = (-priority, next(self._seq))
+            actions = self._rebalance()
+        self._run_actions(actions)
+        self._start()
+
+    # -----------------------------------------
+    def unwatch(self, tickerIds):
+        with self._cond:
+            for tickerId in tickerIds:
+                self.watched.pop(tickerId, None)
+                self.parked.pop(tickerId, None)
+            actions = self._rebalance()
+        self._run_actions(actions)
+
+    # -----------------------------------------
+    def watchDepth(self, tickerIds, priority=0):
+        with self._cond:
+            for tickerId in tickerIds:
+                self.depthWatched[tickerId] = (-priority, next(self._seq))
+            actions = self._rebalanceDepth(time.monotonic())
+        self._run_actions(actions)
+        self._start()
+
+    # -----------------------------------------
+    def unwatchDepth(self, tickerIds):
+        with self._cond:
+            for tickerId in tickerIds:
+                self.depthWatched.pop(tickerId, None)
+                self.depthParked.pop(tickerId, None)
+            actions = self._rebalanceDepth(time.monotonic())
+        self._run_actions(actions)
+
+    # -----------------------------------------
+    def touch(self, tickerId):
+        """ market data received for tickerId """
+        self.updated[tickerId] = time.monotonic()
+        if tickerId in self.parked:
+            self.parked.pop(tickerId, None)  # the line works: forget rejections
+
+    # -----------------------------------------
+    def touchDepth(self, tickerId):
+        self.depthUpdated[tickerId] = time.monotonic()
+        if tickerId in self.depthParked:
+            self.depthParked.pop(tickerId, None)
+
+    # -----------------------------------------
+    def snapshotEnd(self, tickerId):
+        with self._cond:
+            if self.snapshots.pop(tickerId, None) is not None:
+                self.updated[tickerId] = time.monotonic()
+                self._cond.notify()
+
+    # -----------------------------------------
+    def lineRejected(self, tickerId):
+        """
+        IB refused a line (#101 max tickers reached): the account
+        has fewer lines than maxLines, shrink it to what's in use and
+        park tickerId so it isn't re-requested right away
+        """
+        with self._cond:
+            if tickerId not in self.streaming and tickerId not in self.snapshots:
+                return
+
+            self.streaming.discard(tickerId)
+            self.snapshots.pop(tickerId, None)
+            self.rejected += 1
+            self.maxLines = max(len(self.streaming) + len(self.snapshots), 1)
+            backoff = self._park(self.parked, tickerId)
+            self.log.warning("[MARKET DATA LINES] limit reached, using %d lines "
+                             "(tickerId %s parked for %gs)", self.maxLines, tickerId, backoff)
+            actions = self._rebalance()
+        self._run_actions(actions)
+
+    # -----------------------------------------
+    def depthRejected(self, tickerId):
+        """ IB refused a depth slot (#309 max depth requests reached) """
+        with self._cond:
+            if self.depthStreaming.pop(tickerId, None) is None:
+                return
+
+            self.rejected += 1
+            self.depthSlots = max(len(self.depthStreaming), 1)
+            backoff = self._park(self.depthParked, tickerId)
+            self.log.warning("[MARKET DEPTH SLOTS] limit reached, using %d slots "
+                             "(tickerId %s parked for %gs)", self.depthSlots, tickerId, backoff)
+            actions = self._rebalanceDepth(time.monotonic())
+        self._run_actions(actions)
+
+    # -----------------------------------------
+    def reset(self):
+        """ after a (re)connect: nothing streams anymore, re-request it all """
+        with self._cond:
+            self.streaming.clear()
+            self.snapshots.clear()
+            self.depthStreaming.clear()
+            actions = self._rebalance() + self._rebalanceDepth(time.monotonic())
+        self._run_actions(actions)
+
+    # -----------------------------------------
+    def _park(self, parked, tickerId):
+        """ sit tickerId out, twice as long as after its last rejection """
+        rejections = parked.get(tickerId, (0, 0))[1]
+        backoff = min(self.rejectBackoff * 2 ** rejections, MAX_REJECT_BACKOFF)
+        parked[tickerId] = (time.monotonic() + backoff, rejections + 1)
+        return backoff
+
+    # -----------------------------------------
+    def _ranked(self, watched, parked):
+        """ watched tickerIds by rank, minus the parked ones """
+        now = time.monotonic()
+        return sorted((tickerId for tickerId in watched
+                       if parked.get(tickerId, (0,))[0] <= now), key=watched.get)
+
+    # -----------------------------------------
+    def _rebalance(self):
+        """ (action, tickerId) list to stream the top ranked symbols """
+        lines = self.maxLines
+        if len(self.watched) > lines:
+            lines -= min(self.snapshotLines, lines // 2)
+        lines = max(min(lines, self.maxLines - len(self.snapshots)), 0)
+
+        top = set(self._ranked(self.watched, self.parked)[:lines])
+        top -= set(self.snapshots)  # streams once its snapshot is done
+
+        actions = [("cancel", tickerId) for tickerId in self.streaming - top]
+        actions += [("stream", tickerId) for tickerId in top - self.streaming]
+        self.streaming = top
+        return actions
+
+    # -----------------------------------------
+    def _rebalanceDepth(self, now):
+        ranked = self._ranked(self.depthWatched, self.depthParked)
+        slots = self.depthSlots
+
+        if len(ranked) <= slots:
+            top = ranked
+        else:
+            # pin slots - 1, rotate the last one (stalest first)
+            top = ranked[:slots - 1]
+            rotating = [tickerId for tickerId in self.depthStreaming if tickerId not in top
+                        and tickerId in self.depthWatched
+                        and now - self.depthStreaming[tickerId] < self.depthRefresh]
+            if not rotating:
+                rest = [tickerId for tickerId in ranked[slots - 1:]
+                        if tickerId not in self.depthStreaming]
+                rest.sort(key=lambda tickerId: self.depthUpdated.get(tickerId, 0))
+                rotating = rest[:1]
+            top = top + rotating[:1]
+
+        actions = [("cancelDepth", tickerId) for tickerId in self.depthStreaming
+                   if tickerId not in top]
+        for _, tickerId in actions:
+            self.depthUpdated[tickerId] = now
+            del self.depthStreaming[tickerId]
+
+        for tickerId in top:
+            if tickerId not in self.depthStreaming:
+                self.depthStreaming[tickerId] = now
+                actions.append(("depth", tickerId))
+        return actions
+
+    # -----------------------------------------
+    def _rotate(self, now):
+        """ expire stuck snapshots and send new ones to the stalest symbols """
+        for tickerId, sent in list(self.snapshots.items()):
+            if now - sent > self.snapshotTimeout:
+                del self.snapshots[tickerId]
+                self.timeouts += 1
+
+        free = min(self.maxLines - len(self.streaming), self.snapshotLines) - len(self.snapshots)
+        if free <= 0:
+            return []
+
+        never = float("-inf")
+        due = [tickerId for tickerId in self._ranked(self.watched, self.parked)
+               if tickerId not in self.streaming and tickerId not in self.snapshots
+               and now - self.updated.get(tickerId, never) >= self.refresh]
+        due.sort(key=lambda tickerId: (self.updated.get(tickerId, never), self.watched[tickerId]))
+
+        actions = []
+        for tickerId in due[:free]:
+            self.snapshots[tickerId] = now
+            actions.append(("snapshot", tickerId))
+        return actions
+
+    # -----------------------------------------
+    def _run_actions(self, actions):
+        for action, tickerId in actions:
+            try:
+                self._send(action, tickerId)
+                self.sent += 1
+            except Exception as e:
+                self.log.error("[MARKET DATA LINES] %s %s failed: %s", action, tickerId, e)
+
+    # -----------------------------------------
+    def _start(self):
+        with self._cond:
+            if self._thread is None and self._running:
+                self._thread = threading.Thread(
+                    target=self._run, name="ezibpy-lines", daemon=True)
+                self._thread.start()
+
+    # -----------------------------------------
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait(self.interval)
+                if not self._running:
+                    return
+                now = time.monotonic()
+                actions = self._rotate(now) + self._rebalance()
+                if len(self.depthWatched) > self.depthSlots:
+                    actions += self._rebalanceDepth(now)
+            self._run_actions(actions)
+
+    # -----------------------------------------
+    def freshness(self, tickerIds=None):
+        """ seconds since the last data per tickerId (None = never) """
+        now = time.monotonic()
+        if tickerIds is None:
+            tickerIds = self.watched
+        return {tickerId: (now - self.updated[tickerId]) if tickerId in self.updated else None
+                for tickerId in tickerIds}
+
+    # -----------------------------------------
+    def stats(self):
+        now = time.monotonic()
+        ages = [age for age in self.freshness().values() if age is not None]
+        return {
+            "watched": len(self.watched),
+            "streaming": len(self.streaming),
+            "snapshots": len(self.snapshots),
+            "maxLines": self.maxLines,
+            "depthWatched": len(self.depthWatched),
+            "depthStreaming": len(self.depthStreaming),
+            "depthSlots": self.depthSlots,
+            "parked": sum(1 for retry, _ in self.parked.values() if retry > now),
+            "depthParked": sum(1 for retry, _ in self.depthParked.values() if retry > now),
+            "neverUpdated": len(self.watched) - len(ages),
+            "maxAge": max(ages) if ages else None,
+            "sent": self.sent,
+            "timeouts": self.timeouts,
+            "rejected": self.rejected,
+        }
+
+    # -----------------------------------------
+    def close(self):
+        """ stops rotating (doesn't cancel anything) """
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
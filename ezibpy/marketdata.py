@@ -0,0 +1,471 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+#
+# ezIBpy: Pythonic Wrapper for IbPy
+# https://github.com/ranaroussi/ezibpy
+#
+# Copyright 2015 Ran Aroussi
+#
+# Licensed under the GNU Lesser General Public License, v3.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.gnu.org/licenses/lgpl-3.0.en.html
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from bisect import bisect_left, insort
+from collections.abc import Mapping
+from datetime import datetime
+
+import numpy as np
+from pandas import DataFrame, to_datetime
+
+from .utils import dataTypes
+
+
+# ---------------------------------------------
+
+QUOTE_FIELDS = (
+    ("bid", "f8"), ("bidsize", "i8"),
+    ("ask", "f8"), ("asksize", "i8"),
+    ("last", "f8"), ("lastsize", "i8"),
+)
+
+OPTION_FIELDS = (
+    ("oi", "i8"), ("volume", "i8"), ("underlying", "f8"), ("iv", "f8"),
+    ("bid", "f8"), ("bidsize", "i8"), ("ask", "f8"), ("asksize", "i8"),
+    ("last", "f8"), ("lastsize", "i8"),
+    # opt field
+    ("price", "f8"), ("dividend", "f8"), ("imp_vol", "f8"), ("delta", "f8"),
+    ("gamma", "f8"), ("vega", "f8"), ("theta", "f8"),
+    ("last_price", "f8"), ("last_dividend", "f8"), ("last_imp_vol", "f8"),
+    ("last_delta", "f8"), ("last_gamma", "f8"), ("last_vega", "f8"), ("last_theta", "f8"),
+    ("bid_price", "f8"), ("bid_dividend", "f8"), ("bid_imp_vol", "f8"),
+    ("bid_delta", "f8"), ("bid_gamma", "f8"), ("bid_vega", "f8"), ("bid_theta", "f8"),
+    ("ask_price", "f8"), ("ask_dividend", "f8"), ("ask_imp_vol", "f8"),
+    ("ask_delta", "f8"), ("ask_gamma", "f8"), ("ask_vega", "f8"), ("ask_theta", "f8"),
+)
+
+
+# ---------------------------------------------
+
+class QuoteBoard(Mapping):
+    """
+    Latest quote per tickerId, stored as rows of a preallocated
+    NumPy structured array. Handlers write scalars with set();
+    board[tickerId] returns a one-row DataFrame for existing readers.
+    """
+
+    def __init__(self, fields=QUOTE_FIELDS, capacity=64):
+        self.dtype = np.dtype([("datetime", "f8")] + list(fields))
+        self.fields = self.dtype.names[1:]
+        self._data = np.zeros(max(int(capacity), 1), dtype=self.dtype)
+        self._slots = {}  # tickerId => row
+
+        # template row (mirrors the old marketData[0] frame)
+        self.slot(0)
+
+    # -----------------------------------------
+    def slot(self, tickerId):
+        """ returns the row of tickerId, allocating one if needed """
+        try:
+            return self._slots[tickerId]
+        except KeyError:
+            pass
+
+        row = len(self._slots)
+        if row >= len(self._data):
+            # amortized growth
+            data = np.zeros(len(self._data) * 2, dtype=self.dtype)
+            data[:row] = self._data
+            self._data = data
+
+        self._slots[tickerId] = row
+        return row
+
+    # -----------------------------------------
+    def set(self, tickerId, field, value):
+        if value is None:
+            value = np.nan
+        if field not in self.dtype.fields:
+            self._addField(field, value)
+        row = self.slot(tickerId)  # may grow (re-allocate) _data
+        self._data[row][field] = value
+
+    # -----------------------------------------
+    def _addField(self, field, value):
+        """ adds a column on first use (ie. volume ticks of stocks) """
+        kind = "i8" if isinstance(value, (int, np.integer)) else "f8"
+        dtype = np.dtype(self.dtype.descr + [(field, kind)])
+
+        data = np.zeros(len(self._data), dtype=dtype)
+        for name in self.dtype.names:
+            data[name] = self._data[name]
+
+        self.dtype = dtype
+        self.fields = dtype.names[1:]
+        self._data = data
+
+    # -----------------------------------------
+    def get(self, tickerId, field, default=0):
+        row = self._slots.get(tickerId)
+        if row is None:
+            return default
+        return self._data[row][field]
+
+    # -----------------------------------------
+    def record(self, tickerId):
+        """ returns the raw NumPy record for tickerId (no pandas involved) """
+        row = self.slot(tickerId)
+        return self._data[row]
+
+    # -----------------------------------------
+    def frame(self, tickerIds=None):
+        """ returns a DataFrame of many tickers, indexed by tickerId """
+        if tickerIds is None:
+            tickerIds = list(self._slots)
+        rows = [self._slots[tickerId] for tickerId in tickerIds]
+        df = DataFrame(self._data[rows], index=tickerIds)
+        df.index.name = "tickerId"
+        return df
+
+    # -----------------------------------------
+    @staticmethod
+    def _format_ts(ts):
+        if ts == 0:
+            return 0
+        return datetime.fromtimestamp(int(ts)).strftime(
+            dataTypes["DATE_TIME_FORMAT_LONG_MILLISECS"])
+
+    # -----------------------------------------
+    def __getitem__(self, tickerId):
+        row = self._slots[tickerId]
+        record = self._data[row:row + 1]
+        df = DataFrame({field: record[field] for field in self.fields},
+                       index=[self._format_ts(record["datetime"][0])])
+        df.index.name = "datetime"
+        return df
+
+    def __contains__(self, tickerId):
+        return tickerId in self._slots
+
+    def __iter__(self):
+        return iter(list(self._slots))
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+# ---------------------------------------------
+
+TICK_HISTORY_FIELDS = np.dtype([
+    ("time", "f8"), ("price", "f8"), ("size", "f8"), ("volume", "f8"),
+    ("wap", "f8"), ("bid", "f8"), ("ask", "f8"),
+])
+
+
+class TickRingBuffer(object):
+    """ fixed-capacity ring buffer of RTVOLUME ticks for one tickerId """
+
+    def __init__(self, capacity=1000):
+        self.capacity = max(int(capacity), 1)
+        self._data = np.zeros(self.capacity, dtype=TICK_HISTORY_FIELDS)
+        self._count = 0  # total ticks ever appended
+
+    # -----------------------------------------
+    def append(self, *values):
+        """ values must follow TICK_HISTORY_FIELDS order """
+        self._data[self._count % self.capacity] = values
+        self._count += 1
+
+    # -----------------------------------------
+    def last(self, n=None):
+        """ returns (a copy of) the last n ticks, oldest first """
+        size = len(self)
+        n = size if n is None else min(int(n), size)
+        if n <= 0:
+            return self._data[:0].copy()
+
+        end = self._count % self.capacity
+        start = (end - n) % self.capacity
+        if start < end:
+            return self._data[start:end].copy()
+        return np.concatenate((self._data[start:], self._data[:end]))
+
+    # -----------------------------------------
+    def since(self, timestamp):
+        """ returns all buffered ticks with time >= timestamp (epoch seconds) """
+        ticks = self.last()
+        return ticks[np.searchsorted(ticks["time"], timestamp, side="left"):]
+
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+
+# ---------------------------------------------
+
+class TickHistory(Mapping):
+    """ tickerId => TickRingBuffer, all sharing the same capacity """
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self._buffers = {}
+
+    # -----------------------------------------
+    def append(self, tickerId, *values):
+        try:
+            buffer = self._buffers[tickerId]
+        except KeyError:
+            buffer = self._buffers[tickerId] = TickRingBuffer(self.capacity)
+        buffer.append(*values)
+
+    # -----------------------------------------
+    def frame(self, tickerId, n=None, since=None):
+        """ returns buffered ticks as a DataFrame indexed by datetime """
+        if tickerId not in self._buffers:
+            ticks = np.zeros(0, dtype=TICK_HISTORY_FIELDS)
+        elif since is not None:
+            ticks = self._buffers[tickerId].since(since)
+            if n is not None:
+                ticks = ticks[-int(n):] if n > 0 else ticks[:0]
+        else:
+            ticks = self._buffers[tickerId].last(n)
+
+        df = DataFrame(ticks)
+        df.index = to_datetime(df.pop("time"), unit="s")
+        df.index.name = "datetime"
+        return df
+
+    def __getitem__(self, tickerId):
+        return self._buffers[tickerId]
+
+    def __iter__(self):
+        return iter(list(self._buffers))
+
+    def __len__(self):
+        return len(self._buffers)
+
+
+# ---------------------------------------------
+
+class DepthBook(object):
+    """
+    fixed-depth order book of one tickerId, maintained with IB's
+    updateMktDepth operations (0 = insert, 1 = update, 2 = delete).
+    bids/asks are (depth x 2) arrays of [price, size] rows.
+    """
+
+    INSERT = 0
+    UPDATE = 1
+    DELETE = 2
+
+    def __init__(self, depth=10):
+        self.depth = int(depth)
+        self.bids = np.zeros((self.depth, 2))
+        self.asks = np.zeros((self.depth, 2))
+
+    # -----------------------------------------
+    def update(self, position, operation, side, price, size):
+        """ side: 1 = bid, 0 = ask (as in updateMktDepth) """
+        if position < 0 or position >= self.depth:
+            return
+
+        book = self.bids if side == 1 else self.asks
+
+        if operation == self.INSERT:
+            book[position + 1:] = book[position:-1]
+            book[position] = (price, size)
+
+        elif operation == self.UPDATE:
+            book[position] = (price, size)
+
+        elif operation == self.DELETE:
+            book[position:-1] = book[position + 1:]
+            book[-1] = 0
+
+    # -----------------------------------------
+    def top(self):
+        """ returns ([bid, bidsize], [ask, asksize]) as views (no copy) """
+        return self.bids[0], self.asks[0]
+
+    # -----------------------------------------
+    def frame(self):
+        return DataFrame(index=range(self.depth), data={
+            "bid": self.bids[:, 0], "bidsize": self.bids[:, 1].astype(int),
+            "ask": self.asks[:, 0], "asksize": self.asks[:, 1].astype(int)
+        })
+
+
+# ---------------------------------------------
+
+class L2Book(DepthBook):
+    """
+    DepthBook for updateMktDepthL2 messages. Besides the row book,
+    keeps every marketMaker's (venue's) levels and a consolidated
+    price => size view per side, both updated incrementally.
+    """
+
+    def __init__(self, depth=10):
+        DepthBook.__init__(self, depth)
+        self._makers = {1: [None] * self.depth, 0: [None] * self.depth}
+        self._venues = {}                # marketMaker => {side: {price: size}}
+        self._levels = {1: {}, 0: {}}    # side => {price: total size}
+        self._prices = {1: [], 0: []}    # side => sorted prices
+
+    # -----------------------------------------
+    def update(self, position, operation, side, price, size, marketMaker=""):
+        if position < 0 or position >= self.depth:
+            return
+
+        rows = self.bids if side == 1 else self.asks
+        makers = self._makers[side]
+
+        # row dropping out of (or being replaced in) the book
+        removed = None
+        if operation == self.INSERT:
+            removed = -1
+        elif operation in (self.UPDATE, self.DELETE):
+            removed = position
+
+        if removed is not None and makers[removed] is not None:
+            self._adjust(side, makers[removed],
+                         float(rows[removed][0]), -int(rows[removed][1]))
+
+        DepthBook.update(self, position, operation, side, price, size)
+
+        if operation == self.INSERT:
+            makers[position + 1:] = makers[position:-1]
+            makers[position] = marketMaker
+        elif operation == self.UPDATE:
+            makers[position] = marketMaker
+        elif operation == self.DELETE:
+            makers[position:-1] = makers[position + 1:]
+            makers[-1] = None
+
+        if operation != self.DELETE:
+            self._adjust(side, marketMaker, price, size)
+
+    # -----------------------------------------
+    def _adjust(self, side, marketMaker, price, size):
+        venue = self._venues.setdefault(marketMaker, {1: {}, 0: {}})[side]
+        venue_size = venue.get(price, 0) + size
+        if venue_size > 0:
+            venue[price] = venue_size
+        else:
+            venue.pop(price, None)
+
+        levels = self._levels[side]
+        level_size = levels.get(price, 0) + size
+        if level_size > 0:
+            if price not in levels:
+                insort(self._prices[side], price)
+            levels[price] = level_size
+        elif price in levels:
+            del levels[price]
+            prices = self._prices[side]
+            del prices[bisect_left(prices, price)]
+
+    # -----------------------------------------
+    def bestBid(self):
+        """ returns (price, size) of the consolidated best bid """
+        prices = self._prices[1]
+        if not prices:
+            return (0., 0)
+        return (prices[-1], self._levels[1][prices[-1]])
+
+    # -----------------------------------------
+    def bestAsk(self):
+        """ returns (price, size) of the consolidated best ask """
+        prices = self._prices[0]
+        if not prices:
+            return (0., 0)
+        return (prices[0], self._levels[0][prices[0]])
+
+    # -----------------------------------------
+    def sizeAt(self, side, price):
+        """ consolidated size at a price level (side: 1 = bid, 0 = ask) """
+        return self._levels[side].get(price, 0)
+
+    # -----------------------------------------
+    def venues(self):
+        return list(self._venues)
+
+    # -----------------------------------------
+    def venue(self, marketMaker):
+        """ returns {"bid": [(price, size), ...], "ask": [...]} of one venue """
+        sides = self._venues.get(marketMaker, {1: {}, 0: {}})
+        return {
+            "bid": sorted(sides[1].items(), reverse=True),
+            "ask": sorted(sides[0].items())
+        }
+
+    # -----------------------------------------
+    def consolidated(self, levels=None):
+        """ returns the aggregated-by-price book as a DataFrame """
+        bids = self._prices[1][::-1][:levels]
+        asks = self._prices[0][:levels]
+        rows = max(len(bids), len(asks))
+        bids = bids + [0.] * (rows - len(bids))
+        asks = asks + [0.] * (rows - len(asks))
+        return DataFrame(index=range(rows), data={
+            "bid": bids, "bidsize": [self._levels[1].get(p, 0) for p in bids],
+            "ask": asks, "asksize": [self._levels[0].get(p, 0) for p in asks]
+        })
+
+
+# ---------------------------------------------
+
+class DepthBoard(Mapping):
+    """
+    tickerId => DepthBook. board[tickerId] returns a DataFrame
+    for existing readers; use book(tickerId) for the live book.
+    """
+
+    def __init__(self, depth=10):
+        self.depth = depth
+        self._depths = {}  # tickerId => requested rows
+        self._books = {}
+
+        # template book (mirrors the old marketDepthData[0] frame)
+        self.book(0)
+
+    # -----------------------------------------
+    def setDepth(self, tickerId, depth):
+        """ sets the book depth of tickerId (resets an existing book) """
+        self._depths[tickerId] = depth
+        book = self._books.get(tickerId)
+        if book is not None and book.depth != depth:
+            self._books[tickerId] = type(book)(depth)
+
+    # -----------------------------------------
+    def book(self, tickerId, l2=False):
+        """ returns the book of tickerId (an L2Book if `l2` is set) """
+        book = self._books.get(tickerId)
+        if book is None or (l2 and not isinstance(book, L2Book)):
+            bookType = L2Book if l2 else DepthBook
+            book = self._books[tickerId] = bookType(
+                self._depths.get(tickerId, self.depth))
+        return book
+
+    def __getitem__(self, tickerId):
+        return self._books[tickerId].frame()
+
+    def __contains__(self, tickerId):
+        return tickerId in self._books
+
+    def __iter__(self):
+        return iter(list(self._books))
+
+    def __len__(self):
+        return len(self._books)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
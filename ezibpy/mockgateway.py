@@ -0,0 +1,812 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+#
+# ezIBpy: Pythonic Wrapper for IbPy
+# https://github.com/ranaroussi/ezibpy
+#
+# Copyright 2015 Ran Aroussi
+#
+# Licensed under the GNU Lesser General Public License, v3.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.gnu.org/licenses/lgpl-3.0.en.html
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Local stand-in for TWS / IB Gateway, speaking the socket protocol of
+ib.opt.Connection (no network, no IB account needed).
+
+Answers the connect handshake, reqContractDetails, reqMktData,
+reqMktDepth, reqHistoricalData, placeOrder/cancelOrder, reqIds and the
+housekeeping requests ezIBpy sends on connect, with randomized (or
+scripted) data at configurable rates. Meant for soak/load testing:
+
+    with MockGateway(port=0, tickRate=4) as gateway:
+        ibConn = ezibpy.ezIBpy()
+        ibConn.connect(clientId=1, host="127.0.0.1", port=gateway.port)
+        ...
+        gateway.dropConnections()  # exercise reconnect handling
+
+or standalone: python -m ezibpy.mockgateway --port 4001
+
+openOrder messages are not generated (orders only get orderStatus).
+"""
+
+import heapq
+import itertools
+import logging
+import random
+import socket
+import threading
+import time
+
+from datetime import datetime, timedelta
+
+
+# ---------------------------------------------
+
+SERVER_VERSION = 69  # newest version IbPy's EClientSocket knows about
+
+# outgoing (server => client) message ids / versions
+TICK_PRICE, TICK_SIZE, ORDER_STATUS, ERR_MSG = 1, 2, 3, 4
+NEXT_VALID_ID, CONTRACT_DATA, MARKET_DEPTH = 9, 10, 12
+MANAGED_ACCTS, HISTORICAL_DATA, TICK_STRING = 15, 17, 46
+CURRENT_TIME, CONTRACT_DATA_END, OPEN_ORDER_END = 49, 52, 53
+ACCT_DOWNLOAD_END, EXECUTION_DATA_END, TICK_SNAPSHOT_END = 54, 55, 57
+POSITION_END, ACCOUNT_SUMMARY_END = 62, 64
+
+# incoming requests we only need to skip over: msgId => fields after msgId
+SKIPPED_REQUESTS = {
+    12: 2,   # reqNewsBulletins
+    13: 1,   # cancelNewsBulletins
+    14: 2,   # setServerLogLevel
+    18: 2,   # requestFA
+    19: 3,   # replaceFA
+    21: 17,  # exerciseOptions
+    24: 1,   # reqScannerParameters
+    50: 17,  # reqRealTimeBars
+    51: 2,   # cancelRealTimeBars
+    52: 10,  # reqFundamentalData
+    53: 2,   # cancelFundamentalData
+    54: 16,  # calculateImpliedVolatility
+    55: 16,  # calculateOptionPrice
+    56: 2,   # cancelCalculateImpliedVolatility
+    57: 2,   # cancelCalculateOptionPrice
+    59: 2,   # reqMarketDataType
+    63: 2,   # cancelAccountSummary
+    64: 1,   # cancelPositions
+}
+
+BAR_SIZE_SECONDS = {"sec": 1, "secs": 1, "min": 60, "mins": 60, "hour": 3600,
+                    "hours": 3600, "day": 86400, "week": 604800, "month": 2592000}
+
+DURATION_SECONDS = {"S": 1, "D": 86400, "W": 604800, "M": 2592000, "Y": 31536000}
+
+MAX_BARS = 5000  # per historical request
+
+
+# ---------------------------------------------
+
+def _encode(*fields):
+    out = []
+    for field in fields:
+        if field is None:
+            field = ""
+        elif field is True or field is False:
+            field = int(field)
+        out.append(str(field))
+    return ("\0".join(out) + "\0").encode()
+
+
+# ---------------------------------------------
+
+class _RequestReader(object):
+    """ reads NUL-terminated request fields off the client socket """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = b""
+
+    def field(self):
+        while True:
+            pos = self.buffer.find(b"\0")
+            if pos >= 0:
+                value, self.buffer = self.buffer[:pos], self.buffer[pos + 1:]
+                return value.decode()
+            data = self.sock.recv(65536)
+            if not data:
+                raise EOFError()
+            self.buffer += data
+
+    def fields(self, count):
+        return [self.field() for _ in range(count)]
+
+    def int(self):
+        value = self.field()
+        return int(value) if value else 0
+
+    def float(self):
+        value = self.field()
+        return float(value) if value else 0.
+
+    def bool(self):
+        # depending on the overload picked, IbPy sends bools as 1/0 or True/False
+        return self.field() in ("1", "True", "true")
+
+
+# ---------------------------------------------
+
+class _Session(object):
+    """ one connected client """
+
+    def __init__(self, gateway, sock, address):
+        self.gateway = gateway
+        self.sock = sock
+        self.address = address
+        self.reader = _RequestReader(sock)
+        self.clientId = None
+        self.closed = False
+
+        self.marketData = {}   # tickerId => (contract, genericTicks)
+        self.marketDepth = {}  # tickerId => (contract, numRows)
+        self.depthRows = {}    # (tickerId, side) => rows sent
+        self.nextOrderId = 1
+
+        self._sendLock = threading.Lock()
+
+    # -----------------------------------------
+    def send(self, *fields):
+        data = _encode(*fields)
+        with self._sendLock:
+            if self.closed:
+                return
+            try:
+                self.sock.sendall(data)
+            except OSError:
+                self.close()
+                return
+        self.gateway.sent += 1
+
+    # -----------------------------------------
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+    # -----------------------------------------
+    def run(self):
+        try:
+            self.handshake()
+            while not self.closed:
+                self.dispatch(self.reader.int())
+        except (EOFError, OSError):
+            pass
+        except Exception as e:
+            self.gateway.log.exception("[MOCK GATEWAY] session error: %s", e)
+        finally:
+            self.close()
+            self.gateway._removeSession(self)
+
+    # -----------------------------------------
+    def handshake(self):
+        self.clientVersion = self.reader.int()
+        self.sock.sendall(_encode(self.gateway.serverVersion,
+                                  datetime.now().strftime("%Y%m%d %H:%M:%S EST")))
+        self.clientId = self.reader.int()
+
+        self.nextOrderId = self.gateway.nextOrderId
+        self.send(NEXT_VALID_ID, 1, self.nextOrderId)
+        self.send(MANAGED_ACCTS, 1, ",".join(self.gateway.accounts))
+
+    # -----------------------------------------
+    def readContract(self, conId=True, primaryExch=True, tradingClass=True):
+        contract = {}
+        if conId:
+            contract["conId"] = self.reader.int()
+        keys = ["symbol", "secType", "expiry", "strike", "right", "multiplier", "exchange"]
+        if primaryExch:
+            keys.append("primaryExch")
+        keys += ["currency", "localSymbol"]
+        if tradingClass:
+            keys.append("tradingClass")
+        contract.update(zip(keys, self.reader.fields(len(keys))))
+        contract["strike"] = float(contract["strike"] or 0)
+        return contract
+
+    # -----------------------------------------
+    def readComboLegs(self, fieldsPerLeg):
+        count = self.reader.int()
+        self.reader.fields(count * fieldsPerLeg)
+
+    # -----------------------------------------
+    def dispatch(self, msgId):
+        handler = getattr(self, "req%d" % msgId, None)
+        if handler is not None:
+            handler()
+        elif msgId in SKIPPED_REQUESTS:
+            self.reader.fields(SKIPPED_REQUESTS[msgId])
+        else:
+            # can't tell where the next request starts
+            raise ValueError("unsupported request id %s" % msgId)
+
+    # -----------------------------------------
+    # market data
+    # -----------------------------------------
+    def req1(self):
+        """ reqMktData """
+        _, tickerId = self.reader.int(), self.reader.int()
+        contract = self.readContract()
+        if contract["secType"].upper() == "BAG":
+            self.readComboLegs(4)
+        if self.reader.bool():  # underComp
+            self.reader.fields(3)
+        genericTicks = self.reader.field()
+        snapshot = self.reader.bool()
+
+        if not self.gateway.knows(contract):
+            return self.error(tickerId, 200, "No security definition has been found for the request")
+
+        if snapshot:
+            self.gateway._schedule(0, self.snapshot, tickerId, contract)
+        else:
+            self.marketData[tickerId] = (contract, genericTicks.split(","))
+
+    def req2(self):
+        """ cancelMktData """
+        self.reader.int()
+        self.marketData.pop(self.reader.int(), None)
+
+    def snapshot(self, tickerId, contract):
+        for field in (1, 2, 4):
+            self.tick(tickerId, contract, field)
+        self.send(TICK_SNAPSHOT_END, 1, tickerId)
+
+    def tick(self, tickerId, contract, field=None, genericTicks=()):
+        price = self.gateway.price(contract)
+        field = field or self.gateway.random.choice((1, 2, 4))
+        spread = self.gateway.minTick(contract)
+        price = round(price + {1: -spread, 2: spread}.get(field, 0), 4)
+        size = self.gateway.random.randint(1, 50) * 100
+
+        # version 3 tickPrice => client also fires the matching tickSize
+        self.send(TICK_PRICE, 3, tickerId, field, price, size, 1)
+
+        if field == 4:
+            self.send(TICK_STRING, 6, tickerId, 45, int(time.time()))  # last timestamp
+
+        if field == 4 and "233" in genericTicks:
+            rtvolume = "%s;%s;%d;%d;%s;false" % (price, size, time.time() * 1000,
+                                                 self.gateway.volume(contract, size), price)
+            self.send(TICK_STRING, 6, tickerId, 48, rtvolume)
+
+    # -----------------------------------------
+    def req10(self):
+        """ reqMktDepth """
+        _, tickerId = self.reader.int(), self.reader.int()
+        contract = self.readContract(primaryExch=False)
+        numRows = self.reader.int()
+
+        if not self.gateway.knows(contract):
+            return self.error(tickerId, 200, "No security definition has been found for the request")
+
+        self.marketDepth[tickerId] = (contract, min(numRows or 5, 10))
+        for side in (0, 1):
+            self.depthRows[(tickerId, side)] = 0
+
+    def req11(self):
+        """ cancelMktDepth """
+        self.reader.int()
+        tickerId = self.reader.int()
+        self.marketDepth.pop(tickerId, None)
+        for side in (0, 1):
+            self.depthRows.pop((tickerId, side), None)
+
+    def depth(self, tickerId, contract, numRows):
+        side = self.gateway.random.randint(0, 1)
+        rows = self.depthRows.get((tickerId, side), 0)
+        if rows < numRows:
+            operation, position = 0, rows
+            self.depthRows[(tickerId, side)] = rows + 1
+        else:
+            operation, position = 1, self.gateway.random.randrange(numRows)
+
+        tick = self.gateway.minTick(contract)
+        price = self.gateway.price(contract) + tick * (position + 1) * (-1 if side == 1 else 1)
+        size = self.gateway.random.randint(1, 50) * 100
+        self.send(MARKET_DEPTH, 1, tickerId, position, operation, side, round(price, 4), size)
+
+    # -----------------------------------------
+    # contracts / history
+    # -----------------------------------------
+    def req9(self):
+        """ reqContractDetails """
+        _, reqId = self.reader.int(), self.reader.int()
+        contract = self.readContract(primaryExch=False)
+        self.reader.fields(3)  # includeExpired, secIdType, secId
+
+        self.gateway._schedule(self.gateway.latency, self.contractDetails, reqId, contract)
+
+    def contractDetails(self, reqId, contract):
+        if not self.gateway.knows(contract):
+            return self.error(reqId, 200, "No security definition has been found for the request")
+
+        for details in self.gateway.contractDetails(contract):
+            self.send(CONTRACT_DATA, 8, reqId,
+                details["symbol"], details["secType"], details["expiry"],
+                details["strike"], details["right"], details["exchange"],
+                details["currency"], details["localSymbol"], details["marketName"],
+                details["tradingClass"], details["conId"], details["minTick"],
+                details["multiplier"], details["orderTypes"], details["validExchanges"],
+                1, 0, details["longName"], details["primaryExch"],
+                details["contractMonth"], "", "", "", details["timeZoneId"],
+                details["tradingHours"], details["liquidHours"], "", "", 0)
+
+        self.send(CONTRACT_DATA_END, 1, reqId)
+
+    # -----------------------------------------
+    def req20(self):
+        """ reqHistoricalData """
+        _, reqId = self.reader.int(), self.reader.int()
+        contract = self.readContract()
+        includeExpired, endDateTime, barSize, duration, useRTH, whatToShow, formatDate = \
+            self.reader.fields(7)
+        if contract["secType"].upper() == "BAG":
+            self.readComboLegs(4)
+
+        request = dict(contract=contract, endDateTime=endDateTime, barSize=barSize,
+                       duration=duration, useRTH=int(useRTH or 0), whatToShow=whatToShow,
+                       formatDate=int(formatDate or 1))
+        self.gateway._schedule(self.gateway.latency, self.historicalData, reqId, request)
+
+    def req25(self):
+        """ cancelHistoricalData """
+        self.reader.fields(2)
+
+    def historicalData(self, reqId, request):
+        if not self.gateway.knows(request["contract"]):
+            return self.error(reqId, 200, "No security definition has been found for the request")
+
+        bars = self.gateway.historicalBars(request)
+        fields = [HISTORICAL_DATA, 3, reqId, request["start"], request["end"], len(bars)]
+        for bar in bars:
+            fields += [bar["date"], bar["open"], bar["high"], bar["low"], bar["close"],
+                       bar["volume"], bar["wap"], "false", bar["count"]]
+        self.send(*fields)
+
+    # -----------------------------------------
+    # orders
+    # -----------------------------------------
+    def req3(self):
+        """ placeOrder """
+        read = self.reader
+        _, orderId = read.int(), read.int()
+        contract = self.readContract()
+        read.fields(2)  # secIdType, secId
+        action, quantity, orderType, lmtPrice, auxPrice = read.fields(5)
+        read.fields(6)  # tif, ocaGroup, account, openClose, origin, orderRef
+        transmit, parentId = read.bool(), read.int()
+        read.fields(6)  # blockOrder ... hidden
+
+        if contract["secType"].upper() == "BAG":
+            self.readComboLegs(8)
+            read.fields(read.int())      # order combo leg prices
+            read.fields(read.int() * 2)  # smart combo routing params
+
+        read.fields(27)  # sharesAllocation ... overridePercentageConstraints
+        read.fields(2)   # volatility, volatilityType
+        deltaNeutralOrderType = read.field()
+        read.field()     # deltaNeutralAuxPrice
+        if deltaNeutralOrderType:
+            read.fields(8)
+        read.fields(6)   # continuousUpdate ... scaleSubsLevelSize
+        scalePriceIncrement = read.field()
+        if scalePriceIncrement and float(scalePriceIncrement) > 0:
+            read.fields(7)
+        read.fields(3)   # scaleTable, activeStartTime, activeStopTime
+        if read.field():  # hedgeType
+            read.field()
+        read.fields(4)   # optOutSmartRouting, clearingAccount, clearingIntent, notHeld
+        if read.bool():  # underComp
+            read.fields(3)
+        if read.field():  # algoStrategy
+            read.fields(read.int() * 2)
+        read.field()     # whatIf
+
+        order = dict(id=orderId, contract=contract, action=action,
+                     quantity=int(float(quantity or 0)), orderType=orderType,
+                     lmtPrice=float(lmtPrice) if lmtPrice else None,
+                     auxPrice=float(auxPrice) if auxPrice else None,
+                     transmit=transmit, parentId=parentId)
+        self.gateway._schedule(self.gateway.latency, self.orderAccepted, order)
+
+    def req4(self):
+        """ cancelOrder """
+        self.reader.int()
+        orderId = self.reader.int()
+        order = self.gateway.orders.get(orderId)
+        if order is not None and order["status"] not in ("Filled", "Cancelled"):
+            self.gateway._schedule(self.gateway.latency, self.orderStatus, order, "Cancelled")
+
+    def orderStatus(self, order, status, fillPrice=0.):
+        if order["status"] in ("Filled", "Cancelled"):
+            return
+        order["status"] = status
+        filled = order["quantity"] if status == "Filled" else 0
+        self.send(ORDER_STATUS, 6, order["id"], status, filled, order["quantity"] - filled,
+                  fillPrice, order["permId"], order["parentId"], fillPrice, self.clientId, "")
+
+    def orderAccepted(self, order):
+        gateway = self.gateway
+        order["permId"] = next(gateway._permIds)
+        order["status"] = None
+        gateway.orders[order["id"]] = order
+        self.nextOrderId = max(self.nextOrderId, order["id"] + 1)
+
+        self.orderStatus(order, "Submitted" if order["transmit"] else "PreSubmitted")
+
+        if order["transmit"] and not order["parentId"] and \
+                gateway.random.random() < gateway.fillProbability:
+            price = order["lmtPrice"] if order["orderType"] == "LMT" else gateway.price(order["contract"])
+            gateway._schedule(gateway.fillDelay, self.orderStatus, order, "Filled", price)
+
+    # -----------------------------------------
+    # housekeeping
+    # -----------------------------------------
+    def req8(self):
+        """ reqIds """
+        self.reader.fields(2)
+        self.send(NEXT_VALID_ID, 1, max(self.nextOrderId, self.gateway.nextOrderId))
+
+    def req49(self):
+        """ reqCurrentTime """
+        self.reader.field()
+        self.send(CURRENT_TIME, 1, int(time.time()))
+
+    def req5(self):
+        """ reqOpenOrders """
+        self.reader.field()
+        self.send(OPEN_ORDER_END, 1)
+
+    req16 = req5  # reqAllOpenOrders
+
+    def req15(self):
+        """ reqAutoOpenOrders """
+        self.reader.fields(2)
+        self.send(OPEN_ORDER_END, 1)
+
+    def req6(self):
+        """ reqAccountUpdates """
+        _, subscribe, account = self.reader.field(), self.reader.bool(), self.reader.field()
+        if subscribe:
+            self.send(ACCT_DOWNLOAD_END, 1, account or self.gateway.accounts[0])
+
+    def req7(self):
+        """ reqExecutions """
+        self.reader.field()
+        reqId = self.reader.int()
+        self.reader.fields(7)
+        self.send(EXECUTION_DATA_END, 1, reqId)
+
+    def req17(self):
+        """ reqManagedAccts """
+        self.reader.field()
+        self.send(MANAGED_ACCTS, 1, ",".join(self.gateway.accounts))
+
+    def req58(self):
+        """ reqGlobalCancel """
+        self.reader.field()
+        for order in list(self.gateway.orders.values()):
+            self.orderStatus(order, "Cancelled")
+
+    def req61(self):
+        """ reqPositions """
+        self.reader.field()
+        self.send(POSITION_END, 1)
+
+    def req62(self):
+        """ reqAccountSummary """
+        _, reqId, _, _ = self.reader.fields(4)
+        self.send(ACCOUNT_SUMMARY_END, 1, reqId)
+
+    # -----------------------------------------
+    def error(self, reqId, code, text):
+        self.send(ERR_MSG, 2, reqId, code, text)
+
+
+# ---------------------------------------------
+
+class MockGateway(object):
+    """
+    Pure-Python mock of TWS / IB Gateway.
+
+    tickRate:        market data ticks / sec, per subscription
+    depthRate:       market depth updates / sec, per subscription
+    latency:         delay (sec) before answering contract/history/order requests
+    fillProbability: chance a transmitted parent order gets filled
+    fillDelay:       delay (sec) between Submitted and Filled
+    unknownSymbols:  symbols answered with error 200 (no security definition)
+
+    Scripted data: pass `contractDetails(contract) -> [dict, ...]` and/or
+    `historicalBars(request) -> [dict, ...]` to override the random ones.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, serverVersion=SERVER_VERSION,
+                 tickRate=4., depthRate=2., latency=0., fillProbability=1.,
+                 fillDelay=.1, accounts=("DU000001",), unknownSymbols=(),
+                 contractDetails=None, historicalBars=None, seed=None):
+
+        self.host = host
+        self.port = port
+        self.serverVersion = serverVersion
+        self.tickRate = tickRate
+        self.depthRate = depthRate
+        self.latency = latency
+        self.fillProbability = fillProbability
+        self.fillDelay = fillDelay
+        self.accounts = list(accounts)
+        self.unknownSymbols = set(unknownSymbols)
+        self.random = random.Random(seed)
+
+        if contractDetails is not None:
+            self.contractDetails = contractDetails
+        if historicalBars is not None:
+            self.historicalBars = historicalBars
+
+        self.log = logging.getLogger('ezibpy')
+        self.sessions = []
+        self.orders = {}
+        self.nextOrderId = 1
+        self.sent = 0
+
+        self._prices = {}
+        self._volumes = {}
+        self._conIds = {}
+        self._permIds = itertools.count(1000000)
+        self._timers = []  # heap of (due, seq, fn, args)
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._running = False
+        self._server = None
+
+    # -----------------------------------------
+    def start(self):
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((self.host, self.port))
+        self._server.listen(128)
+        self.port = self._server.getsockname()[1]
+        self._running = True
+
+        for target, name in ((self._accept, "accept"), (self._feed, "feed")):
+            thread = threading.Thread(target=target, name="ezibpy-mockgateway-" + name)
+            thread.daemon = True
+            thread.start()
+
+        self.log.info("[MOCK GATEWAY] listening on %s:%s", self.host, self.port)
+        return self
+
+    # -----------------------------------------
+    def stop(self):
+        self._running = False
+        self._wakeup.set()
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        self.dropConnections()
+
+    # -----------------------------------------
+    def dropConnections(self):
+        """ closes every client connection (ie. to test reconnects) """
+        for session in list(self.sessions):
+            session.close()
+
+    # -----------------------------------------
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    # -----------------------------------------
+    def _accept(self):
+        while self._running:
+            try:
+                sock, address = self._server.accept()
+            except OSError:
+                break
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            session = _Session(self, sock, address)
+            with self._lock:
+                self.sessions.append(session)
+            thread = threading.Thread(target=session.run, name="ezibpy-mockgateway-session")
+            thread.daemon = True
+            thread.start()
+
+    # -----------------------------------------
+    def _removeSession(self, session):
+        with self._lock:
+            if session in self.sessions:
+                self.sessions.remove(session)
+
+    # -----------------------------------------
+    def _schedule(self, delay, fn, *args):
+        with self._lock:
+            heapq.heappush(self._timers, (time.monotonic() + delay, next(self._seq), fn, args))
+        self._wakeup.set()
+
+    # -----------------------------------------
+    def _feed(self):
+        """ fires scheduled replies and streams ticks/depth """
+        nextTick = nextDepth = time.monotonic()
+
+        while self._running:
+            now = time.monotonic()
+
+            while True:
+                with self._lock:
+                    if not self._timers or self._timers[0][0] > now:
+                        break
+                    _, _, fn, args = heapq.heappop(self._timers)
+                try:
+                    fn(*args)
+                except Exception as e:
+                    self.log.exception("[MOCK GATEWAY] %s", e)
+
+            sessions = list(self.sessions)
+
+            if self.tickRate and now >= nextTick:
+                nextTick = now + 1. / self.tickRate
+                for session in sessions:
+                    for tickerId, (contract, genericTicks) in list(session.marketData.items()):
+                        session.tick(tickerId, contract, genericTicks=genericTicks)
+
+            if self.depthRate and now >= nextDepth:
+                nextDepth = now + 1. / self.depthRate
+                for session in sessions:
+                    for tickerId, (contract, numRows) in list(session.marketDepth.items()):
+                        session.depth(tickerId, contract, numRows)
+
+            wake = [nextTick if self.tickRate else now + 1, nextDepth if self.depthRate else now + 1]
+            with self._lock:
+                if self._timers:
+                    wake.append(self._timers[0][0])
+            self._wakeup.wait(max(min(wake) - time.monotonic(), 0))
+            self._wakeup.clear()
+
+    # -----------------------------------------
+    # data generators
+    # -----------------------------------------
+    @staticmethod
+    def _key(contract):
+        return (contract["symbol"], contract["secType"], contract["expiry"],
+                contract["strike"], contract["right"])
+
+    def knows(self, contract):
+        return contract["symbol"] not in self.unknownSymbols
+
+    def minTick(self, contract):
+        return .25 if contract["secType"].upper() in ("FUT", "FOP") else .01
+
+    def price(self, contract):
+        """ random walk per contract """
+        key = self._key(contract)
+        price = self._prices.get(key)
+        if price is None:
+            price = self.random.uniform(10, 500) if contract["secType"].upper() not in ("OPT", "FOP") \
+                else self.random.uniform(.5, 20)
+        tick = self.minTick(contract)
+        price = max(tick, round((price + self.random.choice((-tick, 0, tick))) / tick) * tick)
+        self._prices[key] = price
+        return round(price, 4)
+
+    def volume(self, contract, size):
+        key = self._key(contract)
+        self._volumes[key] = self._volumes.get(key, 0) + size
+        return self._volumes[key]
+
+    def contractDetails(self, contract):
+        key = self._key(contract)
+        if key not in self._conIds:
+            self._conIds[key] = 100000 + len(self._conIds)
+
+        secType = contract["secType"].upper()
+        expiry = contract["expiry"]
+        if secType in ("FUT", "OPT", "FOP") and not expiry:
+            expiry = (datetime.now() + timedelta(days=30)).strftime("%Y%m%d")
+
+        localSymbol = contract["localSymbol"] or contract["symbol"]
+        if secType == "CASH":
+            localSymbol = "%s.%s" % (contract["symbol"], contract["currency"])
+        elif secType == "FUT" and not contract["localSymbol"]:
+            localSymbol = "%s%s%s" % (contract["symbol"],
+                                      " FGHJKMNQUVXZ"[int(expiry[4:6])], expiry[3])
+        elif secType in ("OPT", "FOP") and not contract["localSymbol"]:
+            localSymbol = "%-6s%s%s%08d" % (contract["symbol"], expiry[2:8],
+                                            (contract["right"] or "C")[0],
+                                            contract["strike"] * 1000)
+
+        return [{
+            "symbol": contract["symbol"], "secType": contract["secType"],
+            "expiry": expiry, "strike": contract["strike"], "right": contract["right"],
+            "exchange": contract["exchange"], "currency": contract["currency"],
+            "localSymbol": localSymbol, "marketName": contract["symbol"],
+            "tradingClass": contract["tradingClass"] or contract["symbol"],
+            "conId": self._conIds[key], "minTick": self.minTick(contract),
+            "multiplier": contract["multiplier"] or ("100" if secType in ("OPT", "FOP") else ""),
+            "orderTypes": "LMT,MKT,STP,STPLMT,TRAIL", "validExchanges": "SMART",
+            "longName": contract["symbol"], "primaryExch": contract["primaryExch"] if "primaryExch" in contract else "",
+            "contractMonth": expiry[:6], "timeZoneId": "EST",
+            "tradingHours": "", "liquidHours": "",
+        }]
+
+    def historicalBars(self, request):
+        """ random bars covering the requested duration """
+        value, unit = request["barSize"].split()
+        barSeconds = int(value) * BAR_SIZE_SECONDS[unit.lower()]
+        value, unit = request["duration"].split()
+        seconds = int(value) * DURATION_SECONDS[unit.upper()]
+
+        end = datetime.strptime(request["endDateTime"][:17], "%Y%m%d %H:%M:%S") \
+            if request["endDateTime"] else datetime.now()
+        count = max(1, min(seconds // barSeconds, MAX_BARS))
+        start = end - timedelta(seconds=count * barSeconds)
+
+        request["start"] = start.strftime("%Y%m%d  %H:%M:%S")
+        request["end"] = end.strftime("%Y%m%d  %H:%M:%S")
+
+        bars = []
+        for i in range(count):
+            ts = start + timedelta(seconds=i * barSeconds)
+            if barSeconds >= 86400:
+                date = ts.strftime("%Y%m%d")
+            elif request["formatDate"] == 2:
+                date = str(int(time.mktime(ts.timetuple())))
+            else:
+                date = ts.strftime("%Y%m%d  %H:%M:%S")
+
+            prices = [self.price(request["contract"]) for _ in range(4)]
+            bars.append({
+                "date": date, "open": prices[0], "high": max(prices), "low": min(prices),
+                "close": prices[-1], "volume": self.random.randint(1, 1000) * 100,
+                "wap": round(sum(prices) / 4, 4), "count": self.random.randint(1, 500)})
+        return bars
+
+
+# ---------------------------------------------
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Local mock of TWS / IB Gateway")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4001)
+    parser.add_argument("--tick-rate", type=float, default=4., help="ticks/sec per subscription")
+    parser.add_argument("--depth-rate", type=float, default=2., help="depth updates/sec per subscription")
+    parser.add_argument("--latency", type=float, default=0., help="reply delay (sec)")
+    parser.add_argument("--fill-probability", type=float, default=1.)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    gateway = MockGateway(args.host, args.port, tickRate=args.tick_rate,
+                          depthRate=args.depth_rate, latency=args.latency,
+                          fillProbability=args.fill_probability, seed=args.seed).start()
+    try:
+        while True:
+            time.sleep(60)
+            gateway.log.info("[MOCK GATEWAY] %d sessions, %d messages sent",
+                             len(gateway.sessions), gateway.sent)
+    except KeyboardInterrupt:
+        gateway.stop()
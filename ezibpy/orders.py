@@ -0,0 +1,366 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+#
+# ezIBpy: Pythonic Wrapper for IbPy
+# https://github.com/ranaroussi/ezibpy
+#
+# Copyright 2015 Ran Aroussi
+#
+# Licensed under the GNU Lesser General Public License, v3.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.gnu.org/licenses/lgpl-3.0.en.html
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import struct
+import threading
+
+from collections import deque
+from datetime import datetime
+
+from .utils import DATA_DIR, contract_to_dict, open_private, order_to_dict, private_dir
+
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None
+    import msvcrt
+
+
+# ---------------------------------------------
+
+# order ids reserved (on disk) per reservation
+ORDER_ID_BLOCK_SIZE = 100
+
+
+# ---------------------------------------------
+
+class OrderIdAllocator(object):
+    """
+    Hands out order ids from memory, under a lock.
+
+    The highest id ever reserved for a clientId is kept in an 8-byte
+    file, updated under an exclusive file lock, so processes sharing
+    a clientId never hand out the same id. Each process reserves
+    `blockSize` ids at a time (so the file is only touched once per
+    block); IB's nextValidId is honoured via sync().
+
+    The file defaults to ~/.ezibpy/client_<clientId>.oid; it's created
+    0600 and refused if another user owns it or can write to it.
+    """
+
+    def __init__(self, clientId=0, path=None, blockSize=ORDER_ID_BLOCK_SIZE):
+        self._folder = None
+        if path is None:
+            self._folder = DATA_DIR  # created on first reservation
+            path = os.path.join(DATA_DIR, "client_%s.oid" % clientId)
+
+        self.clientId = clientId
+        self.path = path
+        self.blockSize = max(int(blockSize), 1)
+
+        self._lock = threading.Lock()
+        self._next = 1    # next id of the current block
+        self._limit = 1   # end (exclusive) of the current block
+        self._ibNext = 1  # latest nextValidId from IB
+
+    # -----------------------------------------
+    def sync(self, nextValidId):
+        """ honour IB's nextValidId (drops the current block if behind) """
+        with self._lock:
+            nextValidId = int(nextValidId)
+            self._ibNext = max(self._ibNext, nextValidId)
+            if self._next < nextValidId:
+                self._next = self._limit = nextValidId
+
+    # -----------------------------------------
+    def peek(self):
+        """ the id next() would most likely return (no I/O) """
+        return max(self._next, self._ibNext)
+
+    # -----------------------------------------
+    def next(self):
+        with self._lock:
+            if self._next >= self._limit:
+                self._next = self._reserve(self.blockSize)
+                self._limit = self._next + self.blockSize
+
+            orderId = self._next
+            self._next += 1
+            return orderId
+
+    # -----------------------------------------
+    def reserve(self, count):
+        """ reserves `count` consecutive ids (ie. for another process) """
+        with self._lock:
+            start = self._reserve(count)
+            return list(range(start, start + count))
+
+    # -----------------------------------------
+    def _reserve(self, count):
+        if self._folder is not None:
+            private_dir(self._folder)
+            self._folder = None
+
+        fd = open_private(self.path)
+        try:
+            self._lockFile(fd)
+            try:
+                data = os.read(fd, 8)
+                last = struct.unpack("<q", data)[0] if len(data) == 8 else 0
+
+                start = max(last + 1, self._next, self._ibNext)
+
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.write(fd, struct.pack("<q", start + count - 1))
+            finally:
+                self._unlockFile(fd)
+        finally:
+            os.close(fd)
+
+        return start
+
+    # -----------------------------------------
+    @staticmethod
+    def _lockFile(fd):
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_LOCK, 8)
+
+    # -----------------------------------------
+    @staticmethod
+    def _unlockFile(fd):
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 8)
+
+
+# ---------------------------------------------
+
+WORKING_ORDER_STATUSES = ("SENT", "OPENED", "APIPENDING", "PENDINGSUBMIT",
+                          "PRESUBMITTED", "SUBMITTED", "PENDINGCANCEL")
+
+# DROPPED: queued by the pacer but never sent (disconnected)
+TERMINAL_ORDER_STATUSES = ("FILLED", "CANCELLED", "APICANCELLED", "DROPPED")
+
+INDEXED_ORDER_FIELDS = ("symbol", "status", "parentId")
+
+
+# ---------------------------------------------
+
+class OrderRecord(object):
+    """
+    Slotted order record with dict-style access, so existing code
+    (and callbacks) can keep using order["status"] etc.
+    """
+
+    __slots__ = ("id", "symbol", "contract", "order", "status", "reason",
+                 "avgFillPrice", "parentId", "time")
+
+    def __init__(self, id, symbol, contract, order=None, status="SENT",
+                 reason=None, avgFillPrice=0., parentId=0, time=None):
+        self.id           = id
+        self.symbol       = symbol
+        self.contract     = contract
+        self.order        = order
+        self.status       = status
+        self.reason       = reason
+        self.avgFillPrice = avgFillPrice
+        self.parentId     = parentId
+        self.time         = time
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def __eq__(self, other):
+        return dict(self.items()) == dict(other.items()) \
+            if hasattr(other, "items") else NotImplemented
+
+    def __repr__(self):
+        return "OrderRecord(%s)" % dict(self.items())
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+    def keys(self):
+        return list(self.__slots__)
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.__slots__]
+
+    def toJSON(self):
+        """ compact, json-able version (contract/order reduced to non-defaults) """
+        record = dict(self.items())
+        record["contract"] = contract_to_dict(self.contract) if self.contract is not None else None
+        record["order"] = order_to_dict(self.order) if self.order is not None else None
+        record["time"] = self.time.isoformat() if isinstance(self.time, datetime) else self.time
+        return record
+
+
+# ---------------------------------------------
+
+class OrderArchive(object):
+    """
+    Append-only on-disk log (json lines) of terminal orders.
+    Terminal orders are scheduled with schedule() and handed to
+    archive() once `retention` seconds passed.
+    The log is created 0600 and refused if others own/can write to it.
+    """
+
+    def __init__(self, path, retention=60):
+        self.path = path
+        self.retention = retention
+        self._due = deque()  # (deadline, orderId), in deadline order
+        self._lock = threading.Lock()
+
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, mode=0o700, exist_ok=True)
+        os.close(self._open())
+
+    # -----------------------------------------
+    def _open(self):
+        return open_private(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+
+    # -----------------------------------------
+    def schedule(self, orderId, now):
+        self._due.append((now + self.retention, orderId))
+
+    # -----------------------------------------
+    def due(self, now):
+        """ pops the orderIds whose retention expired """
+        orderIds = []
+        while self._due and self._due[0][0] <= now:
+            orderIds.append(self._due.popleft()[1])
+        return orderIds
+
+    # -----------------------------------------
+    def append(self, orders):
+        if not orders:
+            return
+        lines = "".join(json.dumps(order.toJSON(), default=str) + "\n" for order in orders)
+        with self._lock, os.fdopen(self._open(), "a") as f:
+            f.write(lines)
+
+    # -----------------------------------------
+    def query(self, symbol=None, status=None, since=None):
+        """ reads back archived orders as {orderId: dict} (latest wins) """
+        if isinstance(since, datetime):
+            since = since.isoformat()
+
+        orders = {}
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        order = json.loads(line)
+                    except ValueError:
+                        continue  # torn write
+                    if symbol is not None and order["symbol"] != symbol:
+                        continue
+                    if status is not None and order["status"] != status:
+                        continue
+                    if since is not None and (order["time"] or "") < since:
+                        continue
+                    orders[order["id"]] = order
+        except FileNotFoundError:
+            pass
+
+        return orders
+
+
+class OrderIndex(object):
+    """
+    Incrementally maintained order indexes by symbol, status and
+    parentId: {value: {orderId: order}}, sharing the order dicts.
+
+    Every write to an indexed field has to go through add() / update()
+    / remove() so the indexes stay in sync (O(1) per event).
+    """
+
+    def __init__(self):
+        self.bySymbol = {}
+        self.byStatus = {}
+        self.byParent = {}
+        self._indexes = dict(zip(INDEXED_ORDER_FIELDS,
+                                 (self.bySymbol, self.byStatus, self.byParent)))
+
+    # -----------------------------------------
+    def index(self, by):
+        return self._indexes[by]
+
+    # -----------------------------------------
+    def _link(self, field, order):
+        self._indexes[field].setdefault(order.get(field), {})[order["id"]] = order
+
+    # -----------------------------------------
+    def _unlink(self, field, order):
+        index = self._indexes[field]
+        value = order.get(field)
+        bucket = index.get(value)
+        if bucket is not None:
+            bucket.pop(order["id"], None)
+            if not bucket:
+                del index[value]
+
+    # -----------------------------------------
+    def add(self, order):
+        for field in INDEXED_ORDER_FIELDS:
+            self._link(field, order)
+
+    # -----------------------------------------
+    def remove(self, order):
+        for field in INDEXED_ORDER_FIELDS:
+            self._unlink(field, order)
+
+    # -----------------------------------------
+    def update(self, order, fields):
+        """ applies `fields` to `order`, re-indexing what changed """
+        for field, value in fields.items():
+            if field in self._indexes and order.get(field) != value:
+                self._unlink(field, order)
+                order[field] = value
+                self._link(field, order)
+            else:
+                order[field] = value
+
+    # -----------------------------------------
+    def working(self, symbol=None):
+        """ working orders ({orderId: order}), optionally for one symbol """
+        orders = {}
+        if symbol is None:
+            for status in WORKING_ORDER_STATUSES:
+                orders.update(self.byStatus.get(status, {}))
+        else:
+            for orderId, order in self.bySymbol.get(symbol, {}).items():
+                if order["status"] in WORKING_ORDER_STATUSES:
+                    orders[orderId] = order
+        return orders
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+#
+# ezIBpy: Pythonic Wrapper for IbPy
+# https://github.com/ranaroussi/ezibpy
+#
+# Copyright 2015 Ran Aroussi
+#
+# Licensed under the GNU Lesser General Public License, v3.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.gnu.org/licenses/lgpl-3.0.en.html
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+
+# ---------------------------------------------
+
+ORDER_PRIORITY, NORMAL_PRIORITY = 0, 1
+
+# requests that jump the queue (order management)
+ORDER_REQUESTS = ("placeOrder", "cancelOrder", "reqGlobalCancel", "exerciseOptions",
+                  "reqIds", "reqOpenOrders", "reqAllOpenOrders", "reqAutoOpenOrders")
+
+# outgoing API messages besides req*/cancel* calls
+PACED_REQUESTS = ("placeOrder", "exerciseOptions", "calculateImpliedVolatility",
+                  "calculateOptionPrice", "replaceFA", "requestFA", "setServerLogLevel")
+
+
+# ---------------------------------------------
+
+class PacedConnection(object):
+    """
+    Wraps an ib.opt.Connection so every outgoing API message goes
+    through one token bucket: at most `rate` messages/sec on average
+    and `burst` back to back, so no second sees more than rate + burst
+    (IB disconnects clients that exceed 50/sec).
+
+    Calls never block: a message goes out right away when a token is
+    available, otherwise it's queued and sent by the pacer thread.
+    Order requests (ORDER_REQUESTS) are queued ahead of everything
+    else; requests of the same priority keep their order. Requests
+    made while sending (ie. from an error callback IbPy fires
+    synchronously) are queued behind the current one.
+    `onDropped(name, args, kwargs)` is called for every queued request
+    disconnect() discards.
+    Anything else (connect, register, ...) is passed through.
+    """
+
+    def __init__(self, connection, rate=40, burst=10, onDropped=None):
+        self.connection = connection
+        self.rate = rate
+        self.burst = burst
+        self.onDropped = onDropped
+        self.priorities = dict.fromkeys(ORDER_REQUESTS, ORDER_PRIORITY)
+
+        self.sent = 0
+        self.deferred = 0
+        self.dropped = 0
+        self.errors = 0
+        self.maxDepth = 0
+        self.maxWait = 0.  # seconds
+
+        self.log = logging.getLogger('ezibpy')
+        self._tokens = float(burst)
+        self._refilled = time.monotonic()
+        self._queue = []  # heap of (priority, seq, queued, name, args, kwargs)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+        # sends go out one at a time, in ticket order
+        self._tickets = itertools.count()
+        self._turn = 0
+        self._sender = None  # ident of the thread sending right now
+
+    # -----------------------------------------
+    def __getattr__(self, name):
+        attr = getattr(self.connection, name)
+        if not (name.startswith(("req", "cancel")) or name in PACED_REQUESTS):
+            return attr
+
+        def paced(*args, **kwargs):
+            self.request(name, *args, **kwargs)
+        paced.__name__ = name
+        return paced
+
+    # -----------------------------------------
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    # -----------------------------------------
+    def request(self, name, *args, **kwargs):
+        """ send (or queue) connection.<name>(*args, **kwargs) """
+        with self._cond:
+            now = time.monotonic()
+            self._refill(now)
+
+            if self._thread is None and not self._queue and self._tokens >= 1 \
+                    and self._sender != threading.get_ident():
+                self._tokens -= 1
+                self._waitTurn(next(self._tickets))
+            else:
+                heapq.heappush(self._queue, (self.priorities.get(name, NORMAL_PRIORITY),
+                                             next(self._seq), now, name, args, kwargs))
+                self.deferred += 1
+                self.maxDepth = max(self.maxDepth, len(self._queue))
+
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name="ezibpy-pacer", daemon=True)
+                    self._thread.start()
+
+                self._cond.notify_all()
+                return
+
+        self._send(name, args, kwargs)
+
+    # -----------------------------------------
+    def _waitTurn(self, ticket):
+        """ called holding self._cond: waits (releasing it) for our turn to send """
+        while self._turn != ticket:
+            self._cond.wait()
+        self._sender = threading.get_ident()
+
+    # -----------------------------------------
+    def _send(self, name, args, kwargs):
+        """ called after _waitTurn(); hands the turn over when done """
+        try:
+            getattr(self.connection, name)(*args, **kwargs)
+            self.sent += 1
+        except Exception as e:
+            self.errors += 1
+            self.log.error("[REQUEST FAILED] %s: %s", name, e)
+        finally:
+            with self._cond:
+                self._sender = None
+                self._turn += 1
+                self._cond.notify_all()
+
+    # -----------------------------------------
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._queue:
+                        self._thread = None  # restarted by request()
+                        return
+
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self._tokens >= 1:
+                        break
+                    self._cond.wait((1 - self._tokens) / self.rate)
+
+                self._tokens -= 1
+                _, _, queued, name, args, kwargs = heapq.heappop(self._queue)
+                self.maxWait = max(self.maxWait, now - queued)
+                self._waitTurn(next(self._tickets))
+
+            self._send(name, args, kwargs)
+
+    # -----------------------------------------
+    def pending(self):
+        return len(self._queue)
+
+    # -----------------------------------------
+    def stats(self):
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "tokens": self._tokens,
+            "pending": len(self._queue),
+            "sent": self.sent,
+            "deferred": self.deferred,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "maxDepth": self.maxDepth,
+            "maxWait": self.maxWait,
+        }
+
+    # -----------------------------------------
+    def disconnect(self):
+        """ drops queued requests (they can't be sent anymore) """
+        with self._cond:
+            dropped = sorted(self._queue)
+            self.dropped += len(dropped)
+            self._queue = []
+            self._cond.notify_all()
+
+        if self.onDropped is not None:
+            for _, _, _, name, args, kwargs in dropped:
+                try:
+                    self.onDropped(name, args, kwargs)
+                except Exception:
+                    self.log.exception("[REQUEST DROPPED] callback failed for %s", name)
+
+        return self.connection.disconnect()
@@ -22,7 +22,12 @@
 # --------------
 # https://interactivebrokers.github.io/tws-api/historical_bars.html
 # https://interactivebrokers.github.io/tws-api/tick_types.html
+import atexit
 import logging
+import os
+import queue
+
+from logging.handlers import QueueHandler, QueueListener
 
 from ib.ext.Contract import Contract
 from ib.ext.Order import Order
@@ -189,16 +194,140 @@ dataTypes = {
 # ---------------------------------------------
 
 def createLogger(name, level=logging.WARNING):
-    """:Return: a logger with the given `name` and optional `level`."""
+    """:Return: a logger with the given `name` and optional `level`.
+
+    Records are handed over to a queue; a listener thread does the
+    actual (blocking) stream I/O.
+    """
     logger = logging.getLogger(name)
     logger.setLevel(level)
     handler = logging.StreamHandler()
     handler.setFormatter(logging.Formatter('%(asctime)s [%(levelname)s] %(name)s: %(message)s'))
-    logger.addHandler(handler)
+
+    log_queue = queue.Queue(-1)
+    listener = QueueListener(log_queue, handler)
+    listener.start()
+    atexit.register(listener.stop)
+
+    logger.addHandler(QueueHandler(log_queue))
     logger.propagate = False
     return logger
 
 
+# ---------------------------------------------
+
+# per-user directory of ezibpy's files (order ids, journals, caches, ...)
+DATA_DIR = os.path.join(os.path.expanduser("~"), ".ezibpy")
+
+
+def check_private(path, st=None):
+    """ raises ValueError unless `path` is ours and not writable by others """
+    if not hasattr(os, "getuid"):
+        return  # no POSIX ownership (windows)
+
+    st = os.stat(path) if st is None else st
+    if st.st_uid != os.getuid() or st.st_mode & 0o022:
+        raise ValueError("%s must be owned by the current user and "
+                         "not writable by others" % path)
+
+
+def private_dir(path=DATA_DIR):
+    """ creates `path` (and missing parents) 0700 and makes sure it's private """
+    missing = []
+    folder = os.path.abspath(path)
+    while not os.path.isdir(folder):
+        missing.append(folder)
+        folder = os.path.dirname(folder)
+
+    for folder in reversed(missing):
+        try:
+            os.mkdir(folder, 0o700)
+        except FileExistsError:
+            pass
+
+    check_private(path)
+    return path
+
+
+def open_private(path, flags=os.O_RDWR | os.O_CREAT):
+    """
+    os.open() for files only we may touch: new files are created 0600,
+    symlinks and files owned/writable by others are refused
+    """
+    fd = os.open(path, flags | getattr(os, "O_NOFOLLOW", 0), 0o600)
+    try:
+        check_private(path, os.fstat(fd))
+    except ValueError:
+        os.close(fd)
+        raise
+    return fd
+
+
+# ---------------------------------------------
+
+class ServerClock(object):
+    """
+    Local model of IB's clock: a monotonic clock anchored to the wall
+    clock at startup, plus an offset estimated from currentTime replies.
+    now() never touches the network.
+    """
+
+    def __init__(self, smoothing=0.2):
+        self.smoothing = smoothing
+        self.offset = 0.
+        self.synced = None  # monotonic time of the last currentTime reply
+
+        self._wall = time.time()
+        self._mono = time.monotonic()
+        self._sent = None
+
+    # -----------------------------------------
+    def local(self):
+        """ local wall time, advanced by the monotonic clock """
+        return self._wall + (time.monotonic() - self._mono)
+
+    # -----------------------------------------
+    def now(self):
+        """ estimated server time (epoch seconds, sub-ms resolution) """
+        return self.local() + self.offset
+
+    # -----------------------------------------
+    def datetime(self):
+        return datetime.fromtimestamp(self.now())
+
+    # -----------------------------------------
+    def requested(self):
+        """ call when sending reqCurrentTime """
+        self._sent = time.monotonic()
+
+    # -----------------------------------------
+    def update(self, serverTime):
+        """ feed a currentTime reply (whole epoch seconds) """
+        mono = time.monotonic()
+        sent = self._sent if self._sent is not None else mono
+        self._sent = None
+
+        # server stamped the reply somewhere in the round trip and
+        # truncated it to the second: compare the midpoints
+        local = self._wall + ((sent + mono) / 2. - self._mono)
+        offset = float(serverTime) + .5 - local
+
+        if self.synced is None or abs(offset - self.offset) > 1:
+            self.offset = offset
+        else:
+            self.offset += self.smoothing * (offset - self.offset)
+
+        self.synced = mono
+
+    # -----------------------------------------
+    def due(self, interval=300, timeout=5):
+        """ True if a re-sync is due and no request is in flight """
+        mono = time.monotonic()
+        if self._sent is not None and mono - self._sent < timeout:
+            return False
+        return self.synced is None or mono - self.synced > interval
+
+
 # ---------------------------------------------
 
 def order_to_dict(order):
@@ -0,0 +1,365 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+#
+# ezIBpy: Pythonic Wrapper for IbPy
+# https://github.com/ranaroussi/ezibpy
+#
+# Copyright 2015 Ran Aroussi
+#
+# Licensed under the GNU Lesser General Public License, v3.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.gnu.org/licenses/lgpl-3.0.en.html
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import calendar
+import shutil
+import tempfile
+import time
+import unittest
+
+from datetime import datetime, timedelta
+
+import numpy as np
+from pandas import DataFrame, DatetimeIndex
+
+from ib.opt import message
+
+from ezibpy import ezIBpy
+from ezibpy.journal import OfflineConnection
+from ezibpy.history import (
+    HistoricalScheduler, HistoryCache, claimable_ranges, duration_to_seconds, history_chunks,
+    local_to_utc_times, parse_end_datetime, stitch_bars, to_utc, utc_to_local_times
+)
+
+KEY = ("AAPL_STK", "1 min", "TRADES", 0)
+
+
+def day(n, hour=0):
+    return datetime(2018, 1, n, hour)
+
+
+def bars(start, end):
+    """ hourly bars from start to end (inclusive) """
+    index = DatetimeIndex(np.arange(np.datetime64(start, "s"), np.datetime64(end, "s") + 1,
+                                    np.timedelta64(3600, "s")), name="datetime")
+    values = np.arange(len(index), dtype=float)
+    return DataFrame({"O": values, "H": values, "L": values, "C": values,
+                      "V": values.astype(int), "OI": 0, "WAP": values}, index=index)
+
+
+class HistoryCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cache = HistoryCache(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def fill(self, start, end):
+        """ downloads (simulated) whatever the cache says is missing """
+        for range_start, range_end in self.cache.missing(KEY, start, end):
+            self.cache.update(KEY, bars(range_start, range_end), range_start, range_end)
+
+    def test_empty_cache_misses_everything(self):
+        self.assertEqual(self.cache.missing(KEY, day(5), day(6)), [(day(5), day(6))])
+
+    def test_covered_window_is_not_missing(self):
+        self.fill(day(5), day(8))
+        self.assertEqual(self.cache.missing(KEY, day(6), day(7)), [])
+
+    def test_overlapping_windows_only_fetch_the_new_part(self):
+        self.fill(day(5), day(6))
+        self.assertEqual(self.cache.missing(KEY, day(5, 12), day(7)), [(day(6), day(7))])
+        self.assertEqual(self.cache.missing(KEY, day(4), day(5, 12)), [(day(4), day(5))])
+
+    def test_window_after_coverage_fetches_the_gap(self):
+        self.fill(day(5), day(5, 23))
+        self.assertEqual(self.cache.missing(KEY, day(8), day(8, 23)), [(day(5, 23), day(8, 23))])
+
+    def test_window_before_coverage_fetches_the_gap(self):
+        self.fill(day(8), day(8, 23))
+        self.assertEqual(self.cache.missing(KEY, day(5), day(5, 23)), [(day(5), day(8))])
+
+    def test_gap_is_never_reported_as_cached(self):
+        # cache Jan 5, then Jan 8, then ask for Jan 6
+        self.fill(day(5), day(5, 23))
+        self.fill(day(8), day(8, 23))
+        self.assertEqual(self.cache.missing(KEY, day(6), day(6, 23)), [])
+        self.assertEqual(len(self.cache.frame(KEY, day(6), day(6, 23))), 24)
+
+    def test_update_merges_and_deduplicates(self):
+        self.fill(day(5), day(6))
+        self.fill(day(5, 12), day(7))
+        frame = self.cache.frame(KEY)
+        self.assertTrue(frame.index.is_unique)
+        self.assertTrue(frame.index.is_monotonic_increasing)
+        self.assertEqual(len(frame), 49)
+        self.assertEqual(self.cache.coverage(KEY), (day(5), day(7)))
+
+
+class ParseEndDateTimeTest(unittest.TestCase):
+
+    def test_keeps_timezone(self):
+        self.assertEqual(parse_end_datetime("20180105 16:00:00 EST"),
+                         (datetime(2018, 1, 5, 16), " EST"))
+
+    def test_empty_means_now(self):
+        for value in (None, "", "now"):
+            end, tz = parse_end_datetime(value)
+            self.assertEqual(tz, "")
+            self.assertLess(abs(datetime.now() - end), timedelta(seconds=5))
+
+    def test_bad_format_is_reported(self):
+        with self.assertRaises(ValueError) as cm:
+            parse_end_datetime("2018-01-05")
+        self.assertIn("YYYYMMDD HH:MM:SS", str(cm.exception))
+
+
+class HistoryChunksTest(unittest.TestCase):
+
+    def test_duration_to_seconds(self):
+        self.assertEqual(duration_to_seconds("1800 S"), 1800)
+        self.assertEqual(duration_to_seconds("2 d"), 2 * 86400)
+
+    def test_fits_in_one_request(self):
+        self.assertEqual(history_chunks("", "1 D", "1 min"), [("", "1 D")])
+        # bar sizes without a known limit aren't split
+        self.assertEqual(history_chunks("", "5 Y", "7 mins"), [("", "5 Y")])
+
+    def test_splits_newest_first(self):
+        chunks = history_chunks("20180105 16:00:00", "3 D", "1 min")
+        self.assertEqual(chunks, [("20180105 16:00:00", "1 D"),
+                                  ("20180104 16:00:00", "1 D"),
+                                  ("20180103 16:00:00", "1 D")])
+
+    def test_partial_chunk_rounds_up(self):
+        chunks = history_chunks("20180105 16:00:00", "5400 S", "1 secs")
+        self.assertEqual(chunks, [("20180105 16:00:00", "1800 S"),
+                                  ("20180105 15:30:00", "1800 S"),
+                                  ("20180105 15:00:00", "1800 S")])
+
+    def test_keeps_timezone(self):
+        chunks = history_chunks("20180105 16:00:00 EST", "2 D", "1 min")
+        self.assertEqual([end for end, _ in chunks],
+                         ["20180105 16:00:00 EST", "20180104 16:00:00 EST"])
+
+    def test_now(self):
+        chunks = history_chunks("", "2 D", "1 min")
+        self.assertEqual(len(chunks), 2)
+        end = datetime.strptime(chunks[0][0], "%Y%m%d %H:%M:%S")
+        self.assertLess(abs(datetime.now() - end), timedelta(seconds=5))
+
+    def test_stitch_bars(self):
+        older, newer = bars(day(3), day(4)), bars(day(4), day(5))
+        older["C"], newer["C"] = 1., 2.
+        frame = stitch_bars([newer, bars(day(9), day(9)).iloc[:0], older])
+        self.assertTrue(frame.index.is_unique)
+        self.assertTrue(frame.index.is_monotonic_increasing)
+        self.assertEqual(len(frame), 49)
+        # overlapping bars: the last frame passed wins
+        self.assertEqual(frame.loc[day(4), "C"], 1.)
+
+
+class HistoryEventsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ib = ezIBpy()
+        self.ib.ibConn = OfflineConnection()
+        self.contract = self.ib.createContract(("AAPL", "STK", "SMART", "USD", "", 0.0, ""),
+                                               wait=False)
+        self.tickerId = self.ib.tickerId("AAPL")
+
+    def download(self):
+        future = self.ib.requestHistoricalData(self.contract, lookback="1 D")
+        reqId, = self.ib._historyRequests
+        for minute in range(3):
+            self.ib.receiveServerEvent(message.historicalData(
+                reqId=reqId, date="20180105  10:%02d:00" % minute, open=1., high=1.,
+                low=1., close=1., volume=1, count=1, WAP=1., hasGaps=False))
+        self.ib.receiveServerEvent(message.historicalData(
+            reqId=reqId, date="finished-20180104  10:00:00-20180105  10:03:00", open=-1,
+            high=-1, low=-1, close=-1, volume=-1, count=-1, WAP=-1, hasGaps=False))
+        return future.result(timeout=5)
+
+    def test_subscribers_get_history_by_symbol_and_tickerId(self):
+        bySymbol, byTickerId = [], []
+        subscriptions = [
+            self.ib.subscribe(lambda caller, msg, **kw: bySymbol.append(kw),
+                              callers=["handleHistoricalData"], symbols=["AAPL"]),
+            self.ib.subscribe(lambda caller, msg, **kw: byTickerId.append(kw),
+                              callers=["handleHistoricalData"], tickerIds=[self.tickerId]),
+        ]
+        self.assertEqual(len(self.download()), 3)
+        for subscription in subscriptions:
+            self.ib.unsubscribe(subscription, wait=True)
+
+        for events in (bySymbol, byTickerId):
+            self.assertEqual([kw["completed"] for kw in events], [False] * 3 + [True])
+
+    def test_ibCallback_gets_the_contract_tickerId(self):
+        calls = []
+        self.ib.ibCallback = lambda caller, msg, **kw: calls.append(kw.get("tickerId"))
+        self.download()
+        self.assertEqual(calls, [self.tickerId] * 4)
+
+
+class UtcTest(unittest.TestCase):
+
+    def test_to_utc(self):
+        self.assertEqual(to_utc(day(5, 16), " GMT"), day(5, 16))
+        self.assertEqual(to_utc(day(5, 16), " US/Eastern"), day(5, 21))
+        self.assertEqual(to_utc(datetime(2018, 7, 5, 16), "US/Eastern"),
+                         datetime(2018, 7, 5, 20))
+        with self.assertRaises(ValueError):
+            to_utc(day(5), " Nowhere/Special")
+
+    def test_local_times_round_trip(self):
+        local = np.array([datetime(2018, month, 5, 12) for month in range(1, 13)], dtype="M8[s]")
+        utc = local_to_utc_times(local)
+        self.assertEqual(utc.tolist(), [to_utc(dt) for dt in local.tolist()])
+        self.assertTrue((utc_to_local_times(utc) == local).all())
+        self.assertEqual(len(local_to_utc_times(local[:0])), 0)
+
+    def test_claimable_ranges(self):
+        ranges = [(day(1), day(2)), (day(3), day(4)), (day(4), day(5))]
+        # nothing cached: grow from the newest range
+        self.assertEqual(claimable_ranges(ranges), ranges[1:])
+        # or from the coverage
+        self.assertEqual(claimable_ranges(ranges, (day(2), day(3))), ranges)
+        self.assertEqual(claimable_ranges(ranges, (day(7), day(8))), [])
+        self.assertEqual(claimable_ranges([]), [])
+
+
+class HistoryJobCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.ib = ezIBpy()
+        self.ib.ibConn = OfflineConnection()
+        self.ib.enableHistoryCache(self.path)
+        self.contract = self.ib.createContract(("AAPL", "STK", "SMART", "USD", "", 0.0, ""),
+                                               wait=False)
+        self.key = ("AAPL", "1 min", "TRADES", 0)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def download(self, end_datetime, lookback, failed=()):
+        """ answers every chunk with one bar an hour before its end; fails `failed` """
+        future = self.ib.requestHistoricalData(self.contract, lookback=lookback,
+                                               end_datetime=end_datetime)
+        for index, reqId in enumerate(sorted(self.ib._historyRequests)):
+            if index in failed:
+                self.ib.receiveServerEvent(message.error(
+                    id=reqId, errorCode=162, errorMsg="HMDS query returned no data"))
+                continue
+
+            end = self.ib._historyRequests[reqId]["cacheRange"][1]
+            stamp = calendar.timegm((end - timedelta(hours=1)).timetuple())
+            for date in (str(stamp), "finished"):
+                self.ib.receiveServerEvent(message.historicalData(
+                    reqId=reqId, date=date, open=1., high=1., low=1., close=1.,
+                    volume=1, count=1, WAP=1., hasGaps=False))
+        return future.result(timeout=5)
+
+    def test_coverage_is_utc(self):
+        df = self.download("20180105 16:00:00 US/Eastern", "1 D")
+        self.assertEqual(self.ib.historyCache.coverage(self.key), (day(4, 21), day(5, 21)))
+        self.assertEqual(len(df), 1)
+
+        # the same window, asked for in another timezone, is served from the cache
+        future = self.ib.requestHistoricalData(self.contract, lookback="1 D",
+                                               end_datetime="20180105 21:00:00 GMT")
+        self.assertTrue(future.done())
+        self.assertEqual(future.result().index.tolist(), df.index.tolist())
+
+    def test_failed_chunk_keeps_the_newer_ones(self):
+        # chunks are newest first: the oldest one fails
+        df = self.download("20180105 00:00:00 GMT", "3 D", failed=(2,))
+        self.assertEqual(self.ib.historyCache.coverage(self.key), (day(3), day(5)))
+        self.assertEqual(len(df), 2)
+        self.assertEqual(len(self.ib.historyCache.frame(self.key)), 2)
+
+    def test_failed_chunk_never_claims_a_gap(self):
+        df = self.download("20180105 00:00:00 GMT", "3 D", failed=(1,))
+        self.assertEqual(self.ib.historyCache.coverage(self.key), (day(4), day(5)))
+        # the older chunk's bars are still returned, just not cached
+        self.assertEqual(len(df), 2)
+        self.assertEqual(len(self.ib.historyCache.frame(self.key)), 1)
+
+
+class HistoricalSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sent = []
+        self.scheduler = HistoricalScheduler(lambda request: self.sent.append(request["reqId"]),
+                                             max_requests=2, period=600)
+
+    def submit(self, reqIds, barSize):
+        for reqId in reqIds:
+            self.scheduler.submit({"reqId": reqId, "identity": ("AAPL", barSize, reqId),
+                                   "contractKey": ("AAPL", "SMART", "TRADES"),
+                                   "barSizeSetting": barSize})
+
+    def wait_for(self, count, timeout=2):
+        deadline = time.monotonic() + timeout
+        while len(self.sent) < count and time.monotonic() < deadline:
+            time.sleep(0.005)
+
+    def test_small_bars_are_paced(self):
+        self.submit(range(4), "5 secs")
+        self.wait_for(4, timeout=0.2)
+        self.assertEqual(self.sent, [0, 1])
+        self.assertEqual(self.scheduler.pending(), 2)
+
+    def test_larger_bars_are_not_paced(self):
+        # more than max_requests, and they don't use up the budget
+        self.submit(range(4), "1 min")
+        self.wait_for(4)
+        self.submit(range(4, 6), "5 secs")
+        self.wait_for(6)
+        self.assertEqual(self.sent, list(range(6)))
+
+    def test_configure(self):
+        self.submit(range(4), "1 min")
+        self.wait_for(4)
+        self.scheduler.configure(max_requests=3, paced_bar_sizes=["1 min"])
+        self.submit(range(4, 8), "1 min")
+        self.wait_for(8, timeout=0.2)
+        self.assertEqual(self.sent, list(range(7)))
+
+        with self.assertRaises(ValueError):
+            self.scheduler.configure(max_request=5)
+
+
+class HistoryWindowTest(unittest.TestCase):
+
+    def test_chunked_download_is_trimmed_to_lookback(self):
+        ib = ezIBpy()
+        ib.ibConn = OfflineConnection()
+        contract = ib.createContract(("AAPL", "STK", "SMART", "USD", "", 0.0, ""), wait=False)
+
+        # 2 chunks of 1800 secs; the oldest reaches 1600 secs past the lookback
+        future = ib.requestHistoricalData(contract, resolution="1 secs", lookback="2000 S",
+                                          end_datetime="20180105 12:00:00 GMT")
+        end = calendar.timegm(day(5, 12).timetuple())
+        for reqId, stamp in zip(sorted(ib._historyRequests), (end - 100, end - 3500)):
+            for date in (str(stamp), "finished"):
+                ib.receiveServerEvent(message.historicalData(
+                    reqId=reqId, date=date, open=1., high=1., low=1., close=1.,
+                    volume=1, count=1, WAP=1., hasGaps=False))
+
+        df = future.result(timeout=5)
+        self.assertEqual(df.index.tolist(), [datetime.fromtimestamp(end - 100)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+#
+# ezIBpy: Pythonic Wrapper for IbPy
+# https://github.com/ranaroussi/ezibpy
+#
+# Copyright 2015 Ran Aroussi
+#
+# Licensed under the GNU Lesser General Public License, v3.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.gnu.org/licenses/lgpl-3.0.en.html
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from ib.ext.Contract import Contract
+from ib.opt import message
+
+from ezibpy.journal import CONTRACT_RECORD, MessageJournal, read_journal
+from ezibpy.utils import private_dir
+
+POSIX = hasattr(os, "getuid")
+
+
+def tick(price):
+    return message.tickPrice(tickerId=1, field=1, price=price, canAutoExecute=1)
+
+
+class MessageJournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "test.journal")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def record(self, prices, append=False):
+        journal = MessageJournal(self.path, append)
+        for price in prices:
+            journal.record(tick(price), received=price)
+        return journal
+
+    def prices(self):
+        return [msg.price for _, msg in read_journal(self.path)]
+
+    def test_roundtrip(self):
+        journal = self.record([1., 2.])
+        contract = Contract()
+        contract.m_symbol = "AAPL"
+        journal.recordContract(1, "AAPL", contract)
+        journal.close()
+
+        records = list(read_journal(self.path))
+        self.assertEqual([received for received, _ in records[:2]], [1., 2.])
+        self.assertEqual(records[1][1].price, 2.)
+        self.assertEqual(records[2][1].typeName, CONTRACT_RECORD)
+        self.assertEqual(records[2][1].contract.m_symbol, "AAPL")
+
+    def test_existing_file_needs_append(self):
+        self.record([1.]).close()
+        with self.assertRaises(FileExistsError):
+            MessageJournal(self.path)
+
+        self.record([2.], append=True).close()
+        self.assertEqual(self.prices(), [1., 2.])
+
+    def test_not_a_journal(self):
+        with open(self.path, "wb") as f:
+            f.write(b"not a journal")
+        with self.assertRaises(ValueError):
+            list(read_journal(self.path))
+
+    @unittest.skipUnless(POSIX, "POSIX permissions")
+    def test_file_is_private(self):
+        self.record([1.]).close()
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+
+        os.chmod(self.path, 0o666)
+        with self.assertRaises(ValueError):
+            MessageJournal(self.path, append=True)
+
+
+class PrivateDirTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    @unittest.skipUnless(POSIX, "POSIX permissions")
+    def test_creates_parents_private(self):
+        path = os.path.join(self.folder, "data", "journals")
+        self.assertEqual(private_dir(path), path)
+        for folder in (path, os.path.dirname(path)):
+            self.assertEqual(stat.S_IMODE(os.stat(folder).st_mode), 0o700)
+
+    @unittest.skipUnless(POSIX, "POSIX permissions")
+    def test_refuses_writable_by_others(self):
+        os.chmod(self.folder, 0o777)
+        with self.assertRaises(ValueError):
+            private_dir(self.folder)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+#
+# ezIBpy: Pythonic Wrapper for IbPy
+# https://github.com/ranaroussi/ezibpy
+#
+# Copyright 2015 Ran Aroussi
+#
+# Licensed under the GNU Lesser General Public License, v3.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.gnu.org/licenses/lgpl-3.0.en.html
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import time
+import unittest
+
+from ezibpy.lines import MarketDataLines
+
+
+class LinesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sent = []
+        self.lines = self.create()
+
+    def tearDown(self):
+        self.lines.close()
+
+    def create(self, **kwargs):
+        # a long interval keeps the rotating thread out of the way
+        kwargs.setdefault("interval", 60)
+        return MarketDataLines(lambda action, tickerId: self.sent.append((action, tickerId)),
+                               **kwargs)
+
+    def actions(self, action):
+        return [tickerId for sent, tickerId in self.sent if sent == action]
+
+
+class MarketDataLinesTest(LinesTest):
+
+    def create(self, **kwargs):
+        return LinesTest.create(self, maxLines=4, snapshotLines=2, refresh=10,
+                                rejectBackoff=0.2, **kwargs)
+
+    def test_streams_everything_within_lines(self):
+        self.lines.watch([1, 2, 3, 4])
+        self.assertEqual(sorted(self.actions("stream")), [1, 2, 3, 4])
+        self.assertEqual(self.lines.streaming, {1, 2, 3, 4})
+
+    def test_priority_streams_and_rest_rotates(self):
+        self.lines.watch([1, 2, 3, 4, 5, 6])
+        self.lines.watch([6], priority=1)
+        self.assertEqual(self.lines.streaming, {6, 1})
+        self.assertEqual(self.actions("cancel"), [2])
+
+        with self.lines._cond:
+            actions = self.lines._rotate(time.monotonic())
+        self.assertEqual(actions, [("snapshot", 2), ("snapshot", 3)])
+
+        # answered snapshots aren't due again until `refresh` passes
+        self.lines.snapshotEnd(2)
+        self.lines.snapshotEnd(3)
+        with self.lines._cond:
+            actions = self.lines._rotate(time.monotonic())
+        self.assertEqual(actions, [("snapshot", 4), ("snapshot", 5)])
+
+    def test_unwatch_cancels(self):
+        self.lines.watch([1, 2])
+        self.lines.unwatch([2])
+        self.assertEqual(self.actions("cancel"), [2])
+        self.assertEqual(self.lines.streaming, {1})
+
+    def test_rejected_line_is_parked(self):
+        lines = self.lines = LinesTest.create(self, maxLines=10, snapshotLines=2,
+                                              rejectBackoff=0.2)
+        lines.watch(range(1, 9))
+        self.assertEqual(len(lines.streaming), 8)
+
+        lines.lineRejected(1)
+        self.assertEqual(lines.maxLines, 7)
+        self.assertEqual(lines.streaming, {2, 3, 4, 5, 6})
+        self.assertEqual(self.actions("stream").count(1), 1)
+
+        # the free lines go to the others' snapshots, not to 1
+        with lines._cond:
+            actions = lines._rotate(time.monotonic()) + lines._rebalance()
+        self.assertEqual(actions, [("snapshot", 7), ("snapshot", 8)])
+        self.assertEqual(lines.stats()["parked"], 1)
+
+        # back in once the backoff is over
+        time.sleep(0.25)
+        with lines._cond:
+            actions = lines._rebalance()
+        self.assertEqual(sorted(actions), [("cancel", 6), ("stream", 1)])
+
+    def test_repeated_rejections_back_off(self):
+        lines = self.lines = LinesTest.create(self, maxLines=10, snapshotLines=2,
+                                              rejectBackoff=0.2)
+        lines.watch([1, 2])
+        lines.lineRejected(1)
+        first = lines.parked[1][0] - time.monotonic()
+
+        time.sleep(0.25)
+        lines.watch([])  # rebalances: 1 streams again
+        self.assertIn(1, lines.streaming)
+        lines.lineRejected(1)
+        second = lines.parked[1][0] - time.monotonic()
+        self.assertGreater(second, first * 1.5)
+        self.assertEqual(lines.parked[1][1], 2)
+
+        # data for the symbol means the line works again
+        lines.touch(1)
+        self.assertNotIn(1, lines.parked)
+
+    def test_unknown_rejection_is_ignored(self):
+        self.lines.watch([1])
+        self.lines.lineRejected(9)
+        self.assertEqual(self.lines.maxLines, 4)
+        self.assertEqual(self.lines.rejected, 0)
+
+
+class MarketDepthSlotsTest(LinesTest):
+
+    def create(self, **kwargs):
+        return LinesTest.create(self, depthSlots=2, depthRefresh=10,
+                                rejectBackoff=0.2, **kwargs)
+
+    def test_pins_top_and_rotates_last_slot(self):
+        self.lines.watchDepth([1, 2, 3])
+        self.assertEqual(sorted(self.lines.depthStreaming), [1, 2])
+
+        # rotation happens once the last slot has had its turn
+        self.lines.depthStreaming[2] -= 11
+        with self.lines._cond:
+            actions = self.lines._rebalanceDepth(time.monotonic())
+        self.assertEqual(actions, [("cancelDepth", 2), ("depth", 3)])
+
+    def test_rejected_depth_is_parked(self):
+        self.lines.watchDepth([1, 2])
+        self.lines.depthRejected(1)
+        self.assertEqual(self.lines.depthSlots, 1)
+        self.assertEqual(self.actions("depth").count(1), 1)
+
+        with self.lines._cond:
+            self.lines._rebalanceDepth(time.monotonic())
+        self.assertNotIn(1, self.lines.depthStreaming)
+        self.assertEqual(self.lines.stats()["depthParked"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+#
+# ezIBpy: Pythonic Wrapper for IbPy
+# https://github.com/ranaroussi/ezibpy
+#
+# Copyright 2015 Ran Aroussi
+#
+# Licensed under the GNU Lesser General Public License, v3.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.gnu.org/licenses/lgpl-3.0.en.html
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+
+from ezibpy.marketdata import DepthBook, DepthBoard, L2Book
+
+BID, ASK = 1, 0
+INSERT, UPDATE, DELETE = DepthBook.INSERT, DepthBook.UPDATE, DepthBook.DELETE
+
+
+class DepthBookTest(unittest.TestCase):
+
+    def setUp(self):
+        self.book = DepthBook(depth=3)
+
+    def prices(self, side):
+        rows = self.book.bids if side == BID else self.book.asks
+        return [tuple(row) for row in rows]
+
+    def test_insert_shifts_rows_down(self):
+        self.book.update(0, INSERT, BID, 10., 100)
+        self.book.update(0, INSERT, BID, 11., 200)
+        self.book.update(1, INSERT, BID, 10.5, 300)
+        self.assertEqual(self.prices(BID), [(11., 200), (10.5, 300), (10., 100)])
+
+        # the last row falls off a full book
+        self.book.update(0, INSERT, BID, 12., 50)
+        self.assertEqual(self.prices(BID), [(12., 50), (11., 200), (10.5, 300)])
+        self.assertEqual(self.prices(ASK), [(0, 0)] * 3)
+
+    def test_update_replaces_row(self):
+        self.book.update(0, INSERT, ASK, 10., 100)
+        self.book.update(0, UPDATE, ASK, 10., 150)
+        self.assertEqual(self.prices(ASK)[0], (10., 150))
+
+    def test_delete_shifts_rows_up(self):
+        for position, price in enumerate((10., 11., 12.)):
+            self.book.update(position, INSERT, ASK, price, 100)
+        self.book.update(0, DELETE, ASK, 0, 0)
+        self.assertEqual(self.prices(ASK), [(11., 100), (12., 100), (0, 0)])
+
+    def test_out_of_range_position_is_ignored(self):
+        self.book.update(3, INSERT, BID, 10., 100)
+        self.book.update(-1, UPDATE, BID, 10., 100)
+        self.assertEqual(self.prices(BID), [(0, 0)] * 3)
+
+    def test_top_and_frame(self):
+        self.book.update(0, INSERT, BID, 9.9, 100)
+        self.book.update(0, INSERT, ASK, 10.1, 200)
+        bid, ask = self.book.top()
+        self.assertEqual((bid[0], ask[1]), (9.9, 200))
+
+        frame = self.book.frame()
+        self.assertEqual(list(frame.columns), ["bid", "bidsize", "ask", "asksize"])
+        self.assertEqual(len(frame), 3)
+        self.assertEqual(frame["asksize"][0], 200)
+
+
+class DepthBoardTest(unittest.TestCase):
+
+    def test_books_per_ticker(self):
+        board = DepthBoard(depth=5)
+        self.assertIn(0, board)  # template book
+
+        board.setDepth(1, 2)
+        board.book(1).update(0, INSERT, BID, 10., 100)
+        self.assertEqual(board.book(1).depth, 2)
+        self.assertEqual(board[1]["bid"][0], 10.)
+        self.assertEqual(len(board), 2)
+
+        # changing the depth resets the book
+        board.setDepth(1, 4)
+        self.assertEqual(len(board[1]), 4)
+        self.assertEqual(board[1]["bid"][0], 0)
+
+
+class L2BookTest(unittest.TestCase):
+
+    def setUp(self):
+        self.book = L2Book(depth=4)
+        self.book.update(0, INSERT, BID, 10., 100, "ARCA")
+        self.book.update(1, INSERT, BID, 10., 200, "NSDQ")
+        self.book.update(2, INSERT, BID, 9.9, 300, "ARCA")
+        self.book.update(0, INSERT, ASK, 10.1, 100, "NSDQ")
+
+    def test_consolidates_by_price(self):
+        self.assertEqual(self.book.bestBid(), (10., 300))
+        self.assertEqual(self.book.bestAsk(), (10.1, 100))
+        self.assertEqual(self.book.sizeAt(BID, 9.9), 300)
+
+        frame = self.book.consolidated()
+        self.assertEqual(list(frame["bid"]), [10., 9.9])
+        self.assertEqual(list(frame["bidsize"]), [300, 300])
+        self.assertEqual(list(frame["ask"]), [10.1, 0.])
+
+    def test_per_venue(self):
+        self.assertEqual(sorted(self.book.venues()), ["ARCA", "NSDQ"])
+        self.assertEqual(self.book.venue("ARCA"), {"bid": [(10., 100), (9.9, 300)], "ask": []})
+        self.assertEqual(self.book.venue("NSDQ")["ask"], [(10.1, 100)])
+        self.assertEqual(self.book.venue("IEX"), {"bid": [], "ask": []})
+
+    def test_update_replaces_venue_size(self):
+        self.book.update(1, UPDATE, BID, 10., 50, "NSDQ")
+        self.assertEqual(self.book.bestBid(), (10., 150))
+        self.assertEqual(self.book.venue("NSDQ")["bid"], [(10., 50)])
+
+        # a row can change hands
+        self.book.update(1, UPDATE, BID, 10., 50, "IEX")
+        self.assertEqual(self.book.venue("NSDQ")["bid"], [])
+        self.assertEqual(self.book.venue("IEX")["bid"], [(10., 50)])
+        self.assertEqual(self.book.sizeAt(BID, 10.), 150)
+
+    def test_delete_removes_level(self):
+        self.book.update(0, DELETE, BID, 0, 0, "")
+        self.book.update(0, DELETE, BID, 0, 0, "")
+        self.assertEqual(self.book.bestBid(), (9.9, 300))
+        self.assertEqual(self.book.sizeAt(BID, 10.), 0)
+        self.assertEqual(self.book.venue("NSDQ")["bid"], [])
+
+        self.book.update(0, DELETE, ASK, 0, 0, "")
+        self.assertEqual(self.book.bestAsk(), (0., 0))
+
+    def test_row_falling_off_leaves_consolidated_view(self):
+        self.book.update(0, INSERT, BID, 10.2, 10, "IEX")
+        self.book.update(0, INSERT, BID, 10.3, 10, "IEX")  # pushes 9.9 out
+        self.assertEqual(self.book.sizeAt(BID, 9.9), 0)
+        self.assertEqual(self.book.venue("ARCA")["bid"], [(10., 100)])
+        self.assertEqual(list(self.book.consolidated(levels=2)["bid"]), [10.3, 10.2])
+
+    def test_board_upgrades_to_l2(self):
+        board = DepthBoard(depth=4)
+        board.book(1)
+        self.assertIsInstance(board.book(1, l2=True), L2Book)
+        self.assertIsInstance(board.book(1), L2Book)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+#
+# ezIBpy: Pythonic Wrapper for IbPy
+# https://github.com/ranaroussi/ezibpy
+#
+# Copyright 2015 Ran Aroussi
+#
+# Licensed under the GNU Lesser General Public License, v3.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.gnu.org/licenses/lgpl-3.0.en.html
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from ezibpy.orders import OrderArchive, OrderIdAllocator, OrderIndex, OrderRecord
+
+
+class OrderIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = OrderIndex()
+        self.parent = OrderRecord(1, "AAPL", None, status="SUBMITTED")
+        self.child = OrderRecord(2, "AAPL", None, status="PRESUBMITTED", parentId=1)
+        self.other = OrderRecord(3, "MSFT", None, status="FILLED")
+        for order in (self.parent, self.child, self.other):
+            self.index.add(order)
+
+    def test_add(self):
+        self.assertEqual(sorted(self.index.bySymbol["AAPL"]), [1, 2])
+        self.assertIs(self.index.bySymbol["AAPL"][1], self.parent)
+        self.assertEqual(list(self.index.byParent[1]), [2])
+        self.assertEqual(list(self.index.index("status")["FILLED"]), [3])
+
+    def test_update_moves_between_buckets(self):
+        self.index.update(self.child, {"status": "FILLED", "avgFillPrice": 10.})
+        self.assertEqual(self.child["avgFillPrice"], 10.)
+        self.assertNotIn("PRESUBMITTED", self.index.byStatus)
+        self.assertEqual(sorted(self.index.byStatus["FILLED"]), [2, 3])
+
+        # unchanged values don't touch the indexes
+        self.index.update(self.child, {"symbol": "AAPL"})
+        self.assertEqual(sorted(self.index.bySymbol["AAPL"]), [1, 2])
+
+    def test_remove_drops_empty_buckets(self):
+        self.index.remove(self.other)
+        self.assertNotIn("MSFT", self.index.bySymbol)
+        self.assertNotIn("FILLED", self.index.byStatus)
+        self.index.remove(self.other)  # removing twice is harmless
+
+    def test_working(self):
+        self.assertEqual(sorted(self.index.working()), [1, 2])
+        self.assertEqual(self.index.working("MSFT"), {})
+
+        self.index.update(self.parent, {"status": "CANCELLED"})
+        self.assertEqual(list(self.index.working("AAPL")), [2])
+        self.assertEqual(list(self.index.working()), [2])
+
+
+class OrderIdAllocatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "client_1.oid")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_blocks_are_shared_between_allocators(self):
+        first = OrderIdAllocator(1, path=self.path, blockSize=10)
+        second = OrderIdAllocator(1, path=self.path, blockSize=10)
+        self.assertEqual([first.next() for _ in range(3)], [1, 2, 3])
+        self.assertEqual(second.next(), 11)
+        self.assertEqual(second.reserve(5), [21, 22, 23, 24, 25])
+        self.assertEqual(first.next(), 4)
+
+    def test_sync_honours_nextValidId(self):
+        allocator = OrderIdAllocator(1, path=self.path, blockSize=10)
+        allocator.next()
+        allocator.sync(500)
+        self.assertEqual(allocator.peek(), 500)
+        self.assertEqual(allocator.next(), 500)
+
+    @unittest.skipUnless(hasattr(os, "getuid"), "POSIX permissions")
+    def test_file_is_private(self):
+        OrderIdAllocator(1, path=self.path).next()
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+
+        # a file others can write to is refused
+        os.chmod(self.path, 0o666)
+        with self.assertRaises(ValueError):
+            OrderIdAllocator(1, path=self.path).next()
+
+
+class OrderArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "orders", "client_1.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_due_after_retention(self):
+        archive = OrderArchive(self.path, retention=60)
+        archive.schedule(1, now=100)
+        archive.schedule(2, now=130)
+        self.assertEqual(archive.due(159), [])
+        self.assertEqual(archive.due(160), [1])
+        self.assertEqual(archive.due(200), [2])
+
+    def test_append_and_query(self):
+        archive = OrderArchive(self.path)
+        archive.append([OrderRecord(1, "AAPL", None, status="FILLED"),
+                        OrderRecord(2, "MSFT", None, status="CANCELLED")])
+        archive.append([OrderRecord(1, "AAPL", None, status="FILLED", avgFillPrice=10.)])
+
+        self.assertEqual(sorted(archive.query()), [1, 2])
+        self.assertEqual(archive.query(symbol="AAPL")[1]["avgFillPrice"], 10.)
+        self.assertEqual(list(archive.query(status="CANCELLED")), [2])
+
+    @unittest.skipUnless(hasattr(os, "getuid"), "POSIX permissions")
+    def test_file_is_private(self):
+        OrderArchive(self.path)
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+
+        os.chmod(self.path, 0o666)
+        with self.assertRaises(ValueError):
+            OrderArchive(self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
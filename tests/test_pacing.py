@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+#
+# ezIBpy: Pythonic Wrapper for IbPy
+# https://github.com/ranaroussi/ezibpy
+#
+# Copyright 2015 Ran Aroussi
+#
+# Licensed under the GNU Lesser General Public License, v3.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.gnu.org/licenses/lgpl-3.0.en.html
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+import threading
+import time
+import unittest
+
+from ezibpy.pacing import PacedConnection
+
+
+class FakeConnection(object):
+    """ records (time, name, args); sends take up to `jitter` seconds """
+
+    def __init__(self, jitter=0):
+        self.jitter = jitter
+        self.calls = []
+        self.disconnected = False
+
+    def _record(self, name, *args):
+        if self.jitter:
+            time.sleep(random.random() * self.jitter)
+        self.calls.append((time.monotonic(), name, args))
+
+    def reqMktData(self, *args):
+        self._record("reqMktData", *args)
+
+    def placeOrder(self, *args):
+        self._record("placeOrder", *args)
+
+    def disconnect(self):
+        self.disconnected = True
+
+
+class BlockingConnection(FakeConnection):
+    """ holds the send of `blocked` until release is set """
+
+    def __init__(self, blocked):
+        FakeConnection.__init__(self)
+        self.blocked = blocked
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def reqMktData(self, *args):
+        if args[0] == self.blocked:
+            self.entered.set()
+            self.release.wait(5)
+        self._record("reqMktData", *args)
+
+
+class ErroringConnection(FakeConnection):
+    """ reports reqMktData failures synchronously, like IbPy's #504 """
+
+    def __init__(self, onError):
+        FakeConnection.__init__(self)
+        self.onError = onError
+
+    def reqMktData(self, *args):
+        self._record("reqMktData", *args)
+        self.onError(*args)
+
+    def reqCurrentTime(self):
+        self._record("reqCurrentTime")
+
+
+def wait_for(conn, count, timeout=5):
+    deadline = time.monotonic() + timeout
+    while len(conn.calls) < count and time.monotonic() < deadline:
+        time.sleep(0.005)
+
+
+class PacedConnectionTest(unittest.TestCase):
+
+    def test_same_priority_keeps_order(self):
+        # a tight bucket keeps flipping between the inline and queued
+        # paths, so inline sends race the pacer thread's sends
+        conn = FakeConnection(jitter=0.0005)
+        paced = PacedConnection(conn, rate=2000, burst=3)
+        for i in range(300):
+            paced.reqMktData(i)
+            if i % 7 == 0:
+                time.sleep(0.001)
+        wait_for(conn, 300)
+        self.assertEqual([args[0] for _, _, args in conn.calls], list(range(300)))
+        self.assertGreater(paced.deferred, 0)
+
+    def test_inline_send_waits_for_pacer_send(self):
+        conn = BlockingConnection(blocked=1)
+        paced = PacedConnection(conn, rate=100, burst=1)
+        paced.reqMktData(0)  # inline, empties the bucket
+        paced.reqMktData(1)  # queued, sent by the pacer thread
+        self.assertTrue(conn.entered.wait(5))
+
+        # the queue is empty and a token is back while 1 is still being sent
+        time.sleep(0.05)
+        sender = threading.Thread(target=paced.reqMktData, args=(2,))
+        sender.start()
+        time.sleep(0.05)
+        conn.release.set()
+        sender.join(5)
+
+        wait_for(conn, 3)
+        self.assertEqual([args[0] for _, _, args in conn.calls], [0, 1, 2])
+
+    def test_orders_jump_the_queue(self):
+        conn = FakeConnection()
+        paced = PacedConnection(conn, rate=50, burst=1)
+        paced.reqMktData(0)  # inline, empties the bucket
+        for i in range(1, 4):
+            paced.reqMktData(i)
+        paced.placeOrder(99)
+        wait_for(conn, 5)
+        self.assertEqual([args[0] for _, _, args in conn.calls], [0, 99, 1, 2, 3])
+
+    def test_rate_and_burst(self):
+        conn = FakeConnection()
+        rate, burst = 100, 5
+        paced = PacedConnection(conn, rate=rate, burst=burst)
+        for i in range(60):
+            paced.reqMktData(i)
+        wait_for(conn, 60)
+        self.assertEqual(len(conn.calls), 60)
+
+        # no 100ms window sees more than its share plus the burst
+        times = [t for t, _, _ in conn.calls]
+        for i, start in enumerate(times):
+            inside = sum(1 for t in times[i:] if t < start + 0.1)
+            self.assertLessEqual(inside, rate * 0.1 + burst + 1)
+
+    def test_disconnect_drops_queue(self):
+        conn = FakeConnection()
+        paced = PacedConnection(conn, rate=1, burst=1)
+        for i in range(5):
+            paced.reqMktData(i)
+        paced.disconnect()
+        time.sleep(0.05)
+        self.assertTrue(conn.disconnected)
+        self.assertEqual(paced.pending(), 0)
+        self.assertEqual(paced.stats()["dropped"], 4)
+        self.assertEqual(len(conn.calls), 1)
+
+    def test_request_from_error_callback(self):
+        paced = None
+
+        def onError(*args):
+            paced.reqCurrentTime()  # ie. ibCallback reacting to handleError
+
+        conn = ErroringConnection(onError)
+        paced = PacedConnection(conn, rate=100, burst=5)
+
+        # tokens to spare: the nested request could go out inline
+        sender = threading.Thread(target=lambda: (paced.reqMktData(1), paced.reqMktData(2)),
+                                  daemon=True)
+        sender.start()
+        sender.join(5)
+        self.assertFalse(sender.is_alive())
+
+        wait_for(conn, 4)
+        self.assertEqual([name for _, name, _ in conn.calls],
+                         ["reqMktData", "reqCurrentTime", "reqMktData", "reqCurrentTime"])
+
+        # and the pacer keeps going
+        paced.reqMktData(3)
+        wait_for(conn, 6)
+        self.assertEqual(len(conn.calls), 6)
+
+    def test_disconnect_reports_dropped(self):
+        dropped = []
+        conn = FakeConnection()
+        paced = PacedConnection(conn, rate=1, burst=1,
+                                onDropped=lambda name, args, kwargs: dropped.append((name, args)))
+        paced.reqMktData(0)
+        paced.reqMktData(1)
+        paced.placeOrder(7)
+        paced.disconnect()
+        self.assertEqual(dropped, [("placeOrder", (7,)), ("reqMktData", (1,))])
+
+    def test_send_errors_are_counted(self):
+        paced = PacedConnection(object(), rate=10, burst=2)
+        # not a paced name: passed through untouched
+        with self.assertRaises(AttributeError):
+            paced.connect
+        paced.request("reqMktData", 1)
+        self.assertEqual(paced.stats()["errors"], 1)
+        # the turn was handed over: the next request doesn't hang
+        paced.request("reqMktData", 2)
+        self.assertEqual(paced.stats()["errors"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()